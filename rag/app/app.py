@@ -1,14 +1,37 @@
 import json
 import os
+import time
 from pathlib import Path
-from groq import Groq
 
 import gradio as gr
-import torch
-from transformers import AutoTokenizer, AutoModelForTokenClassification
-from huggingface_hub import hf_hub_download, upload_file, InferenceClient
-
-from dynamic_rag_luxnlp import DynamicLuxRAG, build_ner_prompt
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
+from huggingface_hub import upload_file
+
+from document_segmentation import segment_document
+from dynamic_rag_luxnlp import (
+    COMPACT_NER_SYSTEM_MESSAGE,
+    NER_SYSTEM_MESSAGE,
+    DynamicLuxRAG,
+    IncrementalBIOParser,
+    build_compact_ner_prompt,
+    build_ner_prompt,
+    entities_to_bio,
+    normalize_llm_bio_output,
+    parse_bio_block,
+)
+from instrumentation import format_timings, metrics
+from llm_backends import CircuitOpenError, LLMError, backend_from_env
+from llm_cache import LLMResponseCache
+from llm_health import HealthProber, LLMHealth
+from memory_sync import MemorySync
+from model_loader import load_token_classifier, parse_lengths
+from ner_api import create_ner_router
+from ner_metrics import align_labels, spans_from_bio
+from parallel_branches import run_branches
+from prediction_cache import PredictionCache
+from xlmr_tagger import format_bio, tag_batch, tag_words
 
 # =========================
 # CONFIG
@@ -17,51 +40,119 @@ DATA_PATH = "Lux_Final.conll"
 MEMORY_PATH = "rag_memory.jsonl"
 APPROVED_PATH = "approved_examples.jsonl"
 MODEL_REPO = "YashGavade10/luxnlp-xlmr-ner"
+MODEL_REVISION = os.getenv("MODEL_REVISION", "").strip() or None
 DATASET_REPO = "YashGavade10/luxnlp-rag-memory"
 METRICS_PATH = "metrics.json"
 
+# Memory files are served from a local cache; the Hub is only waited on for
+# MEMORY_STARTUP_TIMEOUT seconds and re-checked every MEMORY_REFRESH_INTERVAL.
+MEMORY_CACHE_DIR = os.getenv("MEMORY_CACHE_DIR", ".memory_cache")
+MEMORY_STARTUP_TIMEOUT = float(os.getenv("MEMORY_STARTUP_TIMEOUT", "5"))
+MEMORY_REFRESH_INTERVAL = float(os.getenv("MEMORY_REFRESH_INTERVAL", "600"))
+
+# XLM-R runtime config
+XLMR_NUM_THREADS = int(os.getenv("XLMR_NUM_THREADS", "0") or 0)
+XLMR_WARMUP_LENGTHS = parse_lengths(os.getenv("XLMR_WARMUP_LENGTHS", "8,32,128"))
+XLMR_WARMUP_BATCH = int(os.getenv("XLMR_WARMUP_BATCH", "1"))
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "2048"))
+XLMR_BATCH_SIZE = int(os.getenv("XLMR_BATCH_SIZE", "32"))
+# Inputs longer than XLMR_MAX_LENGTH subwords are tagged in windows that
+# overlap by XLMR_WINDOW_STRIDE subwords (0 = truncate, extra words get "O")
+XLMR_MAX_LENGTH = int(os.getenv("XLMR_MAX_LENGTH", "512"))
+XLMR_WINDOW_STRIDE = int(os.getenv("XLMR_WINDOW_STRIDE", "128"))
+# "viterbi" (BIO-constrained, always valid BIO) or "argmax"
+XLMR_DECODE = os.getenv("XLMR_DECODE", "viterbi").strip().lower()
+
+# Batch JSON API (/api/ner) request limits
+API_MAX_SENTENCES = int(os.getenv("API_MAX_SENTENCES", "5000"))
+API_MAX_WORDS = int(os.getenv("API_MAX_WORDS", "512"))
+API_MAX_RAG_SENTENCES = int(os.getenv("API_MAX_RAG_SENTENCES", "32"))
+# Document mode (Document tab and /api/ner "document"): longest accepted text
+API_MAX_DOCUMENT_CHARS = int(os.getenv("API_MAX_DOCUMENT_CHARS", "100000"))
+
+# Per-branch deadlines (seconds) for the Compare / ensemble paths
+RAG_BRANCH_TIMEOUT = float(os.getenv("RAG_BRANCH_TIMEOUT", "30"))
+XLMR_BRANCH_TIMEOUT = float(os.getenv("XLMR_BRANCH_TIMEOUT", "30"))
+
+# Confidence cascade: only call retrieval + LLM when some XLM-R token margin
+# falls below the threshold (calibrate with calibrate_cascade.py on dev.conll)
+CASCADE_ENABLED = os.getenv("CASCADE_ENABLED", "false").strip().lower() in {"1", "true", "yes"}
+CASCADE_MARGIN_THRESHOLD = float(os.getenv("CASCADE_MARGIN_THRESHOLD", "0.9"))
+
+# Prompt format: "bio" (token<TAB>tag examples) or "compact" (inline entity
+# brackets, entity-list answer, examples packed into a token budget)
+PROMPT_FORMAT = os.getenv("PROMPT_FORMAT", "bio").strip().lower()
+COMPACT_EXAMPLE_BUDGET = int(os.getenv("COMPACT_EXAMPLE_BUDGET", "600"))
+COMPACT_CANDIDATES = int(os.getenv("COMPACT_CANDIDATES", "20"))
+
+# Append per-request stage timings to the prediction mode text
+SHOW_STAGE_TIMINGS = os.getenv("SHOW_STAGE_TIMINGS", "false").strip().lower() in {"1", "true", "yes"}
+
 # Real LLM config from Space secrets
 HF_API_TOKEN = os.getenv("HF_TOKEN", "").strip()
-HF_LLM_MODEL = os.getenv("HF_LLM_MODEL", "meta-llama/Meta-Llama-3-8B-Instruct").strip()
-
 GROQ_API_KEY = os.getenv("GROQ_API_KEY", "").strip()
-client = Groq(api_key=GROQ_API_KEY) if GROQ_API_KEY else None
+
+# LLM backend: LLM_PROVIDER=groq (default) | hf | openai, see llm_backends.py
+llm = backend_from_env()
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "20"))
+
+# Stream the Dynamic RAG answer line by line and stop once every token is tagged
+LLM_STREAMING = os.getenv("LLM_STREAMING", "true").strip().lower() in {"1", "true", "yes"}
+
+# Background health probe shared by the debug tab and the circuit breaker
+LLM_HEALTH_INTERVAL = float(os.getenv("LLM_HEALTH_INTERVAL", "60"))
+llm_health = LLMHealth()
+llm_prober = HealthProber(llm, llm_health, interval=LLM_HEALTH_INTERVAL).start()
+
+# Persistent LLM response cache (prompts are deterministic at temperature 0)
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite")
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "50000"))
+llm_cache = LLMResponseCache(LLM_CACHE_PATH, ttl_seconds=LLM_CACHE_TTL, max_entries=LLM_CACHE_MAX_ENTRIES)
 
 # =========================
 # LOAD DATASET MEMORY FROM HF DATASET REPO
 # =========================
-def ensure_memory_files():
-    for filename in [MEMORY_PATH, APPROVED_PATH]:
-        try:
-            downloaded = hf_hub_download(
-                repo_id=DATASET_REPO,
-                repo_type="dataset",
-                filename=filename,
-                token=HF_API_TOKEN if HF_API_TOKEN else None,
-            )
-            Path(filename).write_text(
-                Path(downloaded).read_text(encoding="utf-8"),
-                encoding="utf-8"
-            )
-        except Exception:
-            if not Path(filename).exists():
-                Path(filename).write_text("", encoding="utf-8")
-
-
-ensure_memory_files()
+memory_sync = MemorySync(
+    DATASET_REPO,
+    [MEMORY_PATH, APPROVED_PATH],
+    cache_dir=MEMORY_CACHE_DIR,
+    token=HF_API_TOKEN if HF_API_TOKEN else None,
+)
+memory_synced_at_startup = memory_sync.sync_at_startup(MEMORY_STARTUP_TIMEOUT)
 
 # =========================
 # LOAD DYNAMIC RAG
 # =========================
 rag = DynamicLuxRAG(DATA_PATH, MEMORY_PATH)
 
+
+def on_memory_update(changed):
+    if MEMORY_PATH in changed:
+        with memory_sync.lock:
+            rag.reload_memory()
+        print(f"Reloaded dynamic memory: {len(rag.memory_examples)} sentences")
+
+
+# A startup refresh that missed the deadline reloads the index once it lands.
+memory_sync.subscribe(on_memory_update, replay=not memory_synced_at_startup)
+memory_sync.start_background(MEMORY_REFRESH_INTERVAL)
+
 # =========================
 # LOAD XLM-R MODEL
 # =========================
-tokenizer = AutoTokenizer.from_pretrained(MODEL_REPO)
-model = AutoModelForTokenClassification.from_pretrained(MODEL_REPO)
-model.eval()
+tokenizer, model = load_token_classifier(
+    MODEL_REPO,
+    revision=MODEL_REVISION,
+    num_threads=XLMR_NUM_THREADS or None,
+    warmup_lengths=XLMR_WARMUP_LENGTHS,
+    warmup_batch_size=XLMR_WARMUP_BATCH,
+)
 id2label = model.config.id2label
+model_revision = getattr(model.config, "_commit_hash", None) or MODEL_REVISION or "main"
+
+# Shared by the XLM-R tab, the RAG fallback and the Compare tab
+prediction_cache = PredictionCache(max_size=PREDICTION_CACHE_SIZE)
 
 
 # =========================
@@ -88,61 +179,51 @@ def format_retrieval_results(results):
     return "\n\n" + ("\n" + "-" * 70 + "\n\n").join(blocks)
 
 
-def parse_bio_block(text):
-    tokens = []
-    tags = []
-
-    for line in (text or "").strip().splitlines():
-        line = line.strip()
-        if not line:
-            continue
-
-        parts = line.split("\t")
-        if len(parts) < 2:
-            parts = line.split()
-
-        if len(parts) < 2:
-            continue
-
-        token = parts[0].strip()
-        tag = parts[-1].strip()
-
-        if token:
-            tokens.append(token)
-            tags.append(tag)
-
-    return tokens, tags
-
-
-def normalize_llm_bio_output(raw_text: str):
+def xlmr_predict_words(words):
     """
-    Try to keep only BIO lines in format: token<TAB>tag
-    Accepts lines with spaces too.
+    Cached XLM-R prediction: (labels, margins) for pre-split words.
     """
-    raw_text = (raw_text or "").strip()
-    if not raw_text:
-        return ""
-
-    cleaned = []
-    for line in raw_text.splitlines():
-        line = line.strip()
-        if not line:
-            continue
+    key = PredictionCache.make_key(model_revision, words)
 
-        parts = line.split("\t")
-        if len(parts) < 2:
-            parts = line.split()
+    cached = prediction_cache.get(key)
+    if cached is not None:
+        metrics.inc("prediction_cache", "hit")
+        return cached
 
-        if len(parts) < 2:
-            continue
+    metrics.inc("prediction_cache", "miss")
+    result = tag_words(
+        model, tokenizer, words, max_length=XLMR_MAX_LENGTH, stride=XLMR_WINDOW_STRIDE, decode=XLMR_DECODE
+    )
+    prediction_cache.put(key, result)
+    return result
 
-        token = parts[0].strip()
-        tag = parts[-1].strip()
 
-        if token and tag:
-            cleaned.append(f"{token}\t{tag}")
+def xlmr_predict_batch(word_lists):
+    """
+    Cached batched XLM-R prediction; only cache misses go through the model.
+    """
+    keys = [PredictionCache.make_key(model_revision, words) for words in word_lists]
+    results = [prediction_cache.get(key) for key in keys]
+
+    misses = [i for i, cached in enumerate(results) if cached is None]
+    metrics.inc("prediction_cache", "hit", len(results) - len(misses))
+    metrics.inc("prediction_cache", "miss", len(misses))
+
+    if misses:
+        tagged = tag_batch(
+            model,
+            tokenizer,
+            [word_lists[i] for i in misses],
+            batch_size=XLMR_BATCH_SIZE,
+            max_length=XLMR_MAX_LENGTH,
+            stride=XLMR_WINDOW_STRIDE,
+            decode=XLMR_DECODE,
+        )
+        for i, result in zip(misses, tagged):
+            prediction_cache.put(keys[i], result)
+            results[i] = result
 
-    return "\n".join(cleaned)
+    return results
 
 
 def predict_xlmr(sentence: str):
@@ -151,122 +232,255 @@ def predict_xlmr(sentence: str):
         return "Please enter a sentence."
 
     words = sentence.split()
+    labels, _ = xlmr_predict_words(words)
+    return format_bio(words, labels)
 
-    inputs = tokenizer(
-        words,
-        is_split_into_words=True,
-        return_tensors="pt",
-        truncation=True,
-        padding=False,
-    )
-
-    with torch.no_grad():
-        outputs = model(**inputs)
 
-    predictions = torch.argmax(outputs.logits, dim=-1)[0].tolist()
-    word_ids = inputs.word_ids()
-
-    result = []
-    previous_word_idx = None
-
-    for token_idx, word_idx in enumerate(word_ids):
-        if word_idx is None:
-            continue
-        if word_idx == previous_word_idx:
-            continue
-
-        label_id = predictions[token_idx]
-        label = id2label[label_id]
-        result.append(f"{words[word_idx]}\t{label}")
-        previous_word_idx = word_idx
+def predict_document(text: str):
+    """
+    Split a pasted document into sentences, tokenize them like the training
+    data and tag all of them in one batched XLM-R pass.
+    Returns (entity list with character offsets, BIO per sentence).
+    """
+    text = text or ""
+    if not text.strip():
+        return "Please enter a text.", ""
+    if len(text) > API_MAX_DOCUMENT_CHARS:
+        return f"Text is too long ({len(text)} characters, limit {API_MAX_DOCUMENT_CHARS}).", ""
+
+    with metrics.stage("document_segment"):
+        sentences = segment_document(text)
+    tagged = xlmr_predict_batch([s.tokens for s in sentences])
+
+    entities = []
+    bio_blocks = []
+    for sentence, (labels, _) in zip(sentences, tagged):
+        for start, end, typ in spans_from_bio(labels):
+            char_start, char_end = sentence.offsets[start][0], sentence.offsets[end - 1][1]
+            entities.append(f"{char_start}-{char_end}\t{typ}\t{text[char_start:char_end]}")
+        bio_blocks.append(format_bio(sentence.tokens, labels))
+
+    summary = f"{len(sentences)} sentences, {len(entities)} entities"
+    return "\n".join([summary, ""] + entities), "\n\n".join(bio_blocks)
+
+
+def ner_messages(prompt, system_message=NER_SYSTEM_MESSAGE):
+    return [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": prompt},
+    ]
 
-    return "\n".join(result)
 
-def call_llm_for_ner(prompt):
-    if not GROQ_API_KEY or client is None:
-        print("GROQ_API_KEY not found")
+def call_llm_for_ner(prompt, postprocess=normalize_llm_bio_output, system_message=NER_SYSTEM_MESSAGE):
+    """
+    postprocess turns the raw answer into token<TAB>tag lines; the compact
+    prompt format passes a converter from entity lists back to BIO together
+    with COMPACT_NER_SYSTEM_MESSAGE.
+    """
+    cached = llm_cache.get(llm.model, system_message, prompt)
+    if cached is not None:
+        metrics.inc("llm_cache", "hit")
+        return cached
+    metrics.inc("llm_cache", "miss")
+
+    if not llm.available:
+        print(f"LLM backend {llm.provider} is not configured")
         return None
 
+    start = time.perf_counter()
     try:
-        response = client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a Luxembourgish named entity recognition system. "
-                        "Return BIO tags only. "
-                        "Output exactly one token per line in this format: token<TAB>tag. "
-                        "Do not explain anything."
-                    )
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            temperature=0.0,
-        )
+        with metrics.stage("llm"):
+            content = llm.chat(ner_messages(prompt, system_message), temperature=0.0, deadline=LLM_DEADLINE)
+    except CircuitOpenError:
+        # Fail fast: provider is known to be down, go straight to the XLM-R fallback.
+        metrics.inc("llm_errors", "circuit_open")
+        return None
+    except LLMError as e:
+        metrics.inc("llm_errors", "error")
+        llm_health.record(False, time.perf_counter() - start, str(e))
+        print(f"LLM error: {e}")
+        return None
 
-        content = response.choices[0].message.content.strip()
-        normalized = normalize_llm_bio_output(content)
+    llm_health.record(True, time.perf_counter() - start)
 
-        return normalized if normalized else content
+    normalized = postprocess(content)
 
-    except Exception as e:
-        print(f"Groq error: {e}")
-        return None
+    # Only well-formed BIO answers are worth replaying.
+    if normalized:
+        llm_cache.put(llm.model, system_message, prompt, normalized)
 
-def check_llm_status():
-    lines = [
+    return normalized if normalized else content
+
+
+def stream_llm_for_ner(prompt, expected_lines, timings=None):
+    """
+    Yield the growing token<TAB>tag answer as lines complete. The stream is
+    closed as soon as expected_lines lines are parsed, so trailing chatter
+    from the model is never generated. When the LLM fails, or the stream
+    ends with fewer lines than expected, the last yielded text is incomplete
+    and the call is recorded as a failure.
+    """
+    cached = llm_cache.get(llm.model, NER_SYSTEM_MESSAGE, prompt)
+    if cached is not None:
+        metrics.inc("llm_cache", "hit")
+        yield cached
+        return
+    metrics.inc("llm_cache", "miss")
+
+    if not llm.available:
+        print(f"LLM backend {llm.provider} is not configured")
+        return
+
+    parser = IncrementalBIOParser(expected_lines)
+    first_line = None
+    start = time.perf_counter()
+    def is_complete(text):
+        check = IncrementalBIOParser(expected_lines)
+        check.feed(text)
+        check.finish()
+        return check.complete
+
+    stream = llm.stream_chat(
+        ner_messages(prompt), temperature=0.0, deadline=LLM_DEADLINE, is_complete=is_complete
+    )
+    try:
+        for delta in stream:
+            if parser.feed(delta):
+                if first_line is None:
+                    first_line = time.perf_counter() - start
+                    metrics.observe("llm_first_line", first_line, timings)
+                yield parser.text()
+            if parser.complete:
+                break
+        else:
+            if parser.finish():
+                yield parser.text()
+    except CircuitOpenError:
+        metrics.inc("llm_errors", "circuit_open")
+        return
+    except LLMError as e:
+        metrics.inc("llm_errors", "error")
+        llm_health.record(False, time.perf_counter() - start, str(e))
+        print(f"LLM error: {e}")
+        return
+    finally:
+        stream.close()
+
+    metrics.observe("llm", time.perf_counter() - start, timings)
+    llm_health.record(True, time.perf_counter() - start)
+
+    # Truncated answers are not cached; the next call gets a fresh attempt.
+    if parser.complete:
+        llm_cache.put(llm.model, NER_SYSTEM_MESSAGE, prompt, parser.text())
+
+
+def describe_llm():
+    return [
         f"GROQ_API_KEY loaded: {'Yes' if bool(GROQ_API_KEY) else 'No'}",
-        "LLM provider: Groq",
-        "LLM model: llama-3.1-8b-instant",
+        f"LLM provider: {llm.provider}",
+        f"LLM model: {llm.model}",
+        f"LLM circuit: {llm.breaker.state}",
     ]
 
-    if not GROQ_API_KEY or client is None:
-        lines.append("LLM test call: Failed")
-        lines.append("Error: GROQ_API_KEY secret is missing.")
-        return "\n".join(lines)
 
-    try:
-        response = client.chat.completions.create(
-            model="llama-3.1-8b-instant",
-            messages=[
-                {"role": "system", "content": "Reply with OK only."},
-                {"role": "user", "content": "OK"}
-            ],
-            temperature=0.0,
-        )
+def check_llm_status():
+    """
+    Reads the shared health state maintained by the background prober and by
+    real prediction calls; no network call is made here.
+    """
+    lines = describe_llm()
 
-        reply = response.choices[0].message.content.strip()
-        lines.append("LLM test call: Success")
-        lines.append(f"LLM response: {reply}")
+    if not llm.available:
+        lines.append("LLM status: Not configured")
+        lines.append(f"Error: {llm.provider} backend is not configured (missing API key?).")
+        return "\n".join(lines)
 
-    except Exception as e:
-        lines.append("LLM test call: Failed")
-        lines.append(f"Error: {type(e).__name__}: {e}")
+    snapshot = llm_health.snapshot()
+    if snapshot["samples"] == 0:
+        status = "Unknown (no calls yet)"
+    elif llm.breaker.state == "open":
+        status = "Down (circuit open, requests use XLM-R fallback)"
+    elif snapshot["last_success"] and (
+        not snapshot["last_failure"] or snapshot["last_success"] >= snapshot["last_failure"]
+    ):
+        status = "Up"
+    else:
+        status = "Degraded"
 
+    lines.append(f"LLM status: {status}")
+    lines.append(f"Probe interval: {LLM_HEALTH_INTERVAL:.0f}s")
+    lines.append(llm_health.format())
     return "\n".join(lines)
 
-    
-def predict_rag(query: str, results):
+
+def predict_rag(query: str, k: int = 3, fallback: bool = True, cascade: bool = False):
     """
     True RAG flow:
     retrieve -> build prompt -> call LLM
     fallback to XLM-R if LLM fails
+
+    With cascade=True XLM-R runs first and retrieval + LLM are skipped when every
+    token margin is at least CASCADE_MARGIN_THRESHOLD.
+
+    With fallback=False a failed LLM call returns None as prediction, so callers
+    that already run XLM-R in parallel can reuse that output instead.
+
+    Returns (retrieved examples, prediction, prompt, mode).
     """
-    prompt = build_ner_prompt(query, results)
-    llm_output = call_llm_for_ner(prompt)
+    if cascade:
+        words = query.split()
+        labels, margins = xlmr_predict_words(words)
+        if margins and min(margins) >= CASCADE_MARGIN_THRESHOLD:
+            return [], format_bio(words, labels), "", "xlmr_confident"
+
+    if PROMPT_FORMAT == "compact":
+        with metrics.stage("retrieval"):
+            candidates = rag.retrieve(query, k=max(int(k), COMPACT_CANDIDATES))
+        with metrics.stage("prompt_build"):
+            prompt, results = build_compact_ner_prompt(query, candidates, COMPACT_EXAMPLE_BUDGET)
+        words = query.split()
+        llm_output = call_llm_for_ner(
+            prompt,
+            postprocess=lambda content: entities_to_bio(content, words),
+            system_message=COMPACT_NER_SYSTEM_MESSAGE,
+        )
+    else:
+        with metrics.stage("retrieval"):
+            results = rag.retrieve(query, k=int(k))
+        with metrics.stage("prompt_build"):
+            prompt = build_ner_prompt(query, results)
+        llm_output = call_llm_for_ner(prompt)
 
     if llm_output and str(llm_output).strip():
         rag_prediction = str(llm_output).strip()
         mode = "real_llm"
-    else:
+    elif fallback:
         rag_prediction = predict_xlmr(query)
         mode = "fallback_xlmr"
+    else:
+        rag_prediction = None
+        mode = "fallback_xlmr"
 
-    return rag_prediction, prompt, mode
+    return results, rag_prediction, prompt, mode
+
+
+def rag_tag_words(words, k=3):
+    """
+    RAG prediction for the batch API: (labels aligned to words, mode).
+    """
+    _, prediction, _, mode = predict_rag(" ".join(words), k)
+    _, tags = parse_bio_block(prediction or "")
+    return align_labels(words, tags), mode
+
+
+def describe_mode(mode: str, prefix: str = "Prediction mode") -> str:
+    if mode == "real_llm":
+        return f"{prefix}: Real LLM"
+    if mode == "xlmr_confident":
+        return f"{prefix}: XLM-R (confident, LLM skipped by cascade)"
+    if mode == "fallback_xlmr_incomplete":
+        return f"{prefix}: Fallback to XLM-R (LLM answer incomplete)"
+    return f"{prefix}: Fallback to XLM-R (LLM unavailable or failed)"
 
 
 def show_memory_status():
@@ -277,9 +491,10 @@ def show_memory_status():
         f"Memory file: {MEMORY_PATH}\n"
         f"Approved file: {APPROVED_PATH}\n"
         f"Dataset repo: {DATASET_REPO}\n"
-        f"GROQ_API_KEY loaded: {'Yes' if GROQ_API_KEY else 'No'}\n"
-        f"LLM provider: Groq\n"
-        f"LLM model: llama-3.1-8b-instant"
+        f"{memory_sync.format_status()}\n"
+        + "\n".join(describe_llm()) + "\n"
+        f"{prediction_cache.format_stats()}\n"
+        f"{llm_cache.format_stats()}"
     )
 
 
@@ -287,14 +502,16 @@ def sync_file_to_dataset_repo(local_file, repo_file):
     if not HF_API_TOKEN:
         raise RuntimeError("HF_TOKEN secret is missing. Cannot sync to dataset repo.")
 
-    upload_file(
-        path_or_fileobj=local_file,
-        path_in_repo=repo_file,
-        repo_id=DATASET_REPO,
-        repo_type="dataset",
-        token=HF_API_TOKEN,
-        commit_message=f"Update {repo_file} from Space",
-    )
+    with metrics.stage("memory_sync"):
+        commit = upload_file(
+            path_or_fileobj=local_file,
+            path_in_repo=repo_file,
+            repo_id=DATASET_REPO,
+            repo_type="dataset",
+            token=HF_API_TOKEN,
+            commit_message=f"Update {repo_file} from Space",
+        )
+    memory_sync.mark_uploaded(repo_file, revision=getattr(commit, "oid", None))
 
 
 def add_prediction_to_memory(predicted_bio):
@@ -307,26 +524,29 @@ def add_prediction_to_memory(predicted_bio):
         return "Invalid BIO prediction format."
 
     try:
-        added = rag.add_example(tokens, tags)
-        if not added:
-            return "Example already exists in base dataset or memory."
-
-        approved_path = Path(APPROVED_PATH)
-        with approved_path.open("a", encoding="utf-8") as f:
-            f.write(
-                json.dumps(
-                    {
-                        "tokens": tokens,
-                        "tags": tags,
-                        "text": " ".join(tokens),
-                        "source": "approved",
-                    },
-                    ensure_ascii=False,
-                ) + "\n"
-            )
-
-        sync_file_to_dataset_repo(MEMORY_PATH, MEMORY_PATH)
-        sync_file_to_dataset_repo(APPROVED_PATH, APPROVED_PATH)
+        # Held until the upload finishes so a background refresh cannot
+        # replace the files between the local append and the push.
+        with memory_sync.lock:
+            added = rag.add_example(tokens, tags)
+            if not added:
+                return "Example already exists in base dataset or memory."
+
+            approved_path = Path(APPROVED_PATH)
+            with approved_path.open("a", encoding="utf-8") as f:
+                f.write(
+                    json.dumps(
+                        {
+                            "tokens": tokens,
+                            "tags": tags,
+                            "text": " ".join(tokens),
+                            "source": "approved",
+                        },
+                        ensure_ascii=False,
+                    ) + "\n"
+                )
+
+            sync_file_to_dataset_repo(MEMORY_PATH, MEMORY_PATH)
+            sync_file_to_dataset_repo(APPROVED_PATH, APPROVED_PATH)
 
         return (
             f"Added to memory and synced to dataset repo.\n"
@@ -341,25 +561,24 @@ def run_static_rag(query, k):
     if not query:
         return "Please enter a Luxembourgish sentence.", ""
 
-    base_results = rag.retrieve_from_base(query, k=int(k))
-    prompt = build_ner_prompt(query, base_results)
+    with metrics.stage("retrieval"):
+        base_results = rag.retrieve_from_base(query, k=int(k))
+    with metrics.stage("prompt_build"):
+        prompt = build_ner_prompt(query, base_results)
 
     return format_retrieval_results(base_results), prompt
 
 
-def run_dynamic_rag(query, k):
+def run_dynamic_rag(query, k, cascade=False):
     query = (query or "").strip()
     if not query:
         return "Please enter a Luxembourgish sentence.", "", "", ""
 
-    dynamic_results = rag.retrieve(query, k=int(k))
-    rag_prediction, prompt, mode = predict_rag(query, dynamic_results)
-
-    mode_text = (
-        "Prediction mode: Real LLM"
-        if mode == "real_llm"
-        else "Prediction mode: Fallback to XLM-R (LLM unavailable or failed)"
-    )
+    with metrics.request() as timings:
+        dynamic_results, rag_prediction, prompt, mode = predict_rag(query, k, cascade=bool(cascade))
+    mode_text = describe_mode(mode)
+    if SHOW_STAGE_TIMINGS:
+        mode_text += "\n" + format_timings(timings)
 
     return (
         format_retrieval_results(dynamic_results),
@@ -369,26 +588,109 @@ def run_dynamic_rag(query, k):
     )
 
 
+def run_dynamic_rag_stream(query, k, cascade=False):
+    """
+    Generator version of run_dynamic_rag for the Gradio tab: retrieval and the
+    prompt are shown immediately, then the prediction fills in line by line.
+    Compact prompts answer with entity lists, which cannot be shown per token,
+    so they (and LLM_STREAMING=false) use the blocking path.
+    """
+    query = (query or "").strip()
+    if not query or not LLM_STREAMING or PROMPT_FORMAT == "compact":
+        yield run_dynamic_rag(query, k, cascade)
+        return
+
+    # Gradio may resume the generator on another thread, so timings are
+    # collected in an explicit dict rather than through metrics.request().
+    timings = {}
+    start = time.perf_counter()
+
+    def finish(mode):
+        mode_text = describe_mode(mode)
+        if SHOW_STAGE_TIMINGS:
+            timings["total"] = time.perf_counter() - start
+            mode_text += "\n" + format_timings(timings)
+        return mode_text
+
+    words = query.split()
+    if cascade:
+        with metrics.stage("xlmr", timings):
+            labels, margins = xlmr_predict_words(words)
+        if margins and min(margins) >= CASCADE_MARGIN_THRESHOLD:
+            yield "", "", format_bio(words, labels), finish("xlmr_confident")
+            return
+
+    with metrics.stage("retrieval", timings):
+        results = rag.retrieve(query, k=int(k))
+    retrieved = format_retrieval_results(results)
+    with metrics.stage("prompt_build", timings):
+        prompt = build_ner_prompt(query, results)
+    yield retrieved, prompt, "", "Prediction mode: Waiting for LLM..."
+
+    partial = ""
+    for partial in stream_llm_for_ner(prompt, expected_lines=len(words), timings=timings):
+        yield retrieved, prompt, partial, "Prediction mode: Real LLM (streaming)"
+
+    # A mid-stream error, the deadline or a short answer leaves fewer lines
+    # than tokens; that partial answer is replaced by XLM-R, not shown as the LLM's.
+    _, tags = parse_bio_block(partial)
+    if len(tags) >= len(words):
+        yield retrieved, prompt, partial, finish("real_llm")
+    else:
+        with metrics.stage("xlmr", timings):
+            fallback = predict_xlmr(query)
+        yield retrieved, prompt, fallback, finish("fallback_xlmr_incomplete" if tags else "fallback_xlmr")
+
+
 def compare_approaches(query, k):
     query = (query or "").strip()
     if not query:
         return "Please enter a sentence.", "", "", ""
 
-    rag_results = rag.retrieve(query, k=int(k))
-    rag_prediction, prompt, mode = predict_rag(query, rag_results)
-    xlmr_output = predict_xlmr(query)
+    def rag_branch():
+        return predict_rag(query, k, fallback=False)
+
+    # LLM round-trip and XLM-R forward run concurrently; latency is the slower branch.
+    with metrics.request() as timings:
+        branches = run_branches(
+            {"rag": rag_branch, "xlmr": lambda: predict_xlmr(query)},
+            timeouts={"rag": RAG_BRANCH_TIMEOUT, "xlmr": XLMR_BRANCH_TIMEOUT},
+        )
+    rag_branch_result = branches["rag"]
+    xlmr_branch_result = branches["xlmr"]
 
-    mode_text = (
-        "RAG mode: Real LLM"
-        if mode == "real_llm"
-        else "RAG mode: Fallback to XLM-R (LLM unavailable or failed)"
+    if xlmr_branch_result.ok:
+        xlmr_output = xlmr_branch_result.value
+    elif xlmr_branch_result.timed_out:
+        xlmr_output = f"XLM-R timed out after {XLMR_BRANCH_TIMEOUT:.0f}s."
+    else:
+        xlmr_output = f"XLM-R error: {xlmr_branch_result.error}"
+
+    if rag_branch_result.ok:
+        rag_results, rag_prediction, prompt, mode = rag_branch_result.value
+    else:
+        rag_results, rag_prediction, prompt, mode = [], None, "", "fallback_xlmr"
+        if rag_branch_result.timed_out:
+            print(f"RAG branch timed out after {RAG_BRANCH_TIMEOUT:.0f}s")
+        else:
+            print(f"RAG branch error: {rag_branch_result.error}")
+
+    if rag_prediction is None:
+        rag_prediction = xlmr_output
+
+    mode_text = describe_mode(mode, prefix="RAG mode")
+    timing_text = (
+        f"Branch timings: rag={rag_branch_result.elapsed:.2f}s "
+        f"xlmr={xlmr_branch_result.elapsed:.2f}s"
     )
+    if SHOW_STAGE_TIMINGS:
+        timing_text += "\n" + format_timings(timings)
 
     return (
         rag_prediction,
         xlmr_output,
         prompt,
-        format_retrieval_results(rag_results) + "\n\n" + mode_text,
+        format_retrieval_results(rag_results) + "\n\n" + mode_text + "\n" + timing_text,
     )
 
 
@@ -491,6 +793,10 @@ with gr.Blocks(title="LuxNLP: RAG + XLM-R NER") as demo:
             placeholder="Hien huet Diabetis an ass zu Esch ."
         )
         dynamic_k = gr.Slider(1, 5, value=3, step=1, label="Top-k examples")
+        dynamic_cascade = gr.Checkbox(
+            value=CASCADE_ENABLED,
+            label=f"Cascade: skip the LLM when XLM-R is confident (margin >= {CASCADE_MARGIN_THRESHOLD:.2f})",
+        )
         dynamic_btn = gr.Button("Run Dynamic RAG")
 
         dynamic_out = gr.Textbox(label="Retrieved Examples", lines=16)
@@ -499,8 +805,8 @@ with gr.Blocks(title="LuxNLP: RAG + XLM-R NER") as demo:
         prediction_mode = gr.Textbox(label="Prediction Mode", lines=2)
 
         dynamic_btn.click(
-            run_dynamic_rag,
-            inputs=[dynamic_query, dynamic_k],
+            run_dynamic_rag_stream,
+            inputs=[dynamic_query, dynamic_k, dynamic_cascade],
             outputs=[dynamic_out, dynamic_prompt, predicted_bio, prediction_mode],
         )
 
@@ -528,6 +834,28 @@ with gr.Blocks(title="LuxNLP: RAG + XLM-R NER") as demo:
             outputs=[xlmr_out],
         )
 
+    with gr.Tab("Document"):
+        gr.Markdown(
+            "Tag a whole paragraph or article with XLM-R. The text is split into sentences, "
+            "tokenized like the training data and tagged in one batch; entities are listed "
+            "with their character offsets in the text."
+        )
+        doc_query = gr.Textbox(
+            label="Luxembourgish text",
+            lines=10,
+            placeholder="D'Maria wunnt zu Dikrech. Si schafft zu Lëtzebuerg."
+        )
+        doc_btn = gr.Button("Tag Document")
+        with gr.Row():
+            doc_entities = gr.Textbox(label="Entities (start-end, type, text)", lines=22)
+            doc_bio = gr.Textbox(label="Predicted BIO Tags", lines=22)
+
+        doc_btn.click(
+            predict_document,
+            inputs=[doc_query],
+            outputs=[doc_entities, doc_bio],
+        )
+
     with gr.Tab("Compare"):
         gr.Markdown("Compare **RAG prediction** and **XLM-R prediction** side by side.")
         cmp_query = gr.Textbox(
@@ -572,9 +900,48 @@ with gr.Blocks(title="LuxNLP: RAG + XLM-R NER") as demo:
         )
 
     with gr.Tab("LLM Debug"):
-        gr.Markdown("Use this tab to verify whether the Hugging Face LLM endpoint is working.")
+        gr.Markdown(
+            "Use this tab to verify whether the LLM endpoint is working. "
+            "Status comes from a background health probe and recent requests."
+        )
         debug_btn = gr.Button("Check LLM")
         debug_box = gr.Textbox(label="LLM Debug Status", lines=10)
         debug_btn.click(check_llm_status, outputs=debug_box)
 
-demo.launch()
+    with gr.Tab("Performance"):
+        gr.Markdown(
+            "Latency per pipeline stage since startup (retrieval, prompt building, LLM, "
+            "XLM-R tokenization and forward, memory sync). "
+            "The same histograms are served in Prometheus format at `/metrics`."
+        )
+        perf_btn = gr.Button("Refresh")
+        perf_box = gr.Textbox(label="Stage Latency", lines=20)
+        perf_btn.click(metrics.format_summary, outputs=perf_box)
+
+# =========================
+# SERVER (Gradio UI + /metrics + /api/ner)
+# =========================
+api = FastAPI()
+api.include_router(
+    create_ner_router(
+        xlmr_predict_batch,
+        rag_tag_words,
+        max_sentences=API_MAX_SENTENCES,
+        max_words=API_MAX_WORDS,
+        max_document_chars=API_MAX_DOCUMENT_CHARS,
+        max_rag_sentences=API_MAX_RAG_SENTENCES,
+        margin_threshold=CASCADE_MARGIN_THRESHOLD,
+        rag_timeout=RAG_BRANCH_TIMEOUT,
+    )
+)
+
+
+@api.get("/metrics", response_class=PlainTextResponse)
+def prometheus_metrics():
+    return metrics.render_prometheus()
+
+
+app = gr.mount_gradio_app(api, demo, path="/")
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", "7860")))
@@ -0,0 +1,314 @@
+"""
+Load test and latency benchmark for the Space handlers.
+
+In-process mode imports app.py against the local stub LLM and drives
+run_dynamic_rag, compare_approaches, predict_xlmr and add_prediction_to_memory
+from a thread pool. HTTP mode drives a running server through /api/ner.
+Sentences are sampled from a CoNLL file. For each handler it reports
+p50/p95/p99 latency, throughput, error count and RSS, and saves everything as
+JSON. Pass --baseline to compare with an earlier run.
+
+In-process (starts the stub itself):
+    python benchmark_app.py --conll test.conll --requests 200 --concurrency 8 --llm_latency_ms 400
+
+Over HTTP (server started separately, e.g. pointed at llm_stub_server.py):
+    python benchmark_app.py --conll test.conll --url http://127.0.0.1:7860 --handlers api_xlmr,api_auto
+
+add_prediction_to_memory appends to the local memory files. They are backed up
+before the run and restored afterwards. Hub sync is disabled unless --allow_sync.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from dynamic_rag_luxnlp import load_conll
+from llm_health import percentile
+from llm_stub_server import start_stub_server
+
+IN_PROCESS_HANDLERS = ["run_dynamic_rag", "compare_approaches", "predict_xlmr", "add_prediction_to_memory"]
+HTTP_HANDLERS = ["api_xlmr", "api_rag", "api_auto"]
+
+
+# -----------------------------
+# Inputs and measurements
+# -----------------------------
+def sample_inputs(sentences: List[List[str]], n: int, distribution: str, seed: int) -> List[List[str]]:
+    """
+    uniform: independent draws (natural repeats);
+    zipf: a few hot sentences dominate, which exercises the caches;
+    unique: no repeats until the file is exhausted (cold caches).
+    """
+    rng = random.Random(seed)
+    if distribution == "unique":
+        pool = sentences[:]
+        rng.shuffle(pool)
+        return [pool[i % len(pool)] for i in range(n)]
+    if distribution == "zipf":
+        weights = [1.0 / (rank + 1) for rank in range(len(sentences))]
+        return rng.choices(sentences, weights=weights, k=n)
+    return [rng.choice(sentences) for _ in range(n)]
+
+
+def rss_mb(pid: Optional[int] = None) -> float:
+    status = Path(f"/proc/{pid or 'self'}/status")
+    try:
+        for line in status.read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    if pid is None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    return 0.0
+
+
+def summarize(latencies: List[float], errors: int, wall: float, items_per_call: int = 1) -> Dict[str, float]:
+    count = len(latencies)
+    return {
+        "requests": count + errors,
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(count / wall, 3) if wall > 0 else 0.0,
+        "sentences_per_s": round(count * items_per_call / wall, 3) if wall > 0 else 0.0,
+        "mean_ms": round(1000 * sum(latencies) / count, 2) if count else 0.0,
+        "p50_ms": round(1000 * percentile(latencies, 50), 2),
+        "p95_ms": round(1000 * percentile(latencies, 95), 2),
+        "p99_ms": round(1000 * percentile(latencies, 99), 2),
+        "max_ms": round(1000 * max(latencies), 2) if latencies else 0.0,
+    }
+
+
+async def drive(call, inputs, concurrency: int, executor: Optional[ThreadPoolExecutor] = None):
+    """
+    Run call(x) for every input with at most `concurrency` in flight.
+    Sync calls go through the executor, async calls are awaited directly.
+    """
+    loop = asyncio.get_running_loop()
+    sem = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def one(x):
+        nonlocal errors
+        async with sem:
+            start = time.perf_counter()
+            try:
+                if executor is not None:
+                    await loop.run_in_executor(executor, call, x)
+                else:
+                    await call(x)
+            except Exception as e:
+                errors += 1
+                print(f"  error: {type(e).__name__}: {e}")
+                return
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(x) for x in inputs))
+    return latencies, errors, time.perf_counter() - start
+
+
+# -----------------------------
+# Targets
+# -----------------------------
+def load_app(args, base_url: str):
+    os.environ["LLM_PROVIDER"] = "openai"
+    os.environ["LLM_BASE_URL"] = base_url
+    os.environ["LLM_MODEL"] = "stub-ner"
+    os.environ["LLM_HEALTH_INTERVAL"] = "0"
+    os.environ["MEMORY_REFRESH_INTERVAL"] = "0"
+    if not args.warm_llm_cache:
+        os.environ["LLM_CACHE_PATH"] = str(Path(tempfile.mkdtemp(prefix="bench_llm_cache_")) / "llm_cache.sqlite")
+    if args.no_prediction_cache:
+        os.environ["PREDICTION_CACHE_SIZE"] = "0"
+
+    app = importlib.import_module("app")
+    if not args.allow_sync:
+        app.sync_file_to_dataset_repo = lambda local_file, repo_file: None
+    return app
+
+
+def in_process_calls(app, k: int) -> Dict[str, Callable[[List[str]], object]]:
+    counter = iter(range(10**9))
+
+    def add_to_memory(words):
+        # A unique trailing token so every call is a real insert, not a duplicate.
+        tokens = list(words) + [f"bench{next(counter)}"]
+        return app.add_prediction_to_memory("\n".join(f"{t}\tO" for t in tokens))
+
+    return {
+        "run_dynamic_rag": lambda words: app.run_dynamic_rag(" ".join(words), k),
+        "compare_approaches": lambda words: app.compare_approaches(" ".join(words), k),
+        "predict_xlmr": lambda words: app.predict_xlmr(" ".join(words)),
+        "add_prediction_to_memory": add_to_memory,
+    }
+
+
+def http_calls(client, url: str, k: int):
+    def make(mode):
+        async def call(batch):
+            response = await client.post(f"{url.rstrip('/')}/api/ner", json={"tokens": batch, "mode": mode, "k": k})
+            response.raise_for_status()
+            return response.json()
+
+        return call
+
+    return {"api_xlmr": make("xlmr"), "api_rag": make("rag"), "api_auto": make("auto")}
+
+
+# -----------------------------
+# Reporting
+# -----------------------------
+def compare_to_baseline(results: Dict, baseline_path: str) -> None:
+    baseline = json.loads(Path(baseline_path).read_text(encoding="utf-8")).get("handlers", {})
+    print(f"\nCompared to {baseline_path}:")
+    for name, cur in results.items():
+        old = baseline.get(name)
+        if not old:
+            print(f"  {name}: no baseline")
+            continue
+        parts = []
+        for key in ("p50_ms", "p95_ms", "p99_ms", "throughput_rps"):
+            if old.get(key):
+                parts.append(f"{key} {old[key]:.1f} -> {cur[key]:.1f} ({(cur[key] - old[key]) / old[key]:+.1%})")
+        print(f"  {name}: " + " | ".join(parts))
+
+
+def print_table(results: Dict) -> None:
+    print(f"\n{'handler':<26} {'req':>6} {'err':>4} {'rps':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'rss':>8}")
+    for name, r in results.items():
+        print(
+            f"{name:<26} {r['requests']:>6} {r['errors']:>4} {r['throughput_rps']:>8.2f} "
+            f"{r['p50_ms']:>7.1f}ms {r['p95_ms']:>7.1f}ms {r['p99_ms']:>7.1f}ms {r['rss_mb_after']:>6.0f}MB"
+        )
+
+
+async def run(args) -> Dict:
+    sentences = [ex.tokens for ex in load_conll(args.conll, source="bench") if ex.tokens]
+    if not sentences:
+        raise SystemExit(f"No sentences in {args.conll}")
+
+    results: Dict[str, Dict] = {}
+    meta: Dict[str, object] = {}
+
+    if args.url:
+        import httpx
+
+        handlers = [h for h in args.handlers.split(",") if h] or HTTP_HANDLERS
+        async with httpx.AsyncClient(timeout=args.timeout) as client:
+            calls = http_calls(client, args.url, args.k)
+            for name in handlers:
+                batch_size = 1 if name == "api_rag" else args.batch_size
+                inputs = sample_inputs(sentences, args.requests * batch_size, args.distribution, args.seed)
+                batches = [inputs[i:i + batch_size] for i in range(0, len(inputs), batch_size)]
+                if args.warmup:
+                    await drive(calls[name], batches[: args.warmup], args.concurrency)
+                print(f"Running {name} ({len(batches)} requests x {batch_size} sentences, concurrency={args.concurrency})")
+                latencies, errors, wall = await drive(calls[name], batches, args.concurrency)
+                results[name] = summarize(latencies, errors, wall, batch_size)
+                results[name]["rss_mb_after"] = rss_mb(args.server_pid) if args.server_pid else 0.0
+        meta["target"] = args.url
+        return {"meta": meta, "handlers": results}
+
+    server, base_url = start_stub_server(
+        latency_ms=args.llm_latency_ms, jitter_ms=args.llm_jitter_ms, failure_rate=args.llm_failure_rate
+    )
+    rss_before = rss_mb()
+    load_start = time.perf_counter()
+    app = load_app(args, base_url)
+    meta.update(
+        {
+            "target": "in-process",
+            "stub_llm": base_url,
+            "app_load_s": round(time.perf_counter() - load_start, 3),
+            "rss_mb_before_load": round(rss_before, 1),
+            "rss_mb_after_load": round(rss_mb(), 1),
+        }
+    )
+
+    handlers = [h for h in args.handlers.split(",") if h] or IN_PROCESS_HANDLERS
+    calls = in_process_calls(app, args.k)
+    backups = {}
+    if "add_prediction_to_memory" in handlers:
+        for path in (app.MEMORY_PATH, app.APPROVED_PATH):
+            if Path(path).exists():
+                backups[path] = Path(tempfile.mkdtemp(prefix="bench_memory_")) / Path(path).name
+                shutil.copy2(path, backups[path])
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            for name in handlers:
+                inputs = sample_inputs(sentences, args.requests, args.distribution, args.seed)
+                if args.warmup:
+                    await drive(calls[name], inputs[: args.warmup], args.concurrency, executor)
+                print(f"Running {name} ({len(inputs)} requests, concurrency={args.concurrency})")
+                latencies, errors, wall = await drive(calls[name], inputs, args.concurrency, executor)
+                results[name] = summarize(latencies, errors, wall)
+                results[name]["rss_mb_after"] = round(rss_mb(), 1)
+    finally:
+        for path, backup in backups.items():
+            shutil.copy2(backup, path)
+        server.shutdown()
+
+    meta["stub_requests"] = server.RequestHandlerClass.config.requests
+    meta["rss_mb_peak"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1)
+    return {"meta": meta, "handlers": results}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--conll", required=True, help="Sentences to sample from (e.g. test.conll)")
+    ap.add_argument("--handlers", default="", help="Comma-separated subset (default: all for the chosen mode)")
+    ap.add_argument("--requests", type=int, default=100, help="Requests per handler")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--warmup", type=int, default=5, help="Untimed requests per handler")
+    ap.add_argument("--distribution", choices=["uniform", "zipf", "unique"], default="uniform")
+    ap.add_argument("--seed", type=int, default=13)
+    ap.add_argument("--k", type=int, default=3)
+    ap.add_argument("--llm_latency_ms", type=float, default=300.0)
+    ap.add_argument("--llm_jitter_ms", type=float, default=100.0)
+    ap.add_argument("--llm_failure_rate", type=float, default=0.0)
+    ap.add_argument("--warm_llm_cache", action="store_true", help="Use the app's LLM cache instead of a fresh one")
+    ap.add_argument("--no_prediction_cache", action="store_true", help="Disable the XLM-R prediction cache")
+    ap.add_argument("--allow_sync", action="store_true", help="Let add_prediction_to_memory push to the Hub")
+    ap.add_argument("--url", default="", help="Benchmark a running server over HTTP instead of in-process")
+    ap.add_argument("--batch_size", type=int, default=32, help="Sentences per /api/ner request (HTTP mode)")
+    ap.add_argument("--server_pid", type=int, default=0, help="PID of the server to read RSS from (HTTP mode)")
+    ap.add_argument("--timeout", type=float, default=120.0)
+    ap.add_argument("--out", default="benchmark_results.json")
+    ap.add_argument("--baseline", default="", help="Earlier results JSON to compare against")
+    args = ap.parse_args()
+
+    report = asyncio.run(run(args))
+    report["meta"].update(
+        {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+        }
+    )
+
+    print_table(report["handlers"])
+    if args.baseline:
+        compare_to_baseline(report["handlers"], args.baseline)
+
+    Path(args.out).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"\n✅ Wrote: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+BIO-constrained Viterbi decoding over word-level label scores.
+
+An "I-X" label may only follow "B-X" or "I-X" and cannot start a sentence.
+Decoding runs on padded [batch, words, labels] tensors. Each step is one
+broadcast max over [batch, labels, labels]; the only Python loop is over the
+word position. The output is always valid BIO. Compared with argmax followed
+by repair, the decoder picks the best valid sequence instead of patching
+single labels.
+
+Identical copies live in scripts/model/prediction/ and rag/app/.
+"""
+from __future__ import annotations
+
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import torch
+
+NEG_INF = -1e9
+
+
+def bio_constraints(id2label: Dict[int, str]) -> Tuple[torch.Tensor, torch.Tensor]:
+    """(allowed [C, C] indexed [previous, next], start_allowed [C])."""
+    labels = [id2label[i] for i in range(len(id2label))]
+
+    def split(label: str):
+        if "-" in label:
+            tag, typ = label.split("-", 1)
+            return tag, typ
+        return label, None
+
+    parts = [split(label) for label in labels]
+    n = len(labels)
+    allowed = torch.ones(n, n, dtype=torch.bool)
+    start_allowed = torch.ones(n, dtype=torch.bool)
+    for j, (tag, typ) in enumerate(parts):
+        if tag != "I":
+            continue
+        start_allowed[j] = False
+        for i, (prev_tag, prev_type) in enumerate(parts):
+            allowed[i, j] = prev_tag in ("B", "I") and prev_type == typ
+    return allowed, start_allowed
+
+
+@torch.no_grad()
+def viterbi_decode(
+    log_probs: torch.Tensor,
+    lengths: torch.Tensor,
+    allowed: torch.Tensor,
+    start_allowed: torch.Tensor,
+) -> torch.Tensor:
+    """
+    log_probs [B, W, C], lengths [B] -> label ids [B, W]. Positions at or past
+    a row's length repeat its last label; callers slice them off.
+    """
+    batch, width, num_labels = log_probs.shape
+    if width == 0:
+        return torch.zeros(batch, 0, dtype=torch.long, device=log_probs.device)
+
+    log_probs = log_probs.float()
+    zero = torch.zeros((), device=log_probs.device)
+    neg = torch.full((), NEG_INF, device=log_probs.device)
+    transitions = torch.where(allowed.to(log_probs.device), zero, neg)  # [C, C]
+    score = log_probs[:, 0] + torch.where(start_allowed.to(log_probs.device), zero, neg)
+    lengths = lengths.to(log_probs.device)
+    identity = torch.arange(num_labels, device=log_probs.device).expand(batch, num_labels)
+
+    backpointers = []
+    for t in range(1, width):
+        best, previous = (score.unsqueeze(2) + transitions).max(dim=1)  # [B, C]
+        active = (lengths > t).unsqueeze(1)
+        score = torch.where(active, best + log_probs[:, t], score)
+        backpointers.append(torch.where(active, previous, identity))
+
+    last = score.argmax(dim=-1)
+    path = [last]
+    for previous in reversed(backpointers):
+        last = previous.gather(1, last.unsqueeze(1)).squeeze(1)
+        path.append(last)
+    path.reverse()
+    return torch.stack(path, dim=1)
+
+
+class BIODecoder:
+    """Viterbi over many sentences: sorted by length and decoded in padded groups."""
+
+    def __init__(self, id2label: Dict[int, str], group_size: int = 256):
+        self.allowed, self.start_allowed = bio_constraints(id2label)
+        self.group_size = group_size
+
+    def decode(self, scores: Sequence[np.ndarray]) -> List[np.ndarray]:
+        """scores: one [num_words, C] log-probability array per sentence -> label ids per sentence."""
+        out: List[np.ndarray] = [np.zeros(len(s), dtype=np.int64) for s in scores]
+        order = sorted((i for i, s in enumerate(scores) if len(s)), key=lambda i: len(scores[i]))
+        for start in range(0, len(order), self.group_size):
+            group = order[start:start + self.group_size]
+            width = len(scores[group[-1]])
+            num_labels = scores[group[0]].shape[1]
+            padded = np.zeros((len(group), width, num_labels), dtype=np.float32)
+            for row, i in enumerate(group):
+                padded[row, :len(scores[i])] = scores[i]
+            lengths = torch.tensor([len(scores[i]) for i in group])
+            ids = viterbi_decode(torch.from_numpy(padded), lengths, self.allowed, self.start_allowed).numpy()
+            for row, i in enumerate(group):
+                out[i] = ids[row, :len(scores[i])]
+        return out
@@ -0,0 +1,192 @@
+"""
+Offline calibration of the XLM-R -> RAG/LLM confidence cascade.
+
+For every dev sentence this records the XLM-R labels, the minimum per-token
+softmax margin and the RAG + LLM labels, then sweeps thresholds to report the
+latency / span-F1 trade-off of escalating only low-margin sentences.
+
+Example:
+    python calibrate_cascade.py --dev_conll dev.conll --rag_conll Lux_Final.conll
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+from dynamic_rag_luxnlp import (
+    NER_SYSTEM_MESSAGE,
+    DynamicLuxRAG,
+    build_ner_prompt,
+    load_conll,
+    normalize_llm_bio_output,
+    parse_bio_block,
+)
+from llm_backends import LLMError, backend_from_env
+from llm_cache import LLMResponseCache
+from model_loader import load_token_classifier
+from ner_metrics import align_labels, micro_span_prf
+from xlmr_tagger import tag_words
+
+
+# -----------------------------
+# LLM branch
+# -----------------------------
+def call_llm(llm, cache, prompt):
+    """
+    Returns (normalized output or None, seconds, served_from_cache).
+    """
+    start = time.perf_counter()
+    cached = cache.get(llm.model, NER_SYSTEM_MESSAGE, prompt)
+    if cached is not None:
+        return cached, time.perf_counter() - start, True
+
+    if not llm.available:
+        return None, 0.0, False
+
+    try:
+        content = llm.chat(
+            [
+                {"role": "system", "content": NER_SYSTEM_MESSAGE},
+                {"role": "user", "content": prompt},
+            ],
+            temperature=0.0,
+        )
+        normalized = normalize_llm_bio_output(content)
+    except LLMError as e:
+        print(f"LLM error: {e}")
+        normalized = ""
+
+    elapsed = time.perf_counter() - start
+    if normalized:
+        cache.put(llm.model, NER_SYSTEM_MESSAGE, prompt, normalized)
+    return (normalized or None), elapsed, False
+
+
+# -----------------------------
+# Sweep
+# -----------------------------
+def sweep(records, thresholds, xlmr_latency, llm_latency):
+    gold = [r["gold"] for r in records]
+    rows = []
+    for t in thresholds:
+        preds = []
+        escalated = 0
+        for r in records:
+            if r["min_margin"] < t:
+                preds.append(r["llm"])
+                escalated += 1
+            else:
+                preds.append(r["xlmr"])
+
+        rate = escalated / len(records) if records else 0.0
+        m = micro_span_prf(gold, preds)
+        rows.append(
+            {
+                "threshold": t,
+                "escalation_rate": rate,
+                "precision": m["precision"],
+                "recall": m["recall"],
+                "f1": m["f1"],
+                "est_latency_ms": 1000 * (xlmr_latency + rate * llm_latency),
+            }
+        )
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--dev_conll", required=True)
+    ap.add_argument("--rag_conll", default="Lux_Final.conll", help="Retrieval base (same file the Space indexes)")
+    ap.add_argument("--memory", default="rag_memory.jsonl")
+    ap.add_argument("--model", default="YashGavade10/luxnlp-xlmr-ner")
+    ap.add_argument("--k", type=int, default=3)
+    ap.add_argument("--thresholds", default="0.3,0.5,0.6,0.7,0.8,0.9,0.95,0.98,0.99")
+    ap.add_argument("--max_sentences", type=int, default=0)
+    ap.add_argument("--llm_cache", default="llm_cache.sqlite")
+    ap.add_argument("--out_json", default="cascade_calibration.json")
+    args = ap.parse_args()
+
+    thresholds = sorted(float(x) for x in args.thresholds.split(",") if x.strip())
+
+    llm = backend_from_env()
+    if not llm.available:
+        print(f"[WARN] {llm.provider} backend not configured: only cached LLM answers are used, misses fall back to XLM-R")
+
+    cache = LLMResponseCache(args.llm_cache)
+    rag = DynamicLuxRAG(args.rag_conll, args.memory)
+    tokenizer, model = load_token_classifier(args.model, warmup_lengths=(8, 32))
+
+    dev = load_conll(args.dev_conll, source="dev")
+    if args.max_sentences:
+        dev = dev[: args.max_sentences]
+
+    records = []
+    xlmr_times = []
+    llm_times = []
+    for i, ex in enumerate(dev, 1):
+        t0 = time.perf_counter()
+        xlmr_labels, margins = tag_words(model, tokenizer, ex.tokens)
+        xlmr_times.append(time.perf_counter() - t0)
+
+        query = ex.text
+        t0 = time.perf_counter()
+        prompt = build_ner_prompt(query, rag.retrieve(query, k=args.k))
+        retrieval_time = time.perf_counter() - t0
+
+        output, llm_time, from_cache = call_llm(llm, cache, prompt)
+        if not from_cache and output is not None:
+            llm_times.append(retrieval_time + llm_time)
+
+        if output:
+            _, tags = parse_bio_block(output)
+            llm_labels = align_labels(ex.tokens, tags)
+        else:
+            llm_labels = xlmr_labels
+
+        records.append(
+            {
+                "gold": ex.tags,
+                "xlmr": xlmr_labels,
+                "llm": llm_labels,
+                "min_margin": min(margins) if margins else 1.0,
+            }
+        )
+        if i % 100 == 0:
+            print(f"{i}/{len(dev)} sentences")
+
+    xlmr_latency = sum(xlmr_times) / len(xlmr_times) if xlmr_times else 0.0
+    llm_latency = sum(llm_times) / len(llm_times) if llm_times else 0.0
+    if not llm_times:
+        print("[WARN] No uncached LLM calls measured; latency estimates ignore the LLM round-trip")
+
+    rows = sweep(records, thresholds, xlmr_latency, llm_latency)
+    gold = [r["gold"] for r in records]
+    summary = {
+        "dev_conll": str(args.dev_conll),
+        "num_sentences": len(records),
+        "mean_xlmr_latency_ms": 1000 * xlmr_latency,
+        "mean_llm_latency_ms": 1000 * llm_latency,
+        "xlmr_only": micro_span_prf(gold, [r["xlmr"] for r in records]),
+        "llm_always": micro_span_prf(gold, [r["llm"] for r in records]),
+        "curve": rows,
+        "llm_cache": cache.stats(),
+    }
+
+    print(f"\n{'threshold':>9} {'escalated':>9} {'P':>7} {'R':>7} {'F1':>7} {'latency_ms':>11}")
+    for row in rows:
+        print(
+            f"{row['threshold']:9.2f} {row['escalation_rate']:9.1%} {row['precision']:7.4f} "
+            f"{row['recall']:7.4f} {row['f1']:7.4f} {row['est_latency_ms']:11.1f}"
+        )
+    print(f"XLM-R only F1={summary['xlmr_only']['f1']:.4f} | LLM always F1={summary['llm_always']['f1']:.4f}")
+
+    out = Path(args.out_json)
+    out.write_text(json.dumps(summary, indent=2), encoding="utf-8")
+    print("✅ Wrote:", out)
+    print("Set CASCADE_MARGIN_THRESHOLD in the Space to the chosen threshold.")
+
+
+if __name__ == "__main__":
+    main()
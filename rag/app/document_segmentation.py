@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+# Same tokenizer as the training data pipeline
+# (scripts/data_extraction/preprocessing/clean_sentences_to_conll.py), so
+# documents are split into the units the model was trained on.
+TOKEN_PATTERN = re.compile(
+    r"\d{1,2}/\d{1,2}/\d{4}"                                   # 02/10/2014
+    r"|\d{1,2}-\d{1,2}-\d{4}"                                  # 02-10-2014
+    r"|\d{1,2}\.\s+[A-Za-zÀ-ÿ]+(?:\s+\d{4})?"                  # 19. Mee 1993
+    r"|\d{4}"                                                  # 2014
+    r"|[A-Za-zÀ-ÿ0-9]+(?:[-'’][A-Za-zÀ-ÿ0-9]+)*"               # words
+    r"|[.,!?;:()%/\"'„“”‘’\-]"                                 # punctuation
+)
+
+# Sentence-final punctuation, optional closing quotes/brackets, then whitespace
+SENTENCE_END = re.compile(r"[.!?…]+[\"'”“»)\]]*(?=\s)")
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+NEXT_CHAR = re.compile(r"\s*(\S)")
+
+# A period after these does not end a sentence (compared lowercased, without the final ".")
+ABBREVIATIONS = {
+    "abs", "art", "bzw", "ca", "d.h", "dr", "etc", "hr", "jh", "mio", "mme", "mr", "mrd",
+    "nr", "prof", "s", "st", "u.a", "vgl", "z.b",
+}
+
+
+@dataclass
+class DocumentSentence:
+    start: int
+    end: int
+    text: str
+    tokens: List[str] = field(default_factory=list)
+    offsets: List[Tuple[int, int]] = field(default_factory=list)  # absolute character offsets
+
+
+def _is_boundary(text: str, match: re.Match, stop: int) -> bool:
+    following = NEXT_CHAR.match(text, match.end(), stop)
+    if following is None:
+        return True
+    if following.group(1).islower():
+        return False
+    if match.group(0).startswith("."):
+        before = text[max(0, match.start() - 40):match.start()].rsplit(None, 1)
+        word = before[-1].lstrip("(\"'„“‘").lower() if before else ""
+        if word in ABBREVIATIONS or len(word) == 1:
+            return False
+        # Day ordinals as in "19. Mee"
+        if word.isdigit() and len(word) <= 2:
+            return False
+    return True
+
+
+def split_sentences(text: str) -> List[Tuple[int, int]]:
+    """
+    Character (start, end) of each sentence. Blank lines always end a sentence;
+    inside a paragraph, sentences end at . ! ? … followed by whitespace, except
+    after abbreviations, initials and day ordinals or before a lowercase word.
+    """
+    spans = []
+    paragraph_start = 0
+    breaks = [(m.start(), m.end()) for m in PARAGRAPH_BREAK.finditer(text)] + [(len(text), len(text))]
+    for paragraph_end, next_start in breaks:
+        start = paragraph_start
+        for match in SENTENCE_END.finditer(text, paragraph_start, paragraph_end):
+            if _is_boundary(text, match, paragraph_end):
+                spans.append((start, match.end()))
+                start = match.end()
+        spans.append((start, paragraph_end))
+        paragraph_start = next_start
+
+    trimmed = []
+    for start, end in spans:
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if start < end:
+            trimmed.append((start, end))
+    return trimmed
+
+
+def segment_document(text: str) -> List[DocumentSentence]:
+    """Sentences of a document, tokenized with TOKEN_PATTERN; sentences without tokens are dropped."""
+    sentences = []
+    for start, end in split_sentences(text):
+        sentence = DocumentSentence(start=start, end=end, text=text[start:end])
+        for match in TOKEN_PATTERN.finditer(text, start, end):
+            sentence.tokens.append(match.group(0))
+            sentence.offsets.append((match.start(), match.end()))
+        if sentence.tokens:
+            sentences.append(sentence)
+    return sentences
@@ -1,9 +1,10 @@
 from __future__ import annotations
 
 import json
+import re
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
 
 import numpy as np
 from sklearn.feature_extraction.text import TfidfVectorizer
@@ -116,6 +117,11 @@ class DynamicLuxRAG:
         self.vectorizer = TfidfVectorizer(lowercase=True, analyzer="word", ngram_range=(1, 2))
         self.embeddings = self.vectorizer.fit_transform(all_texts)
 
+    def reload_memory(self):
+        """Re-read the memory file (e.g. after a hub sync replaced it) and rebuild the index."""
+        self.memory_examples = load_jsonl_memory(self.memory_path)
+        self.rebuild_index()
+
     def _retrieve_with_index(self, query: str, examples: List[SentenceExample], vectorizer, embeddings, k: int = 3):
         if not examples:
             return []
@@ -215,4 +221,345 @@ NEW SENTENCE:
 Return only the token-tag lines for the NEW SENTENCE.
 """.strip()
 
-    return prompt
\ No newline at end of file
+    return prompt
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough LLM token estimate (~4 characters per token for Latin-script text).
+    Good enough for budgeting and comparing prompt formats.
+    """
+    return max(1, round(len(text or "") / 4))
+
+
+def merge_retrieved(retrieved_per_query: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    Union of retrieved examples across several queries, deduplicated by sentence
+    text and ordered by best score.
+    """
+    best: Dict[str, Dict[str, Any]] = {}
+    for results in retrieved_per_query:
+        for ex in results:
+            key = ex["text"]
+            if key not in best or ex.get("score", 0.0) > best[key].get("score", 0.0):
+                best[key] = ex
+    return sorted(best.values(), key=lambda ex: ex.get("score", 0.0), reverse=True)
+
+
+def build_packed_ner_prompt(queries: List[str], retrieved_per_query: List[List[Dict[str, Any]]]) -> str:
+    """
+    Tag several sentences in one request. The instruction block is sent once and
+    retrieved examples shared between queries are listed once.
+    """
+    blocks = []
+
+    for i, ex in enumerate(merge_retrieved(retrieved_per_query), start=1):
+        block = (
+            f"Example {i} (source={ex['source']})\n"
+            f"Sentence: {ex['text']}\n"
+            f"Annotated:\n{ex['tagged_text']}"
+        )
+        blocks.append(block)
+
+    joined_examples = "\n\n".join(blocks)
+    joined_queries = "\n".join(f"### {i}\n{q}" for i, q in enumerate(queries, start=1))
+
+    prompt = f"""
+You are an NLP assistant for Luxembourgish named entity recognition.
+Your task is to assign one BIO label to each token of every NEW SENTENCE.
+
+Rules:
+- Answer every sentence, in order, under its own header line: ### <number>
+- Keep the original token order.
+- Output exactly one line per token.
+- Use the format: token<TAB>tag
+- Do not explain anything.
+- Use only BIO tags that fit the examples.
+
+Retrieved similar annotated examples:
+
+{joined_examples}
+
+NEW SENTENCES:
+{joined_queries}
+
+Return only the header lines and token-tag lines for the NEW SENTENCES.
+""".strip()
+
+    return prompt
+
+
+PACKED_HEADER_RE = re.compile(r"^\s*(?:#+\s*(?:sentence\s*)?|sentence\s*)(\d+)\s*[:.)]?\s*$", re.IGNORECASE)
+
+
+def split_packed_output(raw_text: str, n: int) -> List[str]:
+    """
+    Split a packed answer into n normalized BIO blocks (token<TAB>tag lines).
+    Sections that are missing or out of range come back as "".
+    """
+    sections: Dict[int, List[str]] = {}
+    current = None
+
+    for line in (raw_text or "").splitlines():
+        m = PACKED_HEADER_RE.match(line)
+        if m:
+            current = int(m.group(1))
+            sections.setdefault(current, [])
+            continue
+        if current is not None:
+            sections[current].append(line)
+
+    if not sections and n == 1:
+        return [normalize_llm_bio_output(raw_text)]
+
+    return [normalize_llm_bio_output("\n".join(sections.get(i, []))) for i in range(1, n + 1)]
+
+
+# =========================
+# COMPACT PROMPT FORMAT
+# =========================
+def inline_entities(tokens: List[str], tags: List[str]) -> str:
+    """
+    Compact example encoding: entities in brackets, O tokens as plain text.
+    De [Jean|PER] schafft zu [Lëtzebuerg|LOC] .
+    """
+    out = []
+    i = 0
+    while i < len(tags):
+        tag = tags[i]
+        if tag.startswith("B-") or tag.startswith("I-"):
+            typ = tag[2:]
+            j = i + 1
+            while j < len(tags) and tags[j] == f"I-{typ}":
+                j += 1
+            out.append(f"[{' '.join(tokens[i:j])}|{typ}]")
+            i = j
+        else:
+            out.append(tokens[i])
+            i += 1
+    return " ".join(out)
+
+
+def pack_examples(candidates: List[Dict[str, Any]], budget: int, render) -> List[Dict[str, Any]]:
+    """
+    Greedily keep the best-scored candidates whose rendered text still fits in
+    `budget` estimated tokens. Candidates that do not fit are skipped, so a
+    shorter lower-ranked example can still use the remaining space.
+    """
+    packed = []
+    used = 0
+    for ex in candidates:
+        cost = estimate_tokens(render(ex)) + 1
+        if used + cost > budget:
+            continue
+        packed.append(ex)
+        used += cost
+    return packed
+
+
+def render_compact_example(ex: Dict[str, Any]) -> str:
+    return inline_entities(ex["tokens"], ex["tags"])
+
+
+def build_compact_ner_prompt(query: str, candidates: List[Dict[str, Any]], example_token_budget: int = 600):
+    """
+    Compact alternative to build_ner_prompt: examples are single lines with
+    inline entity brackets and the LLM answers with an entity list instead of
+    one line per token. Returns (prompt, examples actually included).
+    Use entities_to_bio to turn the answer back into token<TAB>tag lines.
+    """
+    examples = pack_examples(candidates, example_token_budget, render_compact_example)
+    joined_examples = "\n".join(f"- {render_compact_example(ex)}" for ex in examples)
+
+    prompt = f"""
+Luxembourgish NER. Entities are marked as [text|TYPE] in the examples.
+
+Examples:
+{joined_examples}
+
+NEW SENTENCE:
+{query}
+
+List the entities of the NEW SENTENCE, one per line as: text|TYPE
+Copy the entity text exactly. Write NONE if there are no entities.
+""".strip()
+
+    return prompt, examples
+
+
+# Entity types of the training data; anything else in an LLM answer is ignored.
+ENTITY_TYPES = frozenset({"PER", "LOC", "ORG", "DATE", "EVENT", "MED", "PRODUCT"})
+
+ENTITY_LINE_RE = re.compile(r"^\s*(?:[-*]\s*)?\[?(.+?)\s*[|\t]\s*([A-Za-z]+)\]?\s*$")
+INLINE_ENTITY_RE = re.compile(r"\[([^\[\]|]+)\|([A-Za-z]+)\]")
+
+
+def parse_entity_answer(raw_text: str, entity_types=ENTITY_TYPES) -> List[Tuple[str, str]]:
+    """
+    Accepts "text|TYPE" lines, "text<TAB>TYPE" lines or inline [text|TYPE] brackets.
+    Types outside entity_types are dropped, so a token<TAB>tag answer such as
+    "De\tO" never turns into an entity.
+    """
+    raw_text = (raw_text or "").strip()
+    if not raw_text or raw_text.upper() == "NONE":
+        return []
+
+    inline = INLINE_ENTITY_RE.findall(raw_text)
+    if inline:
+        candidates = [(text.strip(), typ.upper()) for text, typ in inline]
+    else:
+        candidates = []
+        for line in raw_text.splitlines():
+            m = ENTITY_LINE_RE.match(line)
+            if m:
+                candidates.append((m.group(1).strip(), m.group(2).upper()))
+    return [(text, typ) for text, typ in candidates if typ in entity_types]
+
+
+def entities_to_bio(raw_text: str, tokens: List[str]) -> str:
+    """
+    Expand an entity-list answer back to token<TAB>tag lines for `tokens`.
+    Each entity is matched to the first unused, case-insensitive token span
+    after the previous match; unmatched entities are dropped.
+    """
+    tags = ["O"] * len(tokens)
+    folded = [t.casefold() for t in tokens]
+    cursor = 0
+
+    for text, typ in parse_entity_answer(raw_text):
+        span = text.casefold().split()
+        if not span:
+            continue
+
+        start = None
+        for offset in (cursor, 0):
+            for i in range(offset, len(tokens) - len(span) + 1):
+                if folded[i : i + len(span)] == span and all(t == "O" for t in tags[i : i + len(span)]):
+                    start = i
+                    break
+            if start is not None:
+                break
+        if start is None:
+            continue
+
+        tags[start] = f"B-{typ}"
+        for j in range(start + 1, start + len(span)):
+            tags[j] = f"I-{typ}"
+        cursor = start + len(span)
+
+    return "\n".join(f"{t}\t{y}" for t, y in zip(tokens, tags))
+
+
+NER_SYSTEM_MESSAGE = (
+    "You are a Luxembourgish named entity recognition system. "
+    "Return BIO tags only. "
+    "Output exactly one token per line in this format: token<TAB>tag. "
+    "Do not explain anything."
+)
+
+# For build_compact_ner_prompt: the answer is an entity list, not BIO lines.
+COMPACT_NER_SYSTEM_MESSAGE = (
+    "You are a Luxembourgish named entity recognition system. "
+    "List the entities of the sentence, one per line in this format: text|TYPE. "
+    f"TYPE is one of {', '.join(sorted(ENTITY_TYPES))}. "
+    "Write NONE if there are no entities. "
+    "Do not explain anything."
+)
+
+
+def parse_bio_block(text: str):
+    tokens = []
+    tags = []
+
+    for line in (text or "").strip().splitlines():
+        line = line.strip()
+        if not line:
+            continue
+
+        parts = line.split("\t")
+        if len(parts) < 2:
+            parts = line.split()
+
+        if len(parts) < 2:
+            continue
+
+        token = parts[0].strip()
+        tag = parts[-1].strip()
+
+        if token:
+            tokens.append(token)
+            tags.append(tag)
+
+    return tokens, tags
+
+
+def normalize_llm_bio_output(raw_text: str):
+    """
+    Try to keep only BIO lines in format: token<TAB>tag
+    Accepts lines with spaces too.
+    """
+    raw_text = (raw_text or "").strip()
+    if not raw_text:
+        return ""
+
+    cleaned = []
+    for line in raw_text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+
+        parts = line.split("\t")
+        if len(parts) < 2:
+            parts = line.split()
+
+        if len(parts) < 2:
+            continue
+
+        token = parts[0].strip()
+        tag = parts[-1].strip()
+
+        if token and tag:
+            cleaned.append(f"{token}\t{tag}")
+
+    return "\n".join(cleaned)
+
+
+class IncrementalBIOParser:
+    """
+    Parse a streamed LLM answer into token<TAB>tag lines as they complete.
+    `complete` turns True once `expected_lines` lines (one per query token)
+    have been parsed, so the caller can stop the stream early.
+    """
+
+    def __init__(self, expected_lines: int | None = None):
+        self.expected_lines = expected_lines
+        self.lines: List[str] = []
+        self._buffer = ""
+
+    def _add(self, line: str) -> int:
+        normalized = normalize_llm_bio_output(line)
+        if normalized and not self.complete:
+            self.lines.append(normalized)
+            return 1
+        return 0
+
+    def feed(self, delta: str) -> int:
+        """Add a chunk; returns the number of newly completed lines."""
+        self._buffer += delta or ""
+        added = 0
+        while "\n" in self._buffer and not self.complete:
+            line, self._buffer = self._buffer.split("\n", 1)
+            added += self._add(line)
+        return added
+
+    def finish(self) -> int:
+        """Parse a trailing line that was not newline-terminated."""
+        line, self._buffer = self._buffer, ""
+        return self._add(line)
+
+    @property
+    def complete(self) -> bool:
+        return self.expected_lines is not None and len(self.lines) >= self.expected_lines
+
+    def text(self) -> str:
+        return "\n".join(self.lines)
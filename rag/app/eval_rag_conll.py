@@ -0,0 +1,425 @@
+"""
+Offline evaluation of the RAG + LLM pipeline over a gold CoNLL file.
+
+Runs DynamicLuxRAG.retrieve -> build_ner_prompt -> LLM for every sentence with
+bounded concurrency, a client-side rate limit that backs off on HTTP 429,
+the persistent LLM response cache and a resumable progress file, then scores
+exact-match span P/R/F1 with the project's BIO span rule.
+
+Example (against the local stub):
+    python llm_stub_server.py --port 8008 --latency_ms 300 &
+    LLM_PROVIDER=openai LLM_BASE_URL=http://127.0.0.1:8008/v1 \\
+        python eval_rag_conll.py --conll test.conll --rag_conll Lux_Final.conll --out_dir eval_rag
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from dynamic_rag_luxnlp import (
+    COMPACT_NER_SYSTEM_MESSAGE,
+    NER_SYSTEM_MESSAGE,
+    DynamicLuxRAG,
+    build_compact_ner_prompt,
+    build_ner_prompt,
+    build_packed_ner_prompt,
+    entities_to_bio,
+    estimate_tokens,
+    load_conll,
+    normalize_llm_bio_output,
+    parse_bio_block,
+    split_packed_output,
+)
+from llm_backends import LLMError, backend_from_env
+from llm_cache import LLMResponseCache
+from ner_metrics import align_labels, micro_span_prf
+
+
+# -----------------------------
+# Rate limiting
+# -----------------------------
+class AsyncRateLimiter:
+    """
+    Token bucket shared by all workers. `penalize` pauses every worker,
+    e.g. after the provider answered 429.
+    """
+
+    def __init__(self, rate_per_sec: float):
+        self.rate = float(rate_per_sec)
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                await asyncio.sleep((1.0 - self.tokens) / self.rate)
+
+    def penalize(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+def is_rate_limited(exc: BaseException) -> bool:
+    cause = exc.__cause__ or exc
+    status = getattr(cause, "status_code", None) or getattr(getattr(cause, "response", None), "status_code", None)
+    return status == 429
+
+
+# -----------------------------
+# Progress file
+# -----------------------------
+def file_fingerprint(path) -> str:
+    """Size plus a BLAKE2 digest of the content."""
+    path = Path(path)
+    digest = hashlib.blake2b(digest_size=16)
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return f"{path.stat().st_size}:{digest.hexdigest()}"
+
+
+def run_settings(args, llm):
+    """Everything that changes the predictions in progress.jsonl."""
+    settings = {
+        "gold": str(args.conll),
+        "gold_hash": file_fingerprint(args.conll),
+        "rag_conll": str(args.rag_conll),
+        "rag_conll_hash": file_fingerprint(args.rag_conll),
+        "prompt_format": args.prompt_format,
+        "pack_size": args.pack_size,
+        "k": args.k,
+        "llm_provider": llm.provider,
+        "llm_model": llm.model,
+    }
+    if args.prompt_format == "compact":
+        settings["compact_budget"] = args.compact_budget
+        settings["compact_candidates"] = args.compact_candidates
+    return settings
+
+
+def check_run_settings(run_path: Path, progress_path: Path, settings, fresh: bool) -> None:
+    """
+    Progress is only reused for the settings it was produced with. Old
+    predictions for another test file, prompt format or model would otherwise be
+    mixed into the new scores. --fresh discards them instead.
+    """
+    if fresh:
+        progress_path.unlink(missing_ok=True)
+    elif progress_path.exists() and progress_path.stat().st_size:
+        try:
+            saved = json.loads(run_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            saved = None
+        if saved != settings:
+            changed = sorted(k for k in set(settings) | set(saved or {}) if (saved or {}).get(k) != settings.get(k))
+            raise SystemExit(
+                f"{progress_path} was written with different settings ({', '.join(changed)}); "
+                "use another --out_dir or pass --fresh to start over"
+            )
+    run_path.write_text(json.dumps(settings, indent=2), encoding="utf-8")
+
+
+def load_progress(path: Path):
+    done = {}
+    if not path.exists():
+        return done
+    with path.open("r", encoding="utf-8") as f:
+        for raw in f:
+            raw = raw.strip()
+            if not raw:
+                continue
+            try:
+                obj = json.loads(raw)
+            except json.JSONDecodeError:
+                # Partially written last line from an interrupted run.
+                continue
+            # Older runs recorded failed requests; run those sentences again.
+            if obj.get("source") == "error":
+                continue
+            done[obj["idx"]] = obj
+    return done
+
+
+# -----------------------------
+# LLM requests
+# -----------------------------
+def ask(llm, cache, prompt, counts, postprocess=normalize_llm_bio_output, system_message=NER_SYSTEM_MESSAGE):
+    """
+    One (possibly cached) LLM request. Returns (answer, source).
+    Token counts are estimated for every prompt built, cached or not,
+    so prompt formats can be compared independently of cache state.
+    """
+    counts["prompt_tokens"] += estimate_tokens(system_message) + estimate_tokens(prompt)
+
+    cached = cache.get(llm.model, system_message, prompt)
+    if cached is not None:
+        return cached, "cache"
+
+    content = llm.chat(
+        [
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": prompt},
+        ],
+        temperature=0.0,
+    )
+    counts["requests"] += 1
+    counts["completion_tokens"] += estimate_tokens(content)
+
+    normalized = postprocess(content)
+    if normalized:
+        cache.put(llm.model, system_message, prompt, normalized)
+    return normalized, "llm"
+
+
+def run_one(rag, llm, cache, tokens, k, counts, opts):
+    query = " ".join(tokens)
+    if opts.prompt_format == "compact":
+        candidates = rag.retrieve(query, k=max(k, opts.compact_candidates))
+        prompt, _ = build_compact_ner_prompt(query, candidates, opts.compact_budget)
+        return ask(
+            llm, cache, prompt, counts,
+            postprocess=lambda content: entities_to_bio(content, tokens),
+            system_message=COMPACT_NER_SYSTEM_MESSAGE,
+        )
+
+    prompt = build_ner_prompt(query, rag.retrieve(query, k=k))
+    return ask(llm, cache, prompt, counts)
+
+
+def run_packed(rag, llm, cache, token_lists, k, counts, opts):
+    """
+    Tag several sentences with one packed prompt. Sentences whose section is
+    missing or has the wrong number of lines are re-asked one by one.
+    """
+    if len(token_lists) == 1:
+        return [run_one(rag, llm, cache, token_lists[0], k, counts, opts)]
+
+    queries = [" ".join(tokens) for tokens in token_lists]
+    prompt = build_packed_ner_prompt(queries, [rag.retrieve(q, k=k) for q in queries])
+    # Packed answers keep their section headers; they are split below.
+    answer, source = ask(llm, cache, prompt, counts, postprocess=str.strip)
+    blocks = split_packed_output(answer, len(queries))
+
+    results = []
+    for tokens, block in zip(token_lists, blocks):
+        _, tags = parse_bio_block(block)
+        if len(tags) == len(tokens):
+            results.append((block, f"packed_{source}"))
+        else:
+            counts["unpacked_retry"] += 1
+            results.append(run_one(rag, llm, cache, tokens, k, counts, opts))
+    return results
+
+
+async def evaluate(args):
+    llm = backend_from_env()
+    if not llm.available:
+        raise SystemExit(f"{llm.provider} backend is not configured")
+
+    cache = LLMResponseCache(args.llm_cache)
+    rag = DynamicLuxRAG(args.rag_conll, args.memory)
+    gold = load_conll(args.conll, source="gold")
+    if args.max_sentences:
+        gold = gold[: args.max_sentences]
+
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    progress_path = out_dir / "progress.jsonl"
+    check_run_settings(out_dir / "run.json", progress_path, run_settings(args, llm), args.fresh)
+    done = load_progress(progress_path)
+    todo = [i for i in range(len(gold)) if i not in done]
+    groups = [todo[i : i + args.pack_size] for i in range(0, len(todo), args.pack_size)]
+    print(f"{len(gold)} sentences, {len(done)} already done, {len(todo)} to run in {len(groups)} requests")
+
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=args.concurrency))
+    semaphore = asyncio.Semaphore(args.concurrency)
+    limiter = AsyncRateLimiter(args.rps)
+    counts = Counter()
+    failed = []
+    start = time.perf_counter()
+
+    with progress_path.open("a", encoding="utf-8") as progress:
+
+        async def worker(group):
+            token_lists = [gold[idx].tokens for idx in group]
+            outputs = None
+            async with semaphore:
+                for attempt in range(args.rate_limit_retries + 1):
+                    await limiter.acquire()
+                    # Each call counts into its own Counter in the worker thread;
+                    # the shared one is only updated here, on the event loop.
+                    local_counts = Counter()
+                    try:
+                        outputs = await asyncio.to_thread(
+                            run_packed, rag, llm, cache, token_lists, args.k, local_counts, args
+                        )
+                        break
+                    except LLMError as e:
+                        if is_rate_limited(e) and attempt < args.rate_limit_retries:
+                            limiter.penalize(args.rate_limit_pause * (attempt + 1))
+                            counts["rate_limited"] += 1
+                            continue
+                        print(f"[{group[0]}] {e}")
+                        break
+                    finally:
+                        counts.update(local_counts)
+
+            # Failed sentences are not written to the progress file, so --resume retries them.
+            if outputs is None:
+                counts["failed"] += len(group)
+                failed.extend(group)
+                return
+
+            for idx, (output, source) in zip(group, outputs):
+                ex = gold[idx]
+                _, tags = parse_bio_block(output)
+                pred = align_labels(ex.tokens, tags)
+                counts["sentences"] += 1
+                counts[source] += 1
+                if tags and len(tags) != len(ex.tokens):
+                    counts["length_mismatch"] += 1
+
+                record = {"idx": idx, "pred": pred, "source": source}
+                progress.write(json.dumps(record, ensure_ascii=False) + "\n")
+                done[idx] = record
+            progress.flush()
+
+            finished = len(done)
+            if finished // 100 != (finished - len(group)) // 100:
+                rate = counts["sentences"] / (time.perf_counter() - start)
+                print(f"{finished}/{len(gold)} sentences ({rate:.1f} sent/s)")
+
+        await asyncio.gather(*(worker(g) for g in groups))
+
+    elapsed = time.perf_counter() - start
+    if failed:
+        print(f"[WARN] {len(failed)} sentences failed and are left out of the scores; rerun to retry them")
+    return gold, done, counts, elapsed, cache, llm
+
+
+def write_outputs(args, gold, done, counts, elapsed, cache, llm):
+    out_dir = Path(args.out_dir)
+    # Only sentences with an answer are scored; failed ones stay out until a rerun succeeds.
+    scored = [i for i in range(len(gold)) if i in done]
+    gold_tags = [gold[i].tags for i in scored]
+    pred_tags = [done[i]["pred"] for i in scored]
+
+    pred_path = out_dir / "rag_predictions.conll"
+    with pred_path.open("w", encoding="utf-8") as f:
+        for ex, pred in zip((gold[i] for i in scored), pred_tags):
+            for tok, tag in zip(ex.tokens, pred):
+                f.write(f"{tok}\t{tag}\n")
+            f.write("\n")
+
+    metrics = micro_span_prf(gold_tags, pred_tags)
+    tag_counts = Counter(t for tags in pred_tags for t in tags)
+    ran = counts["sentences"]
+
+    results_txt = out_dir / "rag_results.txt"
+    with results_txt.open("w", encoding="utf-8") as f:
+        f.write(f"Gold: {args.conll}\n")
+        f.write(f"Pred: {pred_path}\n")
+        f.write(f"Scored: {len(scored)} of {len(gold)} sentences\n\n")
+        f.write(f"Precision: {metrics['precision']:.4f}\n")
+        f.write(f"Recall:    {metrics['recall']:.4f}\n")
+        f.write(f"F1 Score:  {metrics['f1']:.4f}\n\n")
+        f.write("Tag Distribution (Pred):\n")
+        f.write(f"{tag_counts}\n")
+
+    summary = {
+        "gold": str(args.conll),
+        "llm": llm.describe(),
+        "k": args.k,
+        "num_sentences": len(gold),
+        "num_scored": len(scored),
+        "num_missing": len(gold) - len(scored),
+        "precision": metrics["precision"],
+        "recall": metrics["recall"],
+        "f1": metrics["f1"],
+        "tp": metrics["tp"],
+        "fp": metrics["fp"],
+        "fn": metrics["fn"],
+        "run": {
+            "sentences_this_run": ran,
+            "elapsed_sec": elapsed,
+            "sentences_per_sec": ran / elapsed if elapsed else 0.0,
+            "concurrency": args.concurrency,
+            "rps_limit": args.rps,
+            "pack_size": args.pack_size,
+            "prompt_format": args.prompt_format,
+            "llm_requests": counts["requests"],
+            "prompt_tokens_per_sentence": counts["prompt_tokens"] / ran if ran else 0.0,
+            "completion_tokens_per_sentence": counts["completion_tokens"] / ran if ran else 0.0,
+            "sources": {key: v for key, v in counts.items() if key not in {"sentences", "requests", "prompt_tokens", "completion_tokens"}},
+        },
+        "llm_cache": cache.stats(),
+    }
+    summary_path = out_dir / "rag_metrics.json"
+    summary_path.write_text(json.dumps(summary, indent=2), encoding="utf-8")
+
+    print(f"P={metrics['precision']:.4f} R={metrics['recall']:.4f} F1={metrics['f1']:.4f}")
+    print(f"{ran} sentences in {elapsed:.1f}s ({summary['run']['sentences_per_sec']:.1f} sent/s)")
+    print(
+        f"pack_size={args.pack_size}: ~{summary['run']['prompt_tokens_per_sentence']:.0f} prompt tokens/sentence, "
+        f"{counts['requests']} LLM requests"
+    )
+    print("✅ Wrote:")
+    print(pred_path)
+    print(results_txt)
+    print(summary_path)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--conll", required=True, help="Gold CoNLL file (test.conll, survey CoNLL, ...)")
+    ap.add_argument("--rag_conll", default="Lux_Final.conll", help="Retrieval base (same file the Space indexes)")
+    ap.add_argument("--memory", default="rag_memory.jsonl")
+    ap.add_argument("--k", type=int, default=3)
+    ap.add_argument("--out_dir", default="eval_rag")
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--rps", type=float, default=0.0, help="Client-side request rate limit (0 = unlimited)")
+    ap.add_argument("--rate_limit_retries", type=int, default=5)
+    ap.add_argument("--rate_limit_pause", type=float, default=2.0, help="Seconds all workers pause after a 429")
+    ap.add_argument("--llm_cache", default="llm_cache.sqlite")
+    ap.add_argument("--max_sentences", type=int, default=0)
+    ap.add_argument("--fresh", action="store_true", help="Discard progress.jsonl in --out_dir instead of resuming")
+    ap.add_argument(
+        "--pack_size",
+        type=int,
+        default=1,
+        help="Sentences tagged per LLM request (1 = single-sentence prompts). "
+        "Compare runs with different values via prompt_tokens_per_sentence and sentences_per_sec.",
+    )
+    ap.add_argument("--prompt_format", choices=["bio", "compact"], default="bio")
+    ap.add_argument("--compact_budget", type=int, default=600, help="Estimated tokens available for compact examples")
+    ap.add_argument("--compact_candidates", type=int, default=20, help="Retrieved candidates offered to the compact packer")
+    args = ap.parse_args()
+    args.pack_size = max(1, args.pack_size)
+    if args.prompt_format == "compact" and args.pack_size > 1:
+        ap.error("--prompt_format compact tags one sentence per request; use --pack_size 1")
+
+    gold, done, counts, elapsed, cache, llm = asyncio.run(evaluate(args))
+    write_outputs(args, gold, done, counts, elapsed, cache, llm)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import bisect
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from llm_health import percentile
+
+# Seconds; covers sub-millisecond cache hits up to slow LLM round-trips.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Stage timings of the request currently being handled (None outside request()).
+_request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram as Prometheus expects it, plus a bounded window
+    of recent samples for the p50/p95/p99 shown in the Performance tab.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS, window: int = 1000):
+        self.buckets = tuple(sorted(buckets))
+        self.bucket_counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent: Deque[float] = deque(maxlen=window)
+
+    def observe(self, value: float) -> None:
+        idx = bisect.bisect_left(self.buckets, value)
+        if idx < len(self.buckets):
+            self.bucket_counts[idx] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        out = []
+        running = 0
+        for bound, n in zip(self.buckets, self.bucket_counts):
+            running += n
+            out.append((f"{bound:g}", running))
+        out.append(("+Inf", self.count))
+        return out
+
+
+class Metrics:
+    """
+    Thread-safe registry of per-stage latency histograms and named counters.
+
+        with metrics.stage("retrieval"):
+            results = rag.retrieve(query)
+
+    Timings also land in the per-request dict opened by request(), so a
+    handler can attach them to its output.
+    """
+
+    def __init__(self, namespace: str = "luxnlp", buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.namespace = namespace
+        self.buckets = tuple(buckets)
+        self._stages: Dict[str, Histogram] = {}
+        self._counters: Dict[Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float, timings: Optional[Dict[str, float]] = None) -> None:
+        with self._lock:
+            hist = self._stages.get(stage)
+            if hist is None:
+                hist = self._stages[stage] = Histogram(self.buckets)
+            hist.observe(seconds)
+
+        if timings is None:
+            timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str, timings: Optional[Dict[str, float]] = None) -> Iterator[None]:
+        """
+        Time a block. Generator handlers that yield across threads pass their
+        own timings dict instead of relying on request().
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, timings)
+
+    def inc(self, name: str, label: str = "", amount: float = 1.0) -> None:
+        with self._lock:
+            key = (name, label)
+            self._counters[key] = self._counters.get(key, 0.0) + amount
+
+    @contextmanager
+    def request(self) -> Iterator[Dict[str, float]]:
+        """Collect the stage timings of one request into the yielded dict."""
+        timings: Dict[str, float] = {}
+        token = _request_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            yield timings
+        finally:
+            timings["total"] = time.perf_counter() - start
+            _request_timings.reset(token)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            stages = {name: (h.count, h.sum, list(h.recent)) for name, h in self._stages.items()}
+
+        return {
+            name: {
+                "count": count,
+                "mean_ms": 1000 * total / count if count else 0.0,
+                "p50_ms": 1000 * percentile(recent, 50),
+                "p95_ms": 1000 * percentile(recent, 95),
+                "p99_ms": 1000 * percentile(recent, 99),
+            }
+            for name, (count, total, recent) in sorted(stages.items())
+        }
+
+    def format_summary(self) -> str:
+        summary = self.summary()
+        if not summary:
+            return "No requests measured yet."
+
+        lines = [f"{'stage':<20} {'count':>7} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9}"]
+        for name, s in summary.items():
+            lines.append(
+                f"{name:<20} {s['count']:>7} {s['mean_ms']:>7.1f}ms {s['p50_ms']:>7.1f}ms "
+                f"{s['p95_ms']:>7.1f}ms {s['p99_ms']:>7.1f}ms"
+            )
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+        if counters:
+            lines.append("")
+            for (name, label), value in counters:
+                lines.append(f"{name}{'[' + label + ']' if label else ''}: {value:g}")
+        return "\n".join(lines)
+
+    def render_prometheus(self) -> str:
+        ns = self.namespace
+        with self._lock:
+            stages = {name: (h.cumulative(), h.sum, h.count) for name, h in self._stages.items()}
+            counters = sorted(self._counters.items())
+
+        lines = [
+            f"# HELP {ns}_stage_seconds Latency of pipeline stages.",
+            f"# TYPE {ns}_stage_seconds histogram",
+        ]
+        for name, (cumulative, total, count) in sorted(stages.items()):
+            for bound, n in cumulative:
+                lines.append(f'{ns}_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {n}')
+            lines.append(f'{ns}_stage_seconds_sum{{stage="{name}"}} {total:.6f}')
+            lines.append(f'{ns}_stage_seconds_count{{stage="{name}"}} {count}')
+
+        seen = set()
+        for (name, label), value in counters:
+            if name not in seen:
+                lines.append(f"# TYPE {ns}_{name}_total counter")
+                seen.add(name)
+            suffix = f'{{kind="{label}"}}' if label else ""
+            lines.append(f"{ns}_{name}_total{suffix} {value:g}")
+
+        return "\n".join(lines) + "\n"
+
+
+def format_timings(timings: Dict[str, float]) -> str:
+    parts = [f"{name}={1000 * seconds:.0f}ms" for name, seconds in timings.items() if name != "total"]
+    if "total" in timings:
+        parts.append(f"total={1000 * timings['total']:.0f}ms")
+    return "Stage timings: " + " | ".join(parts)
+
+
+# Process-wide registry shared by the app modules.
+metrics = Metrics()
@@ -0,0 +1,415 @@
+from __future__ import annotations
+
+import json
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional
+
+Messages = List[Dict[str, str]]
+
+
+class LLMError(RuntimeError):
+    pass
+
+
+class CircuitOpenError(LLMError):
+    pass
+
+
+# =========================
+# CIRCUIT BREAKER
+# =========================
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for
+    `reset_timeout` seconds. After that a single trial call is let through
+    (half-open); success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = float(reset_timeout)
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+    def trip(self) -> None:
+        """Force the circuit open (e.g. from an external health check)."""
+        with self._lock:
+            self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def allow_trial(self) -> None:
+        """
+        Move an open circuit to half-open now (e.g. after a successful health
+        check), so the next real call decides whether it closes.
+        """
+        with self._lock:
+            if self._state() == "open":
+                self.opened_at = time.monotonic() - self.reset_timeout
+
+
+# =========================
+# BACKENDS
+# =========================
+def _is_retryable(exc: BaseException) -> bool:
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        response = getattr(exc, "response", None)
+        status = getattr(response, "status_code", None)
+    if status is None:
+        # Timeouts, connection resets, DNS failures ...
+        return True
+    return status == 429 or status >= 500
+
+
+class LLMBackend:
+    """
+    Base class: subclasses implement `_complete` for a single HTTP round-trip.
+    `chat` adds the per-call deadline, bounded retries with jitter and the circuit breaker.
+    """
+
+    provider = "base"
+
+    def __init__(
+        self,
+        model: str,
+        timeout: float = 20.0,
+        max_retries: int = 2,
+        backoff_base: float = 0.5,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.model = model
+        self.timeout = float(timeout)
+        self.max_retries = max(0, int(max_retries))
+        self.backoff_base = float(backoff_base)
+        self.breaker = breaker or CircuitBreaker()
+
+    @property
+    def available(self) -> bool:
+        return True
+
+    def describe(self) -> str:
+        return f"{self.provider} ({self.model})"
+
+    def _complete(self, messages: Messages, timeout: float, temperature: float, max_tokens: Optional[int]) -> str:
+        raise NotImplementedError
+
+    def chat(
+        self,
+        messages: Messages,
+        temperature: float = 0.0,
+        max_tokens: Optional[int] = None,
+        deadline: Optional[float] = None,
+    ) -> str:
+        """
+        deadline: total seconds for this call including retries (defaults to self.timeout).
+        Raises CircuitOpenError without touching the network while the circuit is open.
+        """
+        if not self.available:
+            raise LLMError(f"{self.provider} backend is not configured")
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.provider} circuit is open")
+
+        budget = self.timeout if deadline is None else float(deadline)
+        end = time.monotonic() + budget
+        last_error: Optional[BaseException] = None
+
+        for attempt in range(self.max_retries + 1):
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                content = self._complete(messages, remaining, temperature, max_tokens)
+                self.breaker.record_success()
+                return content
+            except Exception as e:
+                last_error = e
+                if not _is_retryable(e) or attempt == self.max_retries:
+                    break
+                # Full jitter exponential backoff, never past the deadline.
+                sleep = random.uniform(0, self.backoff_base * (2 ** attempt))
+                time.sleep(max(0.0, min(sleep, end - time.monotonic())))
+
+        self.breaker.record_failure()
+        if last_error is None:
+            raise LLMError(f"{self.provider} deadline of {budget:.1f}s exceeded")
+        raise LLMError(f"{self.provider} call failed: {type(last_error).__name__}: {last_error}") from last_error
+
+    def _stream(
+        self, messages: Messages, timeout: float, temperature: float, max_tokens: Optional[int]
+    ) -> Iterator[str]:
+        # Backends without native streaming deliver the whole answer as one chunk.
+        yield self._complete(messages, timeout, temperature, max_tokens)
+
+    def stream_chat(
+        self,
+        messages: Messages,
+        temperature: float = 0.0,
+        max_tokens: Optional[int] = None,
+        deadline: Optional[float] = None,
+        is_complete: Optional[Callable[[str], bool]] = None,
+    ) -> Iterator[str]:
+        """
+        Yield text deltas as the provider produces them. No retries: once output
+        has been shown it cannot be replayed. Closing the generator early closes
+        the HTTP response, which stops generation on the provider side.
+        When the provider ends the stream, is_complete(full_text) == False
+        counts as a failure and raises LLMError (e.g. a truncated answer).
+        """
+        if not self.available:
+            raise LLMError(f"{self.provider} backend is not configured")
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.provider} circuit is open")
+
+        budget = self.timeout if deadline is None else float(deadline)
+        end = time.monotonic() + budget
+        parts = []
+        try:
+            for delta in self._stream(messages, budget, temperature, max_tokens):
+                if time.monotonic() > end:
+                    raise TimeoutError(f"stream exceeded deadline of {budget:.1f}s")
+                parts.append(delta)
+                yield delta
+        except GeneratorExit:
+            # Consumer stopped early (enough lines): the call itself succeeded.
+            self.breaker.record_success()
+            raise
+        except Exception as e:
+            self.breaker.record_failure()
+            raise LLMError(f"{self.provider} stream failed: {type(e).__name__}: {e}") from e
+
+        if is_complete is not None and not is_complete("".join(parts)):
+            self.breaker.record_failure()
+            raise LLMError(f"{self.provider} stream failed: incomplete stream")
+        self.breaker.record_success()
+
+    def ping(self, timeout: float = 10.0) -> str:
+        """Single round-trip that bypasses retries and the circuit breaker (used by health probes)."""
+        return self._complete(
+            [
+                {"role": "system", "content": "Reply with OK only."},
+                {"role": "user", "content": "OK"},
+            ],
+            timeout,
+            0.0,
+            5,
+        )
+
+    def close(self) -> None:
+        pass
+
+
+class OpenAICompatibleBackend(LLMBackend):
+    """
+    Any server exposing POST {base_url}/chat/completions (vLLM, TGI, llama.cpp,
+    the local stub server). Uses one pooled keep-alive httpx client.
+    """
+
+    provider = "openai"
+
+    def __init__(self, model: str, base_url: str, api_key: str = "", max_connections: int = 16, **kwargs):
+        super().__init__(model, **kwargs)
+        import httpx
+
+        self.base_url = base_url.rstrip("/")
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self._client = httpx.Client(
+            base_url=self.base_url,
+            headers=headers,
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    def describe(self) -> str:
+        return f"{self.provider} ({self.model} @ {self.base_url})"
+
+    def _complete(self, messages, timeout, temperature, max_tokens):
+        payload = {"model": self.model, "messages": messages, "temperature": temperature}
+        if max_tokens:
+            payload["max_tokens"] = max_tokens
+
+        response = self._client.post("/chat/completions", json=payload, timeout=timeout)
+        response.raise_for_status()
+        return (response.json()["choices"][0]["message"]["content"] or "").strip()
+
+    def _stream(self, messages, timeout, temperature, max_tokens):
+        payload = {"model": self.model, "messages": messages, "temperature": temperature, "stream": True}
+        if max_tokens:
+            payload["max_tokens"] = max_tokens
+
+        with self._client.stream("POST", "/chat/completions", json=payload, timeout=timeout) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or [{}]
+                delta = (choices[0].get("delta") or {}).get("content")
+                if delta:
+                    yield delta
+
+    def close(self) -> None:
+        self._client.close()
+
+
+class GroqBackend(LLMBackend):
+    provider = "groq"
+
+    def __init__(self, model: str, api_key: str, **kwargs):
+        super().__init__(model, **kwargs)
+        self.api_key = api_key
+        self._client = None
+        if api_key:
+            from groq import Groq
+
+            # Retries are handled here, so the SDK's own retry loop is disabled.
+            self._client = Groq(api_key=api_key, timeout=self.timeout, max_retries=0)
+
+    @property
+    def available(self) -> bool:
+        return self._client is not None
+
+    def _complete(self, messages, timeout, temperature, max_tokens):
+        kwargs = {"model": self.model, "messages": messages, "temperature": temperature}
+        if max_tokens:
+            kwargs["max_tokens"] = max_tokens
+        response = self._client.with_options(timeout=timeout).chat.completions.create(**kwargs)
+        return (response.choices[0].message.content or "").strip()
+
+    def _stream(self, messages, timeout, temperature, max_tokens):
+        kwargs = {"model": self.model, "messages": messages, "temperature": temperature, "stream": True}
+        if max_tokens:
+            kwargs["max_tokens"] = max_tokens
+        stream = self._client.with_options(timeout=timeout).chat.completions.create(**kwargs)
+        try:
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    yield delta
+        finally:
+            stream.close()
+
+    def close(self) -> None:
+        if self._client is not None:
+            self._client.close()
+
+
+class HFInferenceBackend(LLMBackend):
+    provider = "hf"
+
+    def __init__(self, model: str, token: str = "", **kwargs):
+        super().__init__(model, **kwargs)
+        from huggingface_hub import InferenceClient
+
+        self.token = token
+        self._client_class = InferenceClient
+
+    def _client(self, timeout):
+        # The client timeout is fixed at construction, so each attempt gets a
+        # client bounded by the time left before the caller's deadline.
+        return self._client_class(model=self.model, token=self.token or None, timeout=timeout)
+
+    @property
+    def available(self) -> bool:
+        return bool(self.token)
+
+    def _complete(self, messages, timeout, temperature, max_tokens):
+        kwargs = {"messages": messages, "max_tokens": max_tokens or 512}
+        # TGI rejects temperature == 0; greedy decoding is its default anyway.
+        if temperature > 0:
+            kwargs["temperature"] = temperature
+        response = self._client(timeout).chat_completion(**kwargs)
+        return (response.choices[0].message.content or "").strip()
+
+    def _stream(self, messages, timeout, temperature, max_tokens):
+        kwargs = {"messages": messages, "max_tokens": max_tokens or 512, "stream": True}
+        if temperature > 0:
+            kwargs["temperature"] = temperature
+        for chunk in self._client(timeout).chat_completion(**kwargs):
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                yield delta
+
+
+# =========================
+# FACTORY
+# =========================
+def backend_from_env() -> LLMBackend:
+    """
+    LLM_PROVIDER: groq (default) | hf | openai
+    LLM_MODEL, LLM_BASE_URL, LLM_API_KEY, LLM_TIMEOUT, LLM_MAX_RETRIES,
+    LLM_BREAKER_FAILURES, LLM_BREAKER_RESET
+    """
+    provider = os.getenv("LLM_PROVIDER", "groq").strip().lower()
+    common = dict(
+        timeout=float(os.getenv("LLM_TIMEOUT", "20")),
+        max_retries=int(os.getenv("LLM_MAX_RETRIES", "2")),
+        breaker=CircuitBreaker(
+            failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+            reset_timeout=float(os.getenv("LLM_BREAKER_RESET", "30")),
+        ),
+    )
+    model = os.getenv("LLM_MODEL", "").strip()
+
+    if provider == "hf":
+        return HFInferenceBackend(
+            model=model or os.getenv("HF_LLM_MODEL", "meta-llama/Meta-Llama-3-8B-Instruct").strip(),
+            token=os.getenv("HF_TOKEN", "").strip(),
+            **common,
+        )
+    if provider == "openai":
+        return OpenAICompatibleBackend(
+            model=model or "stub-ner",
+            base_url=os.getenv("LLM_BASE_URL", "http://127.0.0.1:8008/v1").strip(),
+            api_key=os.getenv("LLM_API_KEY", "").strip(),
+            **common,
+        )
+    if provider != "groq":
+        raise ValueError(f"Unknown LLM_PROVIDER: {provider}")
+
+    return GroqBackend(
+        model=model or "llama-3.1-8b-instant",
+        api_key=os.getenv("GROQ_API_KEY", "").strip(),
+        **common,
+    )
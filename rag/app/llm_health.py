@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from llm_backends import LLMBackend
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(q / 100.0 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+class LLMHealth:
+    """
+    Shared provider health state.
+
+    Fed by the background prober and by real prediction calls, read by the
+    LLM Debug tab and by the prediction path (no network call per read).
+    """
+
+    def __init__(self, window: int = 200):
+        self._samples: Deque[Tuple[float, bool, float]] = deque(maxlen=window)  # (timestamp, ok, latency)
+        self._lock = threading.Lock()
+        self.last_success: Optional[float] = None
+        self.last_failure: Optional[float] = None
+        self.last_error: str = ""
+        self.last_probe: Optional[float] = None
+
+    def record(self, ok: bool, latency: float, error: str = "", probe: bool = False) -> None:
+        now = time.time()
+        with self._lock:
+            self._samples.append((now, ok, latency))
+            if ok:
+                self.last_success = now
+            else:
+                self.last_failure = now
+                self.last_error = error
+            if probe:
+                self.last_probe = now
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = list(self._samples)
+            last_success, last_failure = self.last_success, self.last_failure
+            last_error, last_probe = self.last_error, self.last_probe
+
+        latencies = [lat for _, ok, lat in samples if ok]
+        errors = sum(1 for _, ok, _ in samples if not ok)
+        return {
+            "samples": len(samples),
+            "error_rate": (errors / len(samples)) if samples else 0.0,
+            "p50_ms": 1000 * percentile(latencies, 50),
+            "p95_ms": 1000 * percentile(latencies, 95),
+            "p99_ms": 1000 * percentile(latencies, 99),
+            "last_success": last_success,
+            "last_failure": last_failure,
+            "last_error": last_error,
+            "last_probe": last_probe,
+        }
+
+    def format(self) -> str:
+        s = self.snapshot()
+
+        def ago(ts):
+            return "never" if ts is None else f"{time.time() - ts:.0f}s ago"
+
+        lines = [
+            f"Health samples: {s['samples']} | error rate={s['error_rate']:.1%}",
+            f"Latency p50={s['p50_ms']:.0f}ms p95={s['p95_ms']:.0f}ms p99={s['p99_ms']:.0f}ms",
+            f"Last success: {ago(s['last_success'])} | last failure: {ago(s['last_failure'])}",
+            f"Last probe: {ago(s['last_probe'])}",
+        ]
+        if s["last_error"]:
+            lines.append(f"Last error: {s['last_error']}")
+        return "\n".join(lines)
+
+
+class HealthProber:
+    """
+    Periodically sends a tiny completion to the backend and records the result.
+    A failed probe counts as one breaker failure, so the circuit opens after
+    failure_threshold failures of probes and real calls combined. While the
+    circuit is open the probe still runs (bypassing the breaker); a success
+    only makes it half-open, because a 5-token ping can pass while real NER
+    calls still fail. The next real call then decides whether it closes.
+    """
+
+    def __init__(self, backend: LLMBackend, health: LLMHealth, interval: float = 60.0, timeout: float = 10.0):
+        self.backend = backend
+        self.health = health
+        self.interval = float(interval)
+        self.timeout = float(timeout)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def probe_once(self) -> bool:
+        if not self.backend.available:
+            return False
+
+        start = time.perf_counter()
+        try:
+            # The probe must reach the provider even when the circuit is open.
+            self.backend.ping(self.timeout)
+        except Exception as e:
+            self.health.record(False, time.perf_counter() - start, f"{type(e).__name__}: {e}", probe=True)
+            self.backend.breaker.record_failure()
+            return False
+
+        self.health.record(True, time.perf_counter() - start, probe=True)
+        self.backend.breaker.allow_trial()
+        return True
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.probe_once()
+            self._stop.wait(self.interval)
+
+    def start(self) -> "HealthProber":
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name="llm-health", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
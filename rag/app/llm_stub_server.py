@@ -0,0 +1,230 @@
+"""
+Local OpenAI-compatible stub LLM for offline latency and failure testing.
+
+It answers POST /v1/chat/completions by tagging the NEW SENTENCE of the NER
+prompt with a trivial capitalisation rule, after an injectable delay, and can
+fail a configurable fraction of requests. Requests with "stream": true are
+answered as server-sent events, one line per chunk, with the latency spread
+over the lines (first chunk after a fraction of it) like a real provider.
+
+Run:
+    python llm_stub_server.py --port 8008 --latency_ms 400 --failure_rate 0.1
+Point the app at it:
+    LLM_PROVIDER=openai LLM_BASE_URL=http://127.0.0.1:8008/v1 python app.py
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Tuple
+
+
+def extract_query(prompt: str) -> str:
+    marker = "NEW SENTENCE:"
+    if marker not in prompt:
+        return prompt.strip().splitlines()[-1] if prompt.strip() else ""
+    tail = prompt.split(marker, 1)[1].strip()
+    return tail.split("\n\n", 1)[0].strip()
+
+
+def stub_tags(tokens: List[str]) -> List[str]:
+    tags = []
+    prev_entity = False
+    for i, tok in enumerate(tokens):
+        if i > 0 and tok[:1].isupper() and tok[1:2].islower():
+            tags.append("I-LOC" if prev_entity else "B-LOC")
+            prev_entity = True
+        else:
+            tags.append("O")
+            prev_entity = False
+    return tags
+
+
+def extract_packed_queries(prompt: str) -> List[str]:
+    tail = prompt.split("NEW SENTENCES:", 1)[1].strip().split("\n\n", 1)[0]
+    queries = []
+    for line in tail.splitlines():
+        if line.startswith("###"):
+            queries.append("")
+        elif queries:
+            queries[-1] = (queries[-1] + " " + line).strip()
+    return queries
+
+
+def tag_block(query: str) -> str:
+    tokens = query.split()
+    return "\n".join(f"{t}\t{y}" for t, y in zip(tokens, stub_tags(tokens)))
+
+
+def entity_lines(query: str) -> str:
+    tokens = query.split()
+    entities = []
+    for tok, tag in zip(tokens, stub_tags(tokens)):
+        if tag.startswith("I-") and entities:
+            entities[-1][0] += " " + tok
+        elif tag != "O":
+            entities.append([tok, tag[2:]])
+    return "\n".join(f"{text}|{typ}" for text, typ in entities) or "NONE"
+
+
+def stub_answer(prompt: str) -> str:
+    if "List the entities of the NEW SENTENCE" in prompt:
+        return entity_lines(extract_query(prompt))
+    if "NEW SENTENCES:" in prompt:
+        queries = extract_packed_queries(prompt)
+        return "\n".join(f"### {i}\n{tag_block(q)}" for i, q in enumerate(queries, start=1))
+    return tag_block(extract_query(prompt))
+
+
+class StubConfig:
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, failure_rate: float = 0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def delay(self) -> float:
+        return max(0.0, self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000.0
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config: StubConfig = StubConfig()
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, payload: dict, content: str, delay: float) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        lines = content.split("\n")
+        time.sleep(delay * 0.2)
+        per_line = delay * 0.8 / max(1, len(lines))
+        model = payload.get("model", "stub-ner")
+        try:
+            for i, line in enumerate(lines):
+                text = line + ("\n" if i < len(lines) - 1 else "")
+                chunk = {
+                    "id": f"stub-{self.config.requests}",
+                    "object": "chat.completion.chunk",
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                time.sleep(per_line)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Client stopped reading early (enough lines parsed).
+            pass
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/health"):
+            cfg = self.config
+            self._send_json(200, {"status": "ok", "requests": cfg.requests, "failures": cfg.failures})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", "0") or 0)
+        payload = json.loads(self.rfile.read(length) or b"{}")
+
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": "not found"})
+            return
+
+        cfg = self.config
+        with cfg.lock:
+            cfg.requests += 1
+            fail = random.random() < cfg.failure_rate
+            if fail:
+                cfg.failures += 1
+
+        delay = cfg.delay()
+        streaming = bool(payload.get("stream"))
+        if not streaming or fail:
+            time.sleep(delay)
+        if fail:
+            self._send_json(503, {"error": {"message": "stub failure", "type": "server_error"}})
+            return
+
+        messages = payload.get("messages", [])
+        prompt = messages[-1]["content"] if messages else ""
+        content = stub_answer(prompt)
+
+        if streaming:
+            self._send_stream(payload, content, delay)
+            return
+
+        self._send_json(
+            200,
+            {
+                "id": f"stub-{cfg.requests}",
+                "object": "chat.completion",
+                "model": payload.get("model", "stub-ner"),
+                "choices": [
+                    {"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}
+                ],
+                "usage": {"prompt_tokens": len(prompt.split()), "completion_tokens": len(content.split())},
+            },
+        )
+
+
+def start_stub_server(
+    host: str = "127.0.0.1",
+    port: int = 0,
+    latency_ms: float = 0.0,
+    jitter_ms: float = 0.0,
+    failure_rate: float = 0.0,
+) -> Tuple[ThreadingHTTPServer, str]:
+    """
+    Start the stub in a daemon thread. port=0 picks a free port.
+    Returns (server, base_url) where base_url ends with /v1.
+    """
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"config": StubConfig(latency_ms, jitter_ms, failure_rate)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8008)
+    ap.add_argument("--latency_ms", type=float, default=300.0)
+    ap.add_argument("--jitter_ms", type=float, default=100.0)
+    ap.add_argument("--failure_rate", type=float, default=0.0)
+    args = ap.parse_args()
+
+    server, base_url = start_stub_server(args.host, args.port, args.latency_ms, args.jitter_ms, args.failure_rate)
+    print(f"Stub LLM listening on {base_url} (latency={args.latency_ms}ms ±{args.jitter_ms}ms, failure_rate={args.failure_rate})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
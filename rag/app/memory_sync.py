@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+from huggingface_hub import get_hf_file_metadata, hf_hub_download, hf_hub_url
+
+from instrumentation import metrics
+
+
+def copy_file_atomic(src: str | Path, dst: str | Path) -> None:
+    """Streamed copy to a temp file next to dst, then rename over it."""
+    dst = Path(dst)
+    tmp = dst.with_name(dst.name + ".tmp")
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+class MemorySync:
+    """
+    Offline-first sync of the dynamic memory files from the dataset repo.
+
+    A manifest in cache_dir remembers the ETag and commit of every file that
+    was last copied into place. A refresh sends one metadata request per file
+    and downloads only what changed. At startup, sync_at_startup() waits at most
+    `startup_timeout` seconds. If the Hub is slow, the app starts with the local
+    copies and the refresh finishes in the background.
+
+    subscribe(callback) registers callback(changed_filenames), called after
+    files were replaced so the retrieval index can be rebuilt. Hold `lock`
+    while appending to or uploading a memory file so a refresh never replaces
+    it halfway.
+    """
+
+    def __init__(
+        self,
+        repo_id: str,
+        filenames: Iterable[str],
+        cache_dir: str | Path = ".memory_cache",
+        token: Optional[str] = None,
+        metadata_timeout: float = 10.0,
+    ):
+        self.repo_id = repo_id
+        self.filenames = list(filenames)
+        self.cache_dir = Path(cache_dir)
+        self.token = token
+        self.metadata_timeout = float(metadata_timeout)
+        self.on_update: Optional[Callable[[List[str]], None]] = None
+        self._pending: List[str] = []
+        self.lock = threading.RLock()
+        self.last_refresh: Optional[float] = None
+        self.last_error = ""
+        self._manifest_path = self.cache_dir / "manifest.json"
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest: Dict[str, Dict] = self._load_manifest()
+
+    def _load_manifest(self) -> Dict[str, Dict]:
+        try:
+            return json.loads(self._manifest_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self) -> None:
+        tmp = self._manifest_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self.manifest, indent=2), encoding="utf-8")
+        os.replace(tmp, self._manifest_path)
+
+    def ensure_local(self) -> None:
+        for filename in self.filenames:
+            if not Path(filename).exists():
+                Path(filename).write_text("", encoding="utf-8")
+
+    @staticmethod
+    def _local_state(filename: str):
+        try:
+            stat = Path(filename).stat()
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def refresh_file(self, filename: str) -> bool:
+        """Returns True when the local copy was replaced."""
+        # The metadata call and the download run without the lock. The state
+        # seen here is compared again under the lock before the copy.
+        with self.lock:
+            known = dict(self.manifest.get(filename, {}))
+            local_state = self._local_state(filename)
+
+        url = hf_hub_url(self.repo_id, filename, repo_type="dataset")
+        meta = get_hf_file_metadata(url, token=self.token, timeout=self.metadata_timeout)
+        unchanged = (meta.etag and known.get("etag") == meta.etag) or (
+            meta.commit_hash and known.get("revision") == meta.commit_hash
+        )
+        if unchanged and Path(filename).exists():
+            return False
+
+        with metrics.stage("memory_download"):
+            downloaded = hf_hub_download(
+                repo_id=self.repo_id,
+                repo_type="dataset",
+                filename=filename,
+                revision=meta.commit_hash,
+                token=self.token,
+                cache_dir=str(self.cache_dir / "hub"),
+            )
+        with self.lock:
+            # An append or upload (mark_uploaded) in the meantime made the
+            # download older than the local file; the next refresh compares again.
+            if self.manifest.get(filename, {}) != known or self._local_state(filename) != local_state:
+                return False
+            copy_file_atomic(downloaded, filename)
+            self.manifest[filename] = {
+                "etag": meta.etag,
+                "revision": meta.commit_hash,
+                "size": meta.size,
+                "synced_at": time.time(),
+            }
+            self._save_manifest()
+        return True
+
+    def refresh(self) -> List[str]:
+        changed = []
+        for filename in self.filenames:
+            try:
+                if self.refresh_file(filename):
+                    changed.append(filename)
+            except Exception as e:
+                self.last_error = f"{filename}: {type(e).__name__}: {e}"
+                print(f"Memory sync failed for {self.last_error}")
+        self.last_refresh = time.time()
+
+        if changed:
+            with self.lock:
+                callback = self.on_update
+                if callback is None:
+                    self._pending.extend(f for f in changed if f not in self._pending)
+            if callback is not None:
+                callback(changed)
+        return changed
+
+    def subscribe(self, callback: Callable[[List[str]], None], replay: bool = True) -> None:
+        """
+        replay=True delivers changes that landed before anyone subscribed, e.g. a
+        startup refresh that finished after the index was already built.
+        """
+        with self.lock:
+            self.on_update = callback
+            pending, self._pending = self._pending, []
+        if pending and replay:
+            callback(pending)
+
+    def mark_uploaded(self, filename: str, etag: Optional[str] = None, revision: Optional[str] = None) -> None:
+        """Record our own upload so the next refresh does not download it back."""
+        with self.lock:
+            self.manifest[filename] = {
+                "etag": etag,
+                "revision": revision,
+                "size": Path(filename).stat().st_size if Path(filename).exists() else 0,
+                "synced_at": time.time(),
+            }
+            self._save_manifest()
+
+    def sync_at_startup(self, startup_timeout: float = 5.0) -> bool:
+        """
+        Refresh with a deadline. Returns True when the refresh finished in time;
+        otherwise the local files are used and the refresh keeps running.
+        """
+        self.ensure_local()
+        worker = threading.Thread(target=self.refresh, name="memory-sync-startup", daemon=True)
+        worker.start()
+        worker.join(timeout=startup_timeout)
+        if worker.is_alive():
+            print(f"Memory sync still running after {startup_timeout:g}s, starting with cached files")
+            return False
+        return True
+
+    def _run(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            self.refresh()
+
+    def start_background(self, interval: float) -> "MemorySync":
+        if self._thread is None and interval > 0:
+            self._thread = threading.Thread(target=self._run, args=(interval,), name="memory-sync", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def format_status(self) -> str:
+        lines = []
+        for filename in self.filenames:
+            entry = self.manifest.get(filename)
+            if entry:
+                age = time.time() - entry["synced_at"]
+                lines.append(f"{filename}: revision {str(entry.get('revision'))[:8]} synced {age:.0f}s ago")
+            else:
+                lines.append(f"{filename}: not synced (local copy only)")
+        if self.last_error:
+            lines.append(f"Last sync error: {self.last_error}")
+        return "\n".join(lines)
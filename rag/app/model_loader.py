@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+
+import torch
+from transformers import AutoConfig, AutoModelForTokenClassification, AutoTokenizer
+
+SAFETENSORS_NAME = "model.safetensors"
+DEFAULT_WARMUP_LENGTHS = (8, 32, 128)
+
+
+def configure_threads(num_threads: Optional[int] = None) -> int:
+    """
+    Pin the torch intra-op thread count.
+    Defaults to TORCH_NUM_THREADS, otherwise the number of CPUs visible to this process.
+    """
+    if not num_threads:
+        num_threads = int(os.getenv("TORCH_NUM_THREADS", "0") or 0)
+    if not num_threads:
+        try:
+            num_threads = len(os.sched_getaffinity(0))
+        except AttributeError:
+            num_threads = os.cpu_count() or 1
+
+    torch.set_num_threads(num_threads)
+    return num_threads
+
+
+def _resolve_safetensors(model_id: str | Path, revision: Optional[str], token: Optional[str]) -> Optional[Path]:
+    local = Path(model_id)
+    if local.is_dir():
+        path = local / SAFETENSORS_NAME
+        return path if path.exists() else None
+
+    try:
+        from huggingface_hub import hf_hub_download
+
+        return Path(
+            hf_hub_download(
+                repo_id=str(model_id),
+                filename=SAFETENSORS_NAME,
+                revision=revision,
+                token=token,
+            )
+        )
+    except Exception:
+        return None
+
+
+@contextmanager
+def _parameters_on_meta():
+    """
+    Create every nn.Parameter on the meta device: no memory is allocated and the
+    random initialisation is a no-op. Buffers (e.g. position_ids) stay real because
+    they are not in the checkpoint. Only relies on torch, so it works the same
+    with transformers 4.x and 5.x.
+    """
+    register_parameter = torch.nn.Module.register_parameter
+
+    def register_on_meta(module, name, param):
+        register_parameter(module, name, param)
+        if param is not None:
+            module._parameters[name] = torch.nn.Parameter(param.to("meta"), requires_grad=param.requires_grad)
+
+    torch.nn.Module.register_parameter = register_on_meta
+    try:
+        yield
+    finally:
+        torch.nn.Module.register_parameter = register_parameter
+
+
+def _load_mmap_model(config, weights_path: Path):
+    """
+    Build the model with meta parameters, then swap in tensors that are backed
+    by a private memory map of the safetensors file. Pages stay in the OS page
+    cache and are shared by every process that maps the same file.
+    """
+    from safetensors import safe_open
+
+    with _parameters_on_meta():
+        model = AutoModelForTokenClassification.from_config(config)
+
+    state_dict = {}
+    with safe_open(str(weights_path), framework="pt", device="cpu") as f:
+        for key in f.keys():
+            state_dict[key] = f.get_tensor(key)
+
+    # Checkpoints saved from the bare encoder may lack the task prefix.
+    expected = set(model.state_dict().keys())
+    prefix = model.base_model_prefix + "."
+    if not (set(state_dict) & expected):
+        state_dict = {prefix + k: v for k, v in state_dict.items()}
+
+    missing, _ = model.load_state_dict(state_dict, strict=False, assign=True)
+    buffer_names = {name for name, _ in model.named_buffers()}
+    missing = [k for k in missing if k not in buffer_names]
+    if missing:
+        raise RuntimeError(f"Missing weights in {weights_path}: {missing[:5]}")
+    still_meta = [name for name, p in model.named_parameters() if p.is_meta]
+    if still_meta:
+        raise RuntimeError(f"Parameters not loaded from {weights_path}: {still_meta[:5]}")
+
+    model.tie_weights()
+    return model
+
+
+@torch.no_grad()
+def warm_up(model, tokenizer, lengths: Iterable[int] = DEFAULT_WARMUP_LENGTHS, batch_size: int = 1) -> float:
+    """
+    Run dummy forwards over typical sequence lengths so lazy initialisation
+    (allocator pools, kernel selection) is paid at startup, not on the first request.
+    Returns the time spent in seconds.
+    """
+    start = time.perf_counter()
+    pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else 0
+    filler_id = tokenizer.unk_token_id if tokenizer.unk_token_id is not None else pad_id
+    device = next(model.parameters()).device
+
+    for length in lengths:
+        length = max(2, int(length))
+        input_ids = torch.full((batch_size, length), filler_id, dtype=torch.long, device=device)
+        if tokenizer.cls_token_id is not None:
+            input_ids[:, 0] = tokenizer.cls_token_id
+        if tokenizer.sep_token_id is not None:
+            input_ids[:, -1] = tokenizer.sep_token_id
+        attention_mask = torch.ones_like(input_ids)
+        model(input_ids=input_ids, attention_mask=attention_mask)
+
+    return time.perf_counter() - start
+
+
+def load_token_classifier(
+    model_id: str | Path,
+    revision: Optional[str] = None,
+    token: Optional[str] = None,
+    num_threads: Optional[int] = None,
+    warmup_lengths: Iterable[int] = (),
+    warmup_batch_size: int = 1,
+    device: str = "cpu",
+    tokenizer_dir: Optional[str | Path] = None,
+) -> Tuple[object, object]:
+    """
+    Load tokenizer + token-classification model.
+    The tokenizer comes from tokenizer_dir when given, otherwise from model_id.
+
+    On CPU the safetensors weights are memory-mapped instead of copied, so several
+    processes serving the same checkpoint share one copy in the page cache.
+    Falls back to a regular from_pretrained when no safetensors file is available.
+    """
+    configure_threads(num_threads)
+
+    if tokenizer_dir is not None:
+        tokenizer = AutoTokenizer.from_pretrained(tokenizer_dir, token=token, use_fast=True)
+    else:
+        tokenizer = AutoTokenizer.from_pretrained(model_id, revision=revision, token=token, use_fast=True)
+    config = AutoConfig.from_pretrained(model_id, revision=revision, token=token)
+
+    weights_path = _resolve_safetensors(model_id, revision, token)
+    model = None
+    if weights_path is not None:
+        try:
+            model = _load_mmap_model(config, weights_path)
+        except Exception as e:
+            print(f"[WARN] mmap load failed ({e}); falling back to from_pretrained")
+
+    if model is None:
+        model = AutoModelForTokenClassification.from_pretrained(model_id, revision=revision, token=token)
+
+    model.to(device)
+    model.eval()
+
+    warmup_lengths = list(warmup_lengths)
+    if warmup_lengths:
+        elapsed = warm_up(model, tokenizer, warmup_lengths, batch_size=warmup_batch_size)
+        print(f"Warm-up over lengths {warmup_lengths} took {elapsed:.2f}s")
+
+    return tokenizer, model
+
+
+def parse_lengths(value: str) -> Tuple[int, ...]:
+    return tuple(int(x) for x in (value or "").replace(" ", "").split(",") if x)
@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+
+from document_segmentation import segment_document
+from instrumentation import metrics
+from ner_metrics import spans_from_bio
+from parallel_branches import run_branches
+
+# words -> (labels, margins), one entry per input sentence
+BatchTagger = Callable[[List[List[str]]], List[Tuple[List[str], List[float]]]]
+# (words, k) -> (labels, mode); mode as returned by predict_rag
+RagTagger = Callable[[List[str], int], Tuple[List[str], str]]
+
+MODES = ("xlmr", "rag", "auto")
+
+
+class NERRequest(BaseModel):
+    """
+    Exactly one of `sentences` (whitespace-tokenized text), `tokens` (pre-split
+    words) or `document` (free text, split into sentences and tokenized like the
+    training data; span offsets then refer to the document).
+
+    mode: "xlmr" tags everything with the fine-tuned model in batches,
+    "rag" sends every sentence through retrieval + LLM, "auto" runs XLM-R first
+    and escalates only low-margin sentences to RAG.
+    """
+
+    sentences: Optional[List[str]] = None
+    tokens: Optional[List[List[str]]] = None
+    document: Optional[str] = None
+    mode: str = "xlmr"
+    k: int = 3
+    return_confidences: bool = False
+
+
+def token_offsets(text: str, tokens: Sequence[str]) -> List[Tuple[int, int]]:
+    """Character (start, end) of each token, searched left to right in text."""
+    offsets = []
+    pos = 0
+    for tok in tokens:
+        start = text.find(tok, pos)
+        if start < 0:
+            start = pos
+        end = start + len(tok)
+        offsets.append((start, end))
+        pos = end
+    return offsets
+
+
+def build_result(
+    text: str,
+    words: List[str],
+    labels: List[str],
+    margins: Optional[List[float]],
+    mode: str,
+    return_confidences: bool,
+    offsets: Optional[List[Tuple[int, int]]] = None,
+    char_base: Optional[int] = None,
+) -> Dict:
+    """
+    offsets are token positions within text (searched when omitted). char_base,
+    the sentence start in a document, is added to every character offset and
+    returned as start_char.
+    """
+    if offsets is None:
+        offsets = token_offsets(text, words)
+    base = char_base or 0
+    spans = []
+    for start, end, typ in spans_from_bio(labels):
+        span = {
+            "type": typ,
+            "text": text[offsets[start][0]:offsets[end - 1][1]],
+            "start_token": start,
+            "end_token": end,
+            "start_char": base + offsets[start][0],
+            "end_char": base + offsets[end - 1][1],
+        }
+        if return_confidences and margins is not None:
+            span["confidence"] = round(min(margins[start:end]), 4)
+        spans.append(span)
+
+    result = {"text": text, "tokens": words, "tags": labels, "spans": spans, "mode": mode}
+    if char_base is not None:
+        result["start_char"] = char_base
+    if return_confidences:
+        result["confidences"] = None if margins is None else [round(m, 4) for m in margins]
+    return result
+
+
+def create_ner_router(
+    tag_batch: BatchTagger,
+    tag_rag: RagTagger,
+    max_sentences: int = 5000,
+    max_words: int = 512,
+    max_document_chars: int = 100_000,
+    max_rag_sentences: int = 32,
+    margin_threshold: float = 0.9,
+    rag_timeout: float = 30.0,
+) -> APIRouter:
+    """
+    POST /api/ner for batches of sentences or a whole document.
+
+    XLM-R runs over the whole batch at once; RAG calls (one LLM round-trip per
+    sentence) are capped at max_rag_sentences per request and run concurrently.
+    Limits are enforced with 413 before any model work starts.
+    """
+    router = APIRouter(prefix="/api")
+
+    def run_rag(inputs: List[List[str]], indices: List[int], k: int) -> Dict[int, Tuple[List[str], str]]:
+        branches = run_branches(
+            {str(i): (lambda words=inputs[i]: tag_rag(words, k)) for i in indices},
+            timeouts=rag_timeout,
+        )
+        return {int(name): branch.value for name, branch in branches.items() if branch.ok}
+
+    @router.post("/ner")
+    def ner(request: NERRequest):
+        start = time.perf_counter()
+
+        given = [request.sentences is not None, request.tokens is not None, request.document is not None]
+        if sum(given) != 1:
+            raise HTTPException(
+                status_code=422, detail="Provide exactly one of 'sentences', 'tokens' or 'document'."
+            )
+        if request.mode not in MODES:
+            raise HTTPException(status_code=422, detail=f"mode must be one of {', '.join(MODES)}.")
+
+        # Document sentences carry their own token offsets, relative to each sentence.
+        offsets: List[Optional[List[Tuple[int, int]]]] = []
+        bases: List[Optional[int]] = []
+        if request.document is not None:
+            if len(request.document) > max_document_chars:
+                raise HTTPException(status_code=413, detail=f"At most {max_document_chars} characters per document.")
+            with metrics.stage("api_segment"):
+                segments = segment_document(request.document)
+            texts = [seg.text for seg in segments]
+            inputs = [seg.tokens for seg in segments]
+            offsets = [[(a - seg.start, b - seg.start) for a, b in seg.offsets] for seg in segments]
+            bases = [seg.start for seg in segments]
+        elif request.sentences is not None:
+            texts = [s.strip() for s in request.sentences]
+            inputs = [t.split() for t in texts]
+        else:
+            inputs = [[w for w in words if w.strip()] for words in request.tokens]
+            texts = [" ".join(words) for words in inputs]
+        offsets = offsets or [None] * len(inputs)
+        bases = bases or [None] * len(inputs)
+
+        if len(inputs) > max_sentences:
+            raise HTTPException(status_code=413, detail=f"At most {max_sentences} sentences per request.")
+        # Long document sentences are fine: the tagger windows them.
+        longest = max((len(words) for words in inputs), default=0)
+        if request.document is None and longest > max_words:
+            raise HTTPException(status_code=413, detail=f"At most {max_words} tokens per sentence.")
+        if request.mode == "rag" and len(inputs) > max_rag_sentences:
+            raise HTTPException(
+                status_code=413, detail=f"At most {max_rag_sentences} sentences per request in rag mode."
+            )
+
+        k = max(1, min(int(request.k), 10))
+        metrics.inc("api_requests", request.mode)
+        metrics.inc("api_sentences", request.mode, len(inputs))
+
+        results: List[Tuple[List[str], Optional[List[float]], str]] = []
+        if request.mode == "rag":
+            rag_out = run_rag(inputs, list(range(len(inputs))), k)
+            missing = [i for i in range(len(inputs)) if i not in rag_out]
+            fallback = dict(zip(missing, tag_batch([inputs[i] for i in missing]))) if missing else {}
+            for i in range(len(inputs)):
+                if i in rag_out:
+                    labels, mode = rag_out[i]
+                    results.append((labels, None, mode))
+                else:
+                    labels, margins = fallback[i]
+                    results.append((labels, margins, "fallback_xlmr"))
+        else:
+            with metrics.stage("api_xlmr_batch"):
+                tagged = tag_batch(inputs)
+            results = [(labels, margins, "xlmr") for labels, margins in tagged]
+
+            if request.mode == "auto":
+                uncertain = [
+                    i for i, (_, margins) in enumerate(tagged)
+                    if margins and min(margins) < margin_threshold
+                ]
+                # Escalate the least confident sentences first when over budget.
+                uncertain.sort(key=lambda i: min(tagged[i][1]))
+                for i, (labels, mode) in run_rag(inputs, uncertain[:max_rag_sentences], k).items():
+                    if mode == "real_llm":
+                        results[i] = (labels, None, mode)
+                results = [
+                    (labels, margins, "xlmr_confident" if mode == "xlmr" and i not in uncertain else mode)
+                    for i, (labels, margins, mode) in enumerate(results)
+                ]
+
+        return {
+            "mode": request.mode,
+            "count": len(inputs),
+            "elapsed_ms": round(1000 * (time.perf_counter() - start), 1),
+            "results": [
+                build_result(text, words, labels, margins, mode, request.return_confidences, offs, base)
+                for text, words, (labels, margins, mode), offs, base in zip(texts, inputs, results, offsets, bases)
+            ],
+        }
+
+    return router
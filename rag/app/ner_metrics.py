@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+
+def spans_from_bio(labels: Sequence[str]) -> List[Tuple[int, int, str]]:
+    """
+    BIO labels -> exact-match spans (start, end_exclusive, type).
+    Same rule as scripts/model/evaluation/eval_xlmr_conll_spanf1.py.
+    """
+    spans = []
+    i = 0
+    while i < len(labels):
+        y = labels[i]
+        if y.startswith("B-"):
+            typ = y[2:]
+            j = i + 1
+            while j < len(labels) and labels[j] == f"I-{typ}":
+                j += 1
+            spans.append((i, j, typ))
+            i = j
+        else:
+            i += 1
+    return spans
+
+
+def micro_span_prf(gold_list: Iterable[Sequence[str]], pred_list: Iterable[Sequence[str]]) -> Dict[str, float]:
+    tp = fp = fn = 0
+    for gold, pred in zip(gold_list, pred_list):
+        g = set(spans_from_bio(gold))
+        p = set(spans_from_bio(pred))
+        tp += len(g & p)
+        fp += len(p - g)
+        fn += len(g - p)
+
+    prec = tp / (tp + fp) if (tp + fp) > 0 else 0.0
+    rec = tp / (tp + fn) if (tp + fn) > 0 else 0.0
+    f1 = 2 * prec * rec / (prec + rec) if (prec + rec) > 0 else 0.0
+    return {"tp": tp, "fp": fp, "fn": fn, "precision": prec, "recall": rec, "f1": f1}
+
+
+def align_labels(tokens: Sequence[str], pred_tags: Sequence[str]) -> List[str]:
+    """
+    Map an LLM answer back onto the gold tokens by position.
+    Missing positions become "O"; extra lines are dropped.
+    """
+    out = ["O"] * len(tokens)
+    for i, tag in enumerate(pred_tags[: len(tokens)]):
+        out[i] = tag
+    return out
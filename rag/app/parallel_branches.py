@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Mapping, Optional
+
+BRANCH_WORKERS = int(os.getenv("BRANCH_WORKERS", "8"))
+
+# Shared by every request; both branches are I/O- or torch-bound and release the GIL.
+_executor = ThreadPoolExecutor(max_workers=BRANCH_WORKERS, thread_name_prefix="branch")
+
+
+@dataclass
+class BranchResult:
+    name: str
+    value: Any = None
+    error: Optional[BaseException] = None
+    timed_out: bool = False
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and not self.timed_out
+
+
+def _timed(fn: Callable[[], Any]):
+    start = time.perf_counter()
+    value = fn()
+    return value, time.perf_counter() - start
+
+
+def run_branches(
+    branches: Mapping[str, Callable[[], Any]],
+    timeouts: Mapping[str, float] | float | None = None,
+) -> Dict[str, BranchResult]:
+    """
+    Run independent branches (e.g. LLM call and XLM-R inference) concurrently
+    and join them with per-branch deadlines measured from submission.
+
+    A branch that misses its deadline is reported as timed out; its thread keeps
+    running in the background and its result is discarded.
+    """
+    start = time.perf_counter()
+    # Each branch runs in a copy of the caller's context so per-request state
+    # (e.g. stage timings) follows it into the worker thread.
+    futures = {
+        name: _executor.submit(contextvars.copy_context().run, _timed, fn)
+        for name, fn in branches.items()
+    }
+
+    results: Dict[str, BranchResult] = {}
+    for name, future in futures.items():
+        if isinstance(timeouts, Mapping):
+            limit = timeouts.get(name)
+        else:
+            limit = timeouts
+
+        remaining = None if limit is None else max(0.0, limit - (time.perf_counter() - start))
+        result = BranchResult(name=name)
+        try:
+            result.value, result.elapsed = future.result(timeout=remaining)
+        except FutureTimeout:
+            result.timed_out = True
+            result.elapsed = time.perf_counter() - start
+            future.cancel()
+        except Exception as e:
+            result.error = e
+            result.elapsed = time.perf_counter() - start
+        results[name] = result
+
+    return results
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Tuple
+
+
+def normalize_tokens(tokens: Iterable[str]) -> Tuple[str, ...]:
+    """
+    Cache key normalisation: NFC + stripped tokens.
+    Casing is kept because it changes model predictions. Empty tokens stay as ""
+    so the key has one entry per word and a hit always matches the caller's length.
+    """
+    return tuple(unicodedata.normalize("NFC", tok).strip() for tok in tokens)
+
+
+class PredictionCache:
+    """
+    Thread-safe bounded LRU cache for model predictions.
+    Keys are (model revision, normalized token tuple).
+    """
+
+    def __init__(self, max_size: int = 2048):
+        self.max_size = max(0, int(max_size))
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(revision: str, tokens: Iterable[str]) -> Tuple[str, Tuple[str, ...]]:
+        return (revision, normalize_tokens(tokens))
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.max_size == 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
+
+    def format_stats(self, name: str = "Prediction cache") -> str:
+        s = self.stats()
+        return (
+            f"{name}: {s['size']}/{s['max_size']} entries | "
+            f"hits={s['hits']} misses={s['misses']} evictions={s['evictions']} | "
+            f"hit rate={s['hit_rate']:.1%}"
+        )
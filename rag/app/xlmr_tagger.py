@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+
+from bio_decoding import BIODecoder
+from instrumentation import metrics
+
+
+def tag_words(
+    model,
+    tokenizer,
+    words: Sequence[str],
+    max_length: Optional[int] = None,
+    stride: int = 0,
+    decode: str = "viterbi",
+) -> Tuple[List[str], List[float]]:
+    """
+    Tag pre-split words with the token-classification model.
+
+    Returns one label per word (first-subtoken rule) and its softmax margin
+    (top-1 minus top-2 probability). With stride > 0, inputs longer than
+    max_length subwords are tagged in overlapping windows (see tag_batch);
+    otherwise words lost to truncation get "O" with margin 0.0, so they always
+    count as low-confidence.
+    """
+    return tag_batch(model, tokenizer, [words], max_length=max_length, stride=stride, decode=decode)[0]
+
+
+def _word_margins(log_probs: np.ndarray) -> np.ndarray:
+    """Top-1 minus top-2 softmax probability per row."""
+    probs = np.exp(log_probs)
+    if probs.shape[-1] < 2:
+        return probs[..., 0]
+    top = np.partition(probs, -2, axis=-1)
+    return top[..., -1] - top[..., -2]
+
+
+def _collect_words(word_ids, row_log_probs, scores, seen, best=None, window=0) -> None:
+    """
+    First-subtoken log-probabilities of one row. With `best` (per-word
+    (score, -window) of the window that set the row), a word is only
+    overwritten by a window where it sits further from the edges, so
+    overlapping windows merge.
+    """
+    content = [pos for pos, wid in enumerate(word_ids) if wid is not None]
+    first, last = (content[0], content[-1]) if content else (0, 0)
+    previous_word_idx = None
+    for token_idx, word_idx in enumerate(word_ids):
+        if word_idx is None or word_idx == previous_word_idx:
+            continue
+        previous_word_idx = word_idx
+        if best is not None:
+            score = (min(token_idx - first, last - token_idx), -window)
+            if score <= best[word_idx]:
+                continue
+            best[word_idx] = score
+        scores[word_idx] = row_log_probs[token_idx]
+        seen[word_idx] = True
+
+
+@torch.no_grad()
+def tag_batch(
+    model,
+    tokenizer,
+    batch: Sequence[Sequence[str]],
+    batch_size: int = 32,
+    max_length: Optional[int] = None,
+    stride: int = 0,
+    decode: str = "viterbi",
+) -> List[Tuple[List[str], List[float]]]:
+    """
+    tag_words for many sentences. Rows are sorted by subword length and run in
+    padded batches of batch_size so padding stays small; results come back in
+    input order.
+
+    With stride > 0, a sentence longer than max_length subwords (default: the
+    tokenizer limit) becomes several windows overlapping by `stride` subwords.
+    Windows are batched like any other row, and each word keeps the scores of
+    the window where it has the most context on both sides. Cost grows
+    linearly with length instead of words past the limit being dropped.
+
+    decode="viterbi" picks the best valid BIO sequence for every sentence in
+    one batched pass (bio_decoding.py); "argmax" labels each word on its own.
+    """
+    sentences = [list(words) for words in batch]
+    results: List[Tuple[List[str], List[float]]] = [
+        (["O"] * len(words), [0.0] * len(words)) for words in sentences
+    ]
+    todo = [i for i, words in enumerate(sentences) if words]
+    if not todo:
+        return results
+    id2label: Dict[int, str] = {int(k): v for k, v in model.config.id2label.items()}
+
+    # Words never seen (lost to truncation) keep a row that decodes to "O".
+    unseen = np.zeros(len(id2label), dtype=np.float32)
+    o_ids = [i for i, label in id2label.items() if label == "O"]
+    if o_ids:
+        unseen[:] = -1e4
+        unseen[o_ids[0]] = 0.0
+    word_scores = {i: np.tile(unseen, (len(sentences[i]), 1)) for i in todo}
+    seen = {i: np.zeros(len(sentences[i]), dtype=bool) for i in todo}
+
+    window_args = {"stride": stride, "return_overflowing_tokens": True} if stride else {}
+    with metrics.stage("xlmr_tokenize"):
+        enc = tokenizer(
+            [sentences[i] for i in todo],
+            is_split_into_words=True,
+            truncation=True,
+            max_length=max_length or tokenizer.model_max_length,
+            **window_args,
+        )
+    num_rows = len(enc["input_ids"])
+    row_sentence = enc["overflow_to_sample_mapping"] if stride else list(range(num_rows))
+    windowed = num_rows > len(todo)
+    best = {i: [(-1, 0)] * len(sentences[i]) for i in todo} if windowed else {}
+
+    order = sorted(range(num_rows), key=lambda r: len(enc["input_ids"][r]))
+    for start in range(0, len(order), batch_size):
+        chunk = order[start:start + batch_size]
+        with metrics.stage("xlmr_tokenize"):
+            inputs = tokenizer.pad(
+                [{"input_ids": enc["input_ids"][r], "attention_mask": enc["attention_mask"][r]} for r in chunk],
+                return_tensors="pt",
+            )
+
+        with metrics.stage("xlmr_forward"):
+            logits = model(**inputs).logits
+
+        log_probs = torch.log_softmax(logits.float(), dim=-1).cpu().numpy()
+        for row, r in enumerate(chunk):
+            i = todo[row_sentence[r]]
+            _collect_words(
+                enc.word_ids(r), log_probs[row], word_scores[i], seen[i], best=best.get(i), window=r,
+            )
+
+    with metrics.stage("xlmr_decode"):
+        if decode == "viterbi":
+            label_ids = BIODecoder(id2label).decode([word_scores[i] for i in todo])
+        else:
+            label_ids = [word_scores[i].argmax(-1) for i in todo]
+
+    for i, ids in zip(todo, label_ids):
+        margins = np.where(seen[i], _word_margins(word_scores[i]), 0.0)
+        results[i] = ([id2label[int(k)] for k in ids], [float(m) for m in margins])
+
+    return results
+
+
+def format_bio(words: Sequence[str], labels: Sequence[str]) -> str:
+    return "\n".join(f"{w}\t{y}" for w, y in zip(words, labels))
@@ -1,7 +1,9 @@
 import argparse
 import json
 import os
+import sys
 from collections import Counter, defaultdict
+from itertools import tee
 from pathlib import Path
 
 import matplotlib.pyplot as plt
@@ -10,32 +12,11 @@ import pandas as pd
 import torch
 from transformers import AutoModelForTokenClassification, AutoTokenizer
 
+# Shared inference modules live in scripts/model/prediction.
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "model" / "prediction"))
 
-# -----------------------------
-# CoNLL parsing
-# -----------------------------
-
-def read_conll(path: Path):
-    """
-    Returns list of sentences: each sentence is list of (token, tag)
-    """
-    sents = []
-    cur = []
-    with open(path, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.rstrip("\n")
-            if not line.strip():
-                if cur:
-                    sents.append(cur)
-                    cur = []
-                continue
-            parts = line.split()
-            tok = parts[0]
-            tag = parts[-1]
-            cur.append((tok, tag))
-    if cur:
-        sents.append(cur)
-    return sents
+from conll_stream import iter_conll, prefetch
+from xlmr_inference import BatchPredictor
 
 
 # -----------------------------
@@ -62,43 +43,13 @@ def spans_from_bio(tags):
     return spans
 
 
-# -----------------------------
-# Predict tags aligned to words
-# -----------------------------
-
-@torch.no_grad()
-def predict_sentence(model, tokenizer, tokens, device, max_length=256):
-    enc = tokenizer(
-        tokens,
-        is_split_into_words=True,
-        truncation=True,
-        max_length=max_length,
-        return_tensors="pt",
-    )
-    enc = {k: v.to(device) for k, v in enc.items()}
-    logits = model(**enc).logits[0]  # [seq, labels]
-    pred_ids = torch.argmax(logits, dim=-1).cpu().tolist()
-
-    # align to words: take first subtoken for each word
-    word_ids = tokenizer(tokens, is_split_into_words=True, truncation=True, max_length=max_length).word_ids()
-    pred_word_tags = []
-    seen = set()
-    for idx, wid in enumerate(word_ids):
-        if wid is None or wid in seen:
-            continue
-        seen.add(wid)
-        pred_word_tags.append(model.config.id2label[int(pred_ids[idx])])
-
-    return pred_word_tags
-
-
 # -----------------------------
 # Metrics: per-type + overall
 # -----------------------------
 def compute_span_metrics(gold_sents, pred_sents):
     """
-    gold_sents: list of (tokens, gold_tags) word-level
-    pred_sents: list of pred_tags word-level
+    gold_sents: iterable of (tokens, gold_tags) word-level
+    pred_sents: iterable of pred_tags word-level (consumed in lockstep)
     Returns:
       per_type: dict type -> dict(tp, fp, fn, precision, recall, f1, support_gold)
       overall_micro: dict
@@ -292,30 +243,33 @@ def plot_learning_rate(model_dir: Path, out_png: Path, title: str):
 # Run one model evaluation
 # -----------------------------
 
-def evaluate_one_model(model_dir: Path, conll_path: Path, out_dir: Path, max_length: int, device: str):
+def evaluate_one_model(model_dir: Path, conll_path: Path, out_dir: Path, max_length: int, device: str,
+                       batch_size: int = 32):
     out_dir.mkdir(parents=True, exist_ok=True)
 
-    # Load data
-    sents = read_conll(conll_path)
-    gold_sents = [([tok for tok, _ in sent], [tag for _, tag in sent]) for sent in sents]
-    tokens_only = [x[0] for x in gold_sents]
-    gold_tags_only = [x[1] for x in gold_sents]
-
     # Load model
     tokenizer = AutoTokenizer.from_pretrained(model_dir)
     model = AutoModelForTokenClassification.from_pretrained(model_dir)
     model.to(device)
     model.eval()
 
-    # Predict
-    pred_sents = []
-    for tokens in tokens_only:
-        pred_tags = predict_sentence(model, tokenizer, tokens, device=device, max_length=max_length)
-        pred_sents.append(pred_tags)
-
-    # Metrics
-    gold_pairs = list(zip(tokens_only, gold_tags_only))
-    per_type, overall_micro, overall_macro = compute_span_metrics(gold_pairs, pred_sents)
+    # Predict (batched, first subtoken per word) and score as a stream, so the
+    # eval file is never held in memory as a whole.
+    predictor = BatchPredictor(model, tokenizer, batch_size=batch_size, max_len=max_length, device=device)
+    num_sents = 0
+
+    def predicted():
+        nonlocal num_sents
+        sentences = prefetch(iter_conll(conll_path))
+        for (tokens, gold_tags), pred_tags in predictor.predict_stream(sentences, get_tokens=lambda s: s[0]):
+            num_sents += 1
+            yield (tokens, gold_tags), pred_tags
+
+    # compute_span_metrics zips both sides in lockstep, so tee buffers one item.
+    gold_side, pred_side = tee(predicted())
+    per_type, overall_micro, overall_macro = compute_span_metrics(
+        (gold for gold, _ in gold_side), (pred for _, pred in pred_side)
+    )
 
     df = pd.DataFrame([
         {"type": typ, **vals} for typ, vals in per_type.items()
@@ -338,7 +292,7 @@ def evaluate_one_model(model_dir: Path, conll_path: Path, out_dir: Path, max_len
         "eval_file": str(conll_path),
         "overall_micro": overall_micro,
         "overall_macro": overall_macro,
-        "num_sentences": len(sents),
+        "num_sentences": num_sents,
     }
     with open(out_dir / "summary.json", "w", encoding="utf-8") as f:
         json.dump(summary, f, indent=2)
@@ -354,7 +308,7 @@ def evaluate_one_model(model_dir: Path, conll_path: Path, out_dir: Path, max_len
     with open(out_dir / "report.txt", "w", encoding="utf-8") as f:
         f.write(f"MODEL: {model_dir}\n")
         f.write(f"EVAL : {conll_path}\n")
-        f.write(f"SENTS: {len(sents)}\n\n")
+        f.write(f"SENTS: {num_sents}\n\n")
         f.write("OVERALL MICRO:\n")
         f.write(json.dumps(overall_micro, indent=2) + "\n\n")
         f.write("OVERALL MACRO:\n")
@@ -370,6 +324,7 @@ def main():
     ap.add_argument("--project_root", default=r"D:\DOWNLOADS\BRAVE\LuxNLP")
     ap.add_argument("--out_root", default=r"D:\DOWNLOADS\BRAVE\LuxNLP\model_reports")
     ap.add_argument("--max_length", type=int, default=256)
+    ap.add_argument("--batch_size", type=int, default=32)
     ap.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
     args = ap.parse_args()
 
@@ -408,7 +363,7 @@ def main():
         print(f"\n=== Evaluating: {name} ===")
         print("Model:", model_dir)
         print("Eval :", eval_conll)
-        summary = evaluate_one_model(model_dir, eval_conll, out_dir, args.max_length, args.device)
+        summary = evaluate_one_model(model_dir, eval_conll, out_dir, args.max_length, args.device, args.batch_size)
         all_summaries.append(summary)
         print(f"✅ Done: {out_dir}")
 
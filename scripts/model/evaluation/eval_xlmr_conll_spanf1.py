@@ -2,45 +2,18 @@
 from __future__ import annotations
 
 import argparse
-import re
+import sys
 from collections import Counter, defaultdict
 from pathlib import Path
 
 import torch
 from transformers import AutoModelForTokenClassification, AutoTokenizer
 
+# Shared inference modules live in scripts/model/prediction.
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "prediction"))
 
-# -----------------------------
-# CoNLL IO
-# -----------------------------
-def read_conll(path: Path):
-    sents = []
-    toks, gold = [], []
-    with path.open("r", encoding="utf-8", errors="replace") as f:
-        for line in f:
-            line = line.rstrip("\n")
-            if not line.strip():
-                if toks:
-                    sents.append((toks, gold))
-                    toks, gold = [], []
-                continue
-            parts = re.split(r"\s+", line.strip())
-            if len(parts) < 2:
-                continue
-            toks.append(parts[0])
-            gold.append(parts[-1])
-    if toks:
-        sents.append((toks, gold))
-    return sents
-
-
-def write_conll(tokens_and_labels, out_path: Path):
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    with out_path.open("w", encoding="utf-8") as f:
-        for toks, labs in tokens_and_labels:
-            for t, y in zip(toks, labs):
-                f.write(f"{t}\t{y}\n")
-            f.write("\n")
+from conll_stream import ConllWriter, iter_conll, prefetch
+from xlmr_inference import BatchPredictor
 
 
 # -----------------------------
@@ -107,122 +80,45 @@ def per_type_span_f1(gold_labels, pred_labels):
     return rows
 
 
-# -----------------------------
-# Prediction
-# -----------------------------
-def predict_sentence(model, tokenizer, tokens, id2label, device, max_len=256):
-    """
-    Predict one sentence while preserving word-level alignment (one label per original token).
-    """
-    enc = tokenizer(
-        tokens,
-        is_split_into_words=True,
-        return_tensors="pt",
-        truncation=True,
-        max_length=max_len,
-    )
-    enc = {k: v.to(device) for k, v in enc.items()}
-
-    with torch.no_grad():
-        out = model(**enc)
-        logits = out.logits  # [1, seq, num_labels]
-        pred_ids = logits.argmax(dim=-1)[0].tolist()
-
-    word_ids = enc["input_ids"].new_tensor([0])  # dummy just to keep type
-    # Get word_ids via tokenizer API
-    # transformers returns list on CPU; we use the original encoding object:
-    word_id_list = tokenizer(tokens, is_split_into_words=True, truncation=True, max_length=max_len).word_ids()
-
-    # Choose first subtoken label for each word
-    pred_word = ["O"] * len(tokens)
-    seen = set()
-    for idx, wid in enumerate(word_id_list):
-        if wid is None:
-            continue
-        if wid in seen:
-            continue
-        seen.add(wid)
-        pred_word[wid] = id2label[pred_ids[idx]]
-
-
-    repaired = []
-    prev_tag = "O"
-    prev_type = None
-    for lab in pred_word:
-        if lab == "O":
-            repaired.append("O")
-            prev_tag, prev_type = "O", None
-            continue
-        if "-" not in lab:
-            repaired.append("O")
-            prev_tag, prev_type = "O", None
-            continue
-        tag, typ = lab.split("-", 1)
-        if tag == "B":
-            repaired.append(lab)
-            prev_tag, prev_type = "B", typ
-        elif tag == "I":
-            if prev_tag == "O" or prev_type != typ:
-                repaired.append(f"B-{typ}")
-                prev_tag, prev_type = "B", typ
-            else:
-                repaired.append(lab)
-                prev_tag, prev_type = "I", typ
-        else:
-            repaired.append("O")
-            prev_tag, prev_type = "O", None
-
-    return repaired
-
-
-def evaluate_split(model_dir: Path, conll_path: Path, out_pred: Path, max_len: int):
+def evaluate_split(
+    model_dir: Path, conll_path: Path, out_pred: Path, max_len: int, batch_size: int = 32, window_stride: int = 0
+):
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     tokenizer = AutoTokenizer.from_pretrained(model_dir, local_files_only=True)
     model = AutoModelForTokenClassification.from_pretrained(model_dir, local_files_only=True).to(device)
     model.eval()
 
-    id2label = model.config.id2label
+    predictor = BatchPredictor(
+        model, tokenizer, batch_size=batch_size, max_len=max_len, device=device, window_stride=window_stride
+    )
 
-    sents = read_conll(conll_path)
-    preds_out = []
-    gold_all = []
-    pred_all = []
+    tp = fp = fn = 0
+    per_type_tp = Counter()
+    per_type_fp = Counter()
+    per_type_fn = Counter()
 
-    for tokens, gold in sents:
-        pred = predict_sentence(model, tokenizer, tokens, id2label, device, max_len=max_len)
-        preds_out.append((tokens, pred))
-        gold_all.append(gold)
-        pred_all.append(pred)
+    # Streamed: predictions are written and scored sentence by sentence, so
+    # memory stays bounded by the predictor chunk size, not the file size.
+    # Labels are decoded with the BIO-constrained Viterbi, so they are valid BIO.
+    sentences = prefetch(iter_conll(conll_path))
+    with ConllWriter(out_pred, background=True) as writer:
+        for (tokens, gold), pred in predictor.predict_stream(sentences, get_tokens=lambda s: s[0]):
+            writer.write(tokens, pred)
 
-    # Write prediction file
-    write_conll(preds_out, out_pred)
+            tpi, fpi, fni, _, _, _ = span_f1(gold, pred)
+            tp += tpi
+            fp += fpi
+            fn += fni
 
-    # Compute micro span F1
-    tp = fp = fn = 0
-    for g, p in zip(gold_all, pred_all):
-        tpi, fpi, fni, _, _, _ = span_f1(g, p)
-        tp += tpi
-        fp += fpi
-        fn += fni
+            for t, (tpi, fpi, fni, _, _, _) in per_type_span_f1(gold, pred).items():
+                per_type_tp[t] += tpi
+                per_type_fp[t] += fpi
+                per_type_fn[t] += fni
 
     prec = tp / (tp + fp) if (tp + fp) > 0 else 0.0
     rec = tp / (tp + fn) if (tp + fn) > 0 else 0.0
     f1 = 2 * prec * rec / (prec + rec) if (prec + rec) > 0 else 0.0
 
-    # Per-type
-    per_type = Counter()
-    per_type_tp = Counter()
-    per_type_fp = Counter()
-    per_type_fn = Counter()
-
-    for g, p in zip(gold_all, pred_all):
-        rows = per_type_span_f1(g, p)
-        for t, (tpi, fpi, fni, _, _, _) in rows.items():
-            per_type_tp[t] += tpi
-            per_type_fp[t] += fpi
-            per_type_fn[t] += fni
-            per_type[t] += 1
-
     return (prec, rec, f1, tp, fp, fn, per_type_tp, per_type_fp, per_type_fn)
 
 
@@ -232,6 +128,9 @@ def main():
     ap.add_argument("--split_dir", required=True, help="Folder containing train/dev/test conll files")
     ap.add_argument("--out_dir", required=True, help="Where to write predictions + eval txt")
     ap.add_argument("--max_len", type=int, default=256)
+    ap.add_argument("--batch_size", type=int, default=32)
+    ap.add_argument("--window_stride", type=int, default=64,
+                    help="Subword overlap of sliding windows for sentences over --max_len (0 = truncate)")
     args = ap.parse_args()
 
     model_dir = Path(args.model_dir)
@@ -244,7 +143,7 @@ def main():
 
     # DEV
     dev_pred = out_dir / "pred_dev.conll"
-    prec, rec, f1, tp, fp, fn, ttp, tfp, tfn = evaluate_split(model_dir, dev, dev_pred, args.max_len)
+    prec, rec, f1, tp, fp, fn, ttp, tfp, tfn = evaluate_split(model_dir, dev, dev_pred, args.max_len, args.batch_size, args.window_stride)
     dev_txt = out_dir / "eval_dev.txt"
     with dev_txt.open("w", encoding="utf-8") as f:
         f.write(f"DEV micro span-F1 (exact match)\n")
@@ -260,7 +159,7 @@ def main():
 
     # TEST
     test_pred = out_dir / "pred_test.conll"
-    prec, rec, f1, tp, fp, fn, ttp, tfp, tfn = evaluate_split(model_dir, test, test_pred, args.max_len)
+    prec, rec, f1, tp, fp, fn, ttp, tfp, tfn = evaluate_split(model_dir, test, test_pred, args.max_len, args.batch_size, args.window_stride)
     test_txt = out_dir / "eval_test.txt"
     with test_txt.open("w", encoding="utf-8") as f:
         f.write(f"TEST micro span-F1 (exact match)\n")
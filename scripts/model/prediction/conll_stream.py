@@ -0,0 +1,291 @@
+"""
+Constant-memory CoNLL I/O for prediction and evaluation.
+
+    sentences = prefetch(iter_conll(in_path))
+    with ConllWriter(out_path) as writer:
+        for (tokens, _), labels in predictor.predict_stream(sentences, get_tokens=lambda s: s[0]):
+            writer.write(tokens, labels)
+
+iter_conll yields one sentence at a time, prefetch reads ahead in a thread so
+parsing overlaps with inference, and ConllWriter writes each sentence as it
+arrives (optionally from a background thread). For multi-hour runs,
+ResumableConllWriter commits output one chunk at a time and records progress
+so a killed job picks up where it stopped.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+T = TypeVar("T")
+
+_DONE = object()
+
+
+def iter_conll(
+    path: str | Path, label_column: int = -1, unlabeled_label: Optional[str] = None
+) -> Iterator[Tuple[List[str], List[str]]]:
+    """
+    Yield (tokens, labels) per sentence. Sentences are separated by blank lines;
+    the token is the first column and the label `label_column` (default: last).
+    Lines with a single column are skipped, as gold files expect. For unlabeled
+    input pass unlabeled_label (e.g. "O") to keep them as tokens with that label.
+    """
+    toks: List[str] = []
+    labs: List[str] = []
+    with Path(path).open("r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            parts = line.split()
+            if not parts:
+                if toks:
+                    yield toks, labs
+                    toks, labs = [], []
+                continue
+            if len(parts) >= 2:
+                toks.append(parts[0])
+                labs.append(parts[label_column])
+            elif unlabeled_label is not None:
+                toks.append(parts[0])
+                labs.append(unlabeled_label)
+    if toks:
+        yield toks, labs
+
+
+def batched(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    chunk: List[T] = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def prefetch(items: Iterable[T], size: int = 2048) -> Iterator[T]:
+    """
+    Consume `items` in a background thread, keeping at most `size` ready.
+    Exceptions from the producer are re-raised in the consumer.
+    """
+    buf: "queue.Queue" = queue.Queue(maxsize=size)
+    errors: List[BaseException] = []
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in items:
+                while not stop.is_set():
+                    try:
+                        buf.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            if not stop.is_set():
+                buf.put(_DONE)
+
+    thread = threading.Thread(target=produce, name="conll-prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buf.get()
+            if item is _DONE:
+                break
+            yield item
+    finally:
+        stop.set()
+    if errors:
+        raise errors[0]
+
+
+class ConllWriter:
+    """
+    Incremental CoNLL writer: token<TAB>label lines, blank line between sentences.
+    With background=True writes go through a bounded queue to a writer thread.
+    """
+
+    def __init__(self, path: str | Path, background: bool = False, queue_size: int = 1024):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._f = self.path.open("w", encoding="utf-8")
+        self.count = 0
+        self._queue: Optional["queue.Queue"] = None
+        self._thread: Optional[threading.Thread] = None
+        if background:
+            self._queue = queue.Queue(maxsize=queue_size)
+            self._thread = threading.Thread(target=self._drain, name="conll-writer", daemon=True)
+            self._thread.start()
+
+    @staticmethod
+    def format(tokens: Sequence[str], labels: Sequence[str]) -> str:
+        return "".join(f"{t}\t{y}\n" for t, y in zip(tokens, labels)) + "\n"
+
+    def _drain(self) -> None:
+        while True:
+            block = self._queue.get()
+            if block is _DONE:
+                break
+            self._f.write(block)
+
+    def write(self, tokens: Sequence[str], labels: Sequence[str]) -> None:
+        block = self.format(tokens, labels)
+        if self._queue is not None:
+            self._queue.put(block)
+        else:
+            self._f.write(block)
+        self.count += 1
+
+    def close(self) -> None:
+        if self._thread is not None:
+            self._queue.put(_DONE)
+            self._thread.join()
+            self._thread = None
+        self._f.close()
+
+    def __enter__(self) -> "ConllWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def file_fingerprint(path: str | Path, block_size: int = 1 << 20) -> str:
+    """Size plus a BLAKE2 digest of the content."""
+    path = Path(path)
+    digest = hashlib.blake2b(digest_size=16)
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return f"{path.stat().st_size}:{digest.hexdigest()}"
+
+
+class ResumableConllWriter:
+    """
+    CoNLL writer for long jobs that may be killed and restarted.
+
+    Sentences are buffered and written one chunk at a time. After each chunk
+    the output is fsynced and <out>.progress.json records the sentences done,
+    the output size in bytes and the input fingerprint. On resume the output is
+    cut back to the recorded size, which drops a chunk that was only partly
+    written, and the caller skips `done` input sentences:
+
+        with ResumableConllWriter(out, in_path, resume=True) as writer:
+            for toks, labs in islice(iter_conll(in_path), writer.done, None):
+                ...
+                writer.write(toks, labels)
+
+    `params` (model, max_len, ...) must also match for a resume, so a run is
+    never continued with different settings.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        input_path: str | Path,
+        chunk_size: int = 2048,
+        resume: bool = False,
+        params: Optional[Dict[str, Any]] = None,
+    ):
+        self.path = Path(path)
+        self.progress_path = self.path.with_name(self.path.name + ".progress.json")
+        self.chunk_size = max(1, chunk_size)
+        self.input_path = str(input_path)
+        self.input_hash = file_fingerprint(input_path)
+        self.params = dict(params or {})
+        self.complete = False
+
+        state = self._load_progress() if resume else None
+        offset = 0
+        self.done = 0
+        if state is not None:
+            problem = self._check_state(state)
+            if problem:
+                print(f"[WARN] Not resuming {self.path}: {problem}")
+            else:
+                self.done = state["sentences"]
+                offset = state["output_bytes"]
+                self.complete = bool(state.get("complete"))
+        self.resumed_from = self.done
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if offset:
+            self._f = self.path.open("r+b")
+            self._f.truncate(offset)
+            self._f.seek(offset)
+        else:
+            self._f = self.path.open("wb")
+            self._save_progress()
+        self._buffer: List[str] = []
+
+    def _load_progress(self) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads(self.progress_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def _check_state(self, state: Dict[str, Any]) -> str:
+        if state.get("input_hash") != self.input_hash:
+            return "input file changed"
+        if state.get("params") != self.params:
+            return "settings changed"
+        if not self.path.exists() or self.path.stat().st_size < state.get("output_bytes", 0):
+            return "output is shorter than the recorded progress"
+        return ""
+
+    def _save_progress(self) -> None:
+        state = {
+            "input": self.input_path,
+            "input_hash": self.input_hash,
+            "params": self.params,
+            "sentences": self.done,
+            "output_bytes": self._f.tell(),
+            "complete": self.complete,
+            "updated_at": time.time(),
+        }
+        tmp = self.progress_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(state, indent=2), encoding="utf-8")
+        os.replace(tmp, self.progress_path)
+
+    @property
+    def count(self) -> int:
+        return self.done + len(self._buffer)
+
+    def write(self, tokens: Sequence[str], labels: Sequence[str]) -> None:
+        self._buffer.append(ConllWriter.format(tokens, labels))
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Commit buffered sentences: write, fsync, then record progress."""
+        if not self._buffer:
+            return
+        self._f.write("".join(self._buffer).encode("utf-8"))
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self.done += len(self._buffer)
+        self._buffer = []
+        self._save_progress()
+
+    def close(self, complete: bool = True) -> None:
+        # Buffered sentences are whole, so they are committed even on error.
+        self.flush()
+        if complete and not self.complete:
+            self.complete = True
+            self._save_progress()
+        self._f.close()
+
+    def __enter__(self) -> "ResumableConllWriter":
+        return self
+
+    def __exit__(self, exc_type, *exc) -> None:
+        self.close(complete=exc_type is None)
@@ -0,0 +1,237 @@
+"""
+Pipelined batch inference: tokenization, forward passes and output on
+separate threads, connected by bounded queues.
+
+    stats = run_pipelined(
+        predictor, sentences,
+        sink=lambda sent, labels: writer.write(sent[0], labels),
+        get_tokens=lambda sent: sent[0], chunk_size=2048, queue_depth=4,
+    )
+    print(format_pipeline_stats(stats))
+
+- tokenizer thread: reads items, prepare_chunk + pad_batch, queues padded batches
+- main thread:      forward only, queues word log-probabilities
+- writer thread:    accumulate, finish_chunk (windows merge, Viterbi),
+                    then sink(item, labels) in input order
+
+Each stage reports busy time and time spent waiting on its input queue
+(starved) or on its output queue (backed up). If forward waits on input, the
+tokenizer cannot keep up. If it waits on output, the writer is the bottleneck.
+The mean queue fill seen by each consumer shows whether queue_depth is enough
+to absorb bursts.
+"""
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Sequence, TypeVar
+
+T = TypeVar("T")
+
+_DONE = object()
+
+
+class _Aborted(Exception):
+    pass
+
+
+class _Stage:
+    def __init__(self, name: str):
+        self.name = name
+        self.busy = 0.0
+        self.wait_in = 0.0
+        self.wait_out = 0.0
+
+
+class _Channel:
+    """Bounded queue that gives up when the pipeline is stopped and tracks its fill level."""
+
+    def __init__(self, name: str, depth: int, stop: threading.Event):
+        self.name = name
+        self.depth = depth
+        self._queue: "queue.Queue" = queue.Queue(maxsize=depth)
+        self._stop = stop
+        self.fill_total = 0
+        self.gets = 0
+
+    def put(self, item: Any, stage: _Stage) -> None:
+        start = time.perf_counter()
+        while True:
+            if self._stop.is_set():
+                raise _Aborted
+            try:
+                self._queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        stage.wait_out += time.perf_counter() - start
+
+    def get(self, stage: _Stage) -> Any:
+        self.fill_total += self._queue.qsize()
+        self.gets += 1
+        start = time.perf_counter()
+        while True:
+            if self._stop.is_set():
+                raise _Aborted
+            try:
+                item = self._queue.get(timeout=0.1)
+                break
+            except queue.Empty:
+                continue
+        stage.wait_in += time.perf_counter() - start
+        return item
+
+
+def run_pipelined(
+    predictor,
+    items: Iterable[T],
+    sink: Callable[[T, List[str]], None],
+    get_tokens: Callable[[T], Sequence[str]] = lambda item: item,
+    chunk_size: int = 1024,
+    queue_depth: int = 4,
+    repair: bool = False,
+    prob_writer=None,
+) -> Dict[str, Any]:
+    """
+    Tag `items` with a BatchPredictor and call sink(item, labels) for each
+    one, in input order, from the writer thread. Returns the stage report;
+    predictor.last_stats gets the same totals as predict_stream.
+    """
+    stop = threading.Event()
+    errors: List[BaseException] = []
+    stages = {name: _Stage(name) for name in ("tokenize", "forward", "write")}
+    to_forward = _Channel("tokenize->forward", queue_depth, stop)
+    to_write = _Channel("forward->write", queue_depth, stop)
+    totals = {"batches": 0, "real_slots": 0, "padded_slots": 0, "extra_windows": 0}
+
+    def fail(error: BaseException) -> None:
+        if not isinstance(error, _Aborted):
+            errors.append(error)
+        stop.set()
+
+    def tokenize() -> None:
+        stage = stages["tokenize"]
+
+        def emit(chunk: List[T]) -> None:
+            start = time.perf_counter()
+            state = predictor.prepare_chunk([get_tokens(item) for item in chunk])
+            stage.busy += time.perf_counter() - start
+            for batch in state.batches:
+                start = time.perf_counter()
+                padded, rows, cols = predictor.pad_batch(state, batch)
+                stage.busy += time.perf_counter() - start
+                to_forward.put(("batch", state, batch, (padded, rows, cols)), stage)
+            to_forward.put(("end", state, chunk), stage)
+
+        try:
+            chunk: List[T] = []
+            iterator = iter(items)
+            while True:
+                start = time.perf_counter()
+                item = next(iterator, _DONE)
+                stage.wait_in += time.perf_counter() - start
+                if item is _DONE:
+                    break
+                chunk.append(item)
+                if len(chunk) >= chunk_size:
+                    emit(chunk)
+                    chunk = []
+            if chunk:
+                emit(chunk)
+            to_forward.put(_DONE, stage)
+        except BaseException as e:
+            fail(e)
+
+    def write() -> None:
+        stage = stages["write"]
+        try:
+            while True:
+                message = to_write.get(stage)
+                if message is _DONE:
+                    return
+                start = time.perf_counter()
+                kind, state, payload, log_probs = message
+                if kind == "batch":
+                    predictor.accumulate(state, payload, log_probs)
+                else:
+                    preds = predictor.finish_chunk(state, repair=repair, return_probs=prob_writer is not None)
+                    for item, pred in zip(payload, preds):
+                        sink(item, pred.labels)
+                        if prob_writer is not None:
+                            prob_writer.write(pred.probs)
+                    for key in totals:
+                        totals[key] += state.stats()[key]
+                stage.busy += time.perf_counter() - start
+        except BaseException as e:
+            fail(e)
+
+    threads = [
+        threading.Thread(target=tokenize, name="pipeline-tokenize", daemon=True),
+        threading.Thread(target=write, name="pipeline-write", daemon=True),
+    ]
+    wall_start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+
+    stage = stages["forward"]
+    try:
+        while True:
+            message = to_forward.get(stage)
+            if message is _DONE:
+                to_write.put(_DONE, stage)
+                break
+            kind, state, payload, *rest = message
+            log_probs = None
+            if kind == "batch":
+                start = time.perf_counter()
+                log_probs = predictor.forward(*rest[0])
+                stage.busy += time.perf_counter() - start
+            to_write.put((kind, state, payload, log_probs), stage)
+    except BaseException as e:
+        fail(e)
+    finally:
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+
+    elapsed = time.perf_counter() - wall_start
+    padded = totals["padded_slots"]
+    predictor.last_stats = {**totals, "padding_ratio": 1 - totals["real_slots"] / padded if padded else 0.0}
+    return {
+        "elapsed_s": elapsed,
+        "queue_depth": queue_depth,
+        "stages": {
+            s.name: {
+                "busy_s": s.busy,
+                "wait_in_s": s.wait_in,
+                "wait_out_s": s.wait_out,
+                "utilisation": s.busy / elapsed if elapsed else 0.0,
+            }
+            for s in stages.values()
+        },
+        "queues": {
+            c.name: {"depth": c.depth, "mean_fill": c.fill_total / c.gets if c.gets else 0.0}
+            for c in (to_forward, to_write)
+        },
+    }
+
+
+def format_pipeline_stats(stats: Dict[str, Any]) -> str:
+    elapsed = stats["elapsed_s"] or 1e-9
+    lines = [f"Pipeline: {elapsed:.1f}s, queue depth {stats['queue_depth']}"]
+    for name, s in stats["stages"].items():
+        lines.append(
+            f"  {name:<9} busy {s['utilisation']:6.1%} | starved {s['wait_in_s'] / elapsed:6.1%} "
+            f"| blocked {s['wait_out_s'] / elapsed:6.1%}"
+        )
+    for name, q in stats["queues"].items():
+        lines.append(f"  queue {name}: mean fill {q['mean_fill']:.1f}/{q['depth']}")
+
+    forward = stats["stages"]["forward"]
+    if forward["wait_in_s"] > 0.1 * elapsed:
+        lines.append("  -> forward is starved: tokenization or input reading is the bottleneck")
+    elif forward["wait_out_s"] > 0.1 * elapsed:
+        lines.append("  -> forward is blocked: decoding/writing is the bottleneck")
+    return "\n".join(lines)
@@ -1,7 +1,9 @@
 import argparse
 
-import torch
-from transformers import AutoModelForTokenClassification, AutoTokenizer
+import numpy as np
+
+from model_loader import load_token_classifier
+from xlmr_inference import BatchPredictor
 
 
 def main():
@@ -9,39 +11,28 @@ def main():
     ap.add_argument("--model_dir", required=True)
     ap.add_argument("--text", required=True)
     ap.add_argument("--topk", type=int, default=3)
+    ap.add_argument("--num_threads", type=int, default=0)
     args = ap.parse_args()
 
-    tok = AutoTokenizer.from_pretrained(args.model_dir, use_fast=True)
-    model = AutoModelForTokenClassification.from_pretrained(args.model_dir)
-    model.eval()
+    tok, model = load_token_classifier(args.model_dir, num_threads=args.num_threads or None)
 
-    words = args.text.split()
-    enc = tok(words, is_split_into_words=True, return_tensors="pt", truncation=True)
-    word_ids = enc.word_ids(batch_index=0)
+    predictor = BatchPredictor(model, tok, max_len=512)
 
-    with torch.no_grad():
-        out = model(**{k:v for k,v in enc.items() if k!="token_type_ids"})
-        probs = torch.softmax(out.logits, dim=-1)[0]  # [seq, labels]
+    words = args.text.split()
+    (pred,) = predictor.predict([words], return_probs=True)
 
-    id2label = model.config.id2label
-    last = None
+    id2label = predictor.id2label
     print("\nTEXT:", args.text)
     print("-"*60)
 
-    for i, wid in enumerate(word_ids):
-        if wid is None or wid == last:
-            continue
-        token = words[wid]
-
-        p = probs[i]
-        top = torch.topk(p, k=args.topk)
-        preds = [(id2label[idx.item()], float(val.item())) for val, idx in zip(top.values, top.indices)]
+    for token, p in zip(words, pred.probs):
+        top_idx = np.argsort(p)[::-1][:args.topk]
+        preds = [(id2label[int(idx)], float(p[idx])) for idx in top_idx]
 
         best_label = preds[0][0]
         best_prob  = preds[0][1]
 
         print(f"{token:18} {best_label:10} conf={best_prob:.3f}  top{args.topk}={preds}")
-        last = wid
 
 if __name__ == "__main__":
     main()
@@ -1,28 +1,21 @@
 # scripts/new_predict_text_quick.py
 from __future__ import annotations
 import argparse
-import torch
-from transformers import AutoTokenizer, AutoModelForTokenClassification
+
+from model_loader import load_token_classifier
+from xlmr_inference import BatchPredictor
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--model_dir", required=True, help="Path to checkpoint folder, e.g. models/xlmr_ner/checkpoint-500")
+    ap.add_argument("--num_threads", type=int, default=0)
     args = ap.parse_args()
 
     model_dir = args.model_dir
 
-    tokenizer = AutoTokenizer.from_pretrained(model_dir, use_fast=True)
-    model = AutoModelForTokenClassification.from_pretrained(model_dir)
-    model.eval()
+    tokenizer, model = load_token_classifier(model_dir, num_threads=args.num_threads or None)
 
-    id2label = model.config.id2label
-    if isinstance(id2label, dict):
-        # sometimes keys can be strings
-        def get_label(i: int) -> str:
-            return id2label.get(i, id2label.get(str(i), "O"))
-    else:
-        def get_label(i: int) -> str:
-            return id2label[i]
+    predictor = BatchPredictor(model, tokenizer, max_len=512)
 
     tests = [
         "Den 12. Mee 2024 war d'Nationalfeierdag zu Lëtzebuerg .",
@@ -32,22 +25,11 @@ def main():
         "De Jean-Claude Juncker war Premierminister .",
     ]
 
-    for text in tests:
-        words = text.split()
-        enc = tokenizer(words, is_split_into_words=True, return_tensors="pt", truncation=True)
-        word_ids = enc.word_ids(batch_index=0)
-
-        with torch.no_grad():
-            outputs = model(**{k: v for k, v in enc.items() if k != "token_type_ids"})
-            pred_ids = outputs.logits.argmax(dim=-1)[0].tolist()
-
+    words_list = [text.split() for text in tests]
+    for text, words, labels in zip(tests, words_list, predictor.predict_labels(words_list)):
         print("\nTEXT:", text)
-        last = None
-        for i, wid in enumerate(word_ids):
-            if wid is None or wid == last:
-                continue
-            print(f"{words[wid]:20} {get_label(pred_ids[i])}")
-            last = wid
+        for word, label in zip(words, labels):
+            print(f"{word:20} {label}")
 
 if __name__ == "__main__":
     main()
@@ -2,8 +2,10 @@
 from __future__ import annotations
 import argparse
 import torch
-from transformers import AutoTokenizer, AutoModelForTokenClassification
+
+from model_loader import load_token_classifier
 from new_conll_io import read_conll, write_conll
+from xlmr_inference import BatchPredictor
 
 def main():
     ap = argparse.ArgumentParser()
@@ -12,55 +14,25 @@ def main():
     ap.add_argument("--in_conll", required=True)
     ap.add_argument("--out_conll", required=True)
     ap.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    ap.add_argument("--num_threads", type=int, default=0)
+    ap.add_argument("--batch", type=int, default=32)
+    ap.add_argument("--max_len", type=int, default=512)
     args = ap.parse_args()
 
-    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer_dir, use_fast=True)
-    model = AutoModelForTokenClassification.from_pretrained(args.model_dir)
-    model.to(args.device)
-    model.eval()
+    tokenizer, model = load_token_classifier(
+        args.model_dir,
+        num_threads=args.num_threads or None,
+        device=args.device,
+        tokenizer_dir=args.tokenizer_dir,
+    )
 
-    id2label = model.config.id2label
+    predictor = BatchPredictor(model, tokenizer, batch_size=args.batch, max_len=args.max_len, device=args.device)
 
     sentences = read_conll(args.in_conll)
-    out_sents = []
-
-    for sent in sentences:
-        words = [t for t, _ in sent]
-
-        enc = tokenizer(
-            words,
-            is_split_into_words=True,
-            return_tensors="pt",
-            truncation=True
-        )
-
-        word_ids = enc.word_ids(batch_index=0)
-
-        enc = {k: v.to(args.device) for k, v in enc.items()}
-
-        with torch.no_grad():
-            logits = model(**enc).logits  
-        pred_ids = logits.argmax(dim=-1)[0].tolist()
-
-        out_sent = []
-        last_wid = None
-        for i, wid in enumerate(word_ids):
-            if wid is None:
-                continue
-            if wid == last_wid:
-                continue
-            tag = id2label[pred_ids[i]]
-            out_sent.append((words[wid], tag))
-            last_wid = wid
-
-        if len(out_sent) != len(words):
-            fixed = []
-            out_map = {i: tag for i, (_, tag) in enumerate(out_sent)}
-            for i, w in enumerate(words):
-                fixed.append((w, out_map.get(i, "O")))
-            out_sent = fixed
+    words_list = [[t for t, _ in sent] for sent in sentences]
+    labels_list = predictor.predict_labels(words_list)
 
-        out_sents.append(out_sent)
+    out_sents = [list(zip(words, labels)) for words, labels in zip(words_list, labels_list)]
 
     write_conll(out_sents, args.out_conll)
     print(f"Predictions written to: {args.out_conll}")
@@ -0,0 +1,296 @@
+"""
+Multi-process CPU prediction over large CoNLL or plain-text corpora.
+
+The input file is cut into byte-range shards aligned to sentence boundaries.
+A pool of worker processes tags them. Each worker loads its own model copy
+(memory-mapped safetensors, so weight pages are shared between processes) and
+runs a fixed number of torch threads, optionally pinned to its own cores.
+Every shard is streamed to its own output file, and the shards are then
+concatenated in order, so the merged output follows the input order.
+With --resume, shards finished by an earlier (killed) run are kept as long as
+the input and the shard plan are unchanged.
+
+Example (Leipzig sentences file: "<id>\\t<sentence>" per line):
+    python predict_sharded.py --model_dir models/xlmr_ner --input ltz_sentences.txt \\
+        --format text --text_column 1 --out_conll leipzig_pred.conll \\
+        --workers 8 --threads_per_worker 1 --pin_cores
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import queue
+import shutil
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from conll_stream import ConllWriter, file_fingerprint
+from inference_pipeline import run_pipelined
+
+# -----------------------------
+# Shards
+# -----------------------------
+def shard_boundaries(path: Path, num_shards: int, fmt: str) -> List[int]:
+    """
+    Byte offsets [0, b1, ..., size]. Each cut point is moved forward to the next
+    sentence start: the next line for text, past the next blank line for CoNLL.
+    """
+    size = path.stat().st_size
+    bounds = [0]
+    with path.open("rb") as f:
+        for i in range(1, num_shards):
+            f.seek(max(bounds[-1], size * i // num_shards))
+            f.readline()  # finish the partial line
+            if fmt == "conll":
+                while True:
+                    line = f.readline()
+                    if not line or not line.strip():
+                        break
+            pos = f.tell()
+            if bounds[-1] < pos < size:
+                bounds.append(pos)
+    bounds.append(size)
+    return bounds
+
+
+def iter_sentences(path: Path, start: int, end: int, fmt: str, text_column: int = -1) -> Iterator[List[str]]:
+    """Sentences whose bytes lie in [start, end)."""
+    with path.open("rb") as f:
+        f.seek(start)
+        toks: List[str] = []
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            text = line.decode("utf-8", errors="replace").rstrip("\r\n")
+
+            if fmt == "text":
+                if text_column >= 0:
+                    parts = text.split("\t")
+                    text = parts[text_column] if text_column < len(parts) else ""
+                words = text.split()
+                if words:
+                    yield words
+                continue
+
+            if not text.strip():
+                if toks:
+                    yield toks
+                    toks = []
+                continue
+            toks.append(text.split()[0])
+        if toks:
+            yield toks
+
+
+def chunked(items: Iterator[List[str]], size: int) -> Iterator[List[List[str]]]:
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# -----------------------------
+# Worker
+# -----------------------------
+_predictor = None
+_options = None
+
+
+def init_worker(options, core_queue) -> None:
+    global _predictor, _options
+
+    cores = None
+    if core_queue is not None:
+        # Every core set is taken by the first workers. A worker that replaces
+        # one that died finds the queue empty and runs unpinned instead of hanging.
+        try:
+            cores = core_queue.get(timeout=5.0)
+        except queue.Empty:
+            print(f"[WARN] No free core set for worker {os.getpid()}; running unpinned")
+    if cores:
+        os.sched_setaffinity(0, cores)
+
+    import torch
+
+    from model_loader import load_token_classifier
+    from xlmr_inference import BatchPredictor
+
+    torch.set_num_interop_threads(1)
+    tokenizer, model = load_token_classifier(options["model_dir"], num_threads=options["threads"])
+    _predictor = BatchPredictor(
+        model, tokenizer, batch_size=options["batch"], max_len=options["max_len"],
+        window_stride=options["window_stride"],
+    )
+    _options = options
+
+
+def run_shard(task):
+    shard_id, start, end = task
+    opts = _options
+    out_path = Path(opts["shard_dir"]) / f"shard_{shard_id:05d}.conll"
+    tmp_path = out_path.with_suffix(".part")
+
+    t0 = time.perf_counter()
+    count = 0
+    with tmp_path.open("w", encoding="utf-8") as out:
+        sentences = iter_sentences(Path(opts["input"]), start, end, opts["format"], opts["text_column"])
+        if opts["queue_depth"] > 0:
+            def sink(words, labels):
+                nonlocal count
+                out.write(ConllWriter.format(words, labels))
+                count += 1
+
+            run_pipelined(_predictor, sentences, sink, chunk_size=opts["chunk_size"], queue_depth=opts["queue_depth"])
+        else:
+            for chunk in chunked(sentences, opts["chunk_size"]):
+                for words, labels in zip(chunk, _predictor.predict_labels(chunk)):
+                    out.write(ConllWriter.format(words, labels))
+                count += len(chunk)
+    os.replace(tmp_path, out_path)
+    return shard_id, count, time.perf_counter() - t0, os.getpid()
+
+
+# -----------------------------
+# Driver
+# -----------------------------
+def core_sets(workers: int, threads: int) -> Optional[List[List[int]]]:
+    available = sorted(os.sched_getaffinity(0))
+    if len(available) < workers * threads:
+        print(f"[WARN] {len(available)} cores for {workers}x{threads} threads, not pinning")
+        return None
+    return [available[i * threads:(i + 1) * threads] for i in range(workers)]
+
+
+def load_plan(shard_dir: Path, plan: Dict) -> bool:
+    """True when shard_dir holds outputs of the same input and shard plan."""
+    try:
+        previous = json.loads((shard_dir / "plan.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return False
+    return previous == plan
+
+
+def save_plan(shard_dir: Path, plan: Dict) -> None:
+    tmp = shard_dir / "plan.json.tmp"
+    tmp.write_text(json.dumps(plan, indent=2), encoding="utf-8")
+    os.replace(tmp, shard_dir / "plan.json")
+
+
+def merge_shards(shard_dir: Path, num_shards: int, out_path: Path) -> None:
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with out_path.open("wb") as out:
+        for shard_id in range(num_shards):
+            with (shard_dir / f"shard_{shard_id:05d}.conll").open("rb") as f:
+                shutil.copyfileobj(f, out, length=4 * 1024 * 1024)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model_dir", required=True)
+    ap.add_argument("--input", required=True)
+    ap.add_argument("--format", choices=["conll", "text"], default="conll")
+    ap.add_argument("--text_column", type=int, default=-1,
+                    help="For tab-separated text input (Leipzig: 1); -1 = whole line")
+    ap.add_argument("--out_conll", required=True)
+    ap.add_argument("--shard_dir", default="", help="Per-shard outputs (default: <out_conll>.shards)")
+    ap.add_argument("--workers", type=int, default=0, help="Default: usable cores // threads_per_worker")
+    ap.add_argument("--threads_per_worker", type=int, default=1)
+    ap.add_argument("--pin_cores", action="store_true", help="Give each worker its own cores (Linux)")
+    ap.add_argument("--shards_per_worker", type=int, default=4, help="More shards = better load balance")
+    ap.add_argument("--batch", type=int, default=32)
+    ap.add_argument("--chunk_size", type=int, default=1024, help="Sentences tagged per predictor call")
+    ap.add_argument("--max_len", type=int, default=256)
+    ap.add_argument("--window_stride", type=int, default=64,
+                    help="Subword overlap of sliding windows for sentences over --max_len (0 = truncate)")
+    ap.add_argument("--queue_depth", type=int, default=0,
+                    help="Pipeline tokenization/forward/writing inside each worker (adds 2 threads per worker; 0 = off)")
+    ap.add_argument("--keep_shards", action="store_true")
+    ap.add_argument("--resume", action="store_true",
+                    help="Keep finished shards from an earlier run with the same input and shard plan")
+    args = ap.parse_args()
+
+    input_path = Path(args.input)
+    out_path = Path(args.out_conll)
+    shard_dir = Path(args.shard_dir) if args.shard_dir else out_path.with_name(out_path.name + ".shards")
+    shard_dir.mkdir(parents=True, exist_ok=True)
+
+    threads = max(1, args.threads_per_worker)
+    workers = args.workers or max(1, len(os.sched_getaffinity(0)) // threads)
+
+    bounds = shard_boundaries(input_path, workers * max(1, args.shards_per_worker), args.format)
+    tasks = [(i, bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+    print(f"Input: {input_path} ({bounds[-1] / 1e6:.1f} MB) | shards: {len(tasks)} | workers: {workers}x{threads} threads")
+
+    # Shard files only appear once complete (.part + rename), so an existing one can be reused.
+    plan = {
+        "input_hash": file_fingerprint(input_path),
+        "format": args.format,
+        "text_column": args.text_column,
+        "model_dir": args.model_dir,
+        "max_len": args.max_len,
+        "window_stride": args.window_stride,
+        "bounds": bounds,
+    }
+    pending = tasks
+    if args.resume and load_plan(shard_dir, plan):
+        pending = [t for t in tasks if not (shard_dir / f"shard_{t[0]:05d}.conll").exists()]
+        print(f"Resuming: {len(tasks) - len(pending)} of {len(tasks)} shards already done")
+    else:
+        for stale in shard_dir.glob("shard_*"):
+            stale.unlink()
+    save_plan(shard_dir, plan)
+
+    options = {
+        "model_dir": args.model_dir,
+        "input": str(input_path),
+        "format": args.format,
+        "text_column": args.text_column,
+        "shard_dir": str(shard_dir),
+        "threads": threads,
+        "batch": args.batch,
+        "chunk_size": args.chunk_size,
+        "queue_depth": args.queue_depth,
+        "max_len": args.max_len,
+        "window_stride": args.window_stride,
+    }
+
+    # spawn: each worker starts clean instead of inheriting a forked torch runtime.
+    ctx = mp.get_context("spawn")
+    core_queue = None
+    if args.pin_cores:
+        sets = core_sets(workers, threads)
+        if sets:
+            core_queue = ctx.Queue()
+            for cores in sets:
+                core_queue.put(cores)
+
+    start = time.perf_counter()
+    total = 0
+    per_worker = {}
+    with ctx.Pool(workers, initializer=init_worker, initargs=(options, core_queue)) as pool:
+        for shard_id, count, elapsed, pid in pool.imap_unordered(run_shard, pending):
+            total += count
+            per_worker[pid] = per_worker.get(pid, 0) + count
+            rate = total / max(time.perf_counter() - start, 1e-9)
+            print(f"  shard {shard_id:05d}: {count} sentences in {elapsed:.1f}s | total {total} ({rate:.1f} sent/s)")
+
+    merge_shards(shard_dir, len(tasks), out_path)
+    elapsed = time.perf_counter() - start
+    if not args.keep_shards:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+
+    print(f"✅ Wrote: {out_path}")
+    print(f"Sentences: {total} | time: {elapsed:.1f}s | {total / max(elapsed, 1e-9):.1f} sentences/sec")
+    print("Per worker: " + ", ".join(f"{pid}={n}" for pid, n in sorted(per_worker.items())))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,37 +1,17 @@
 from __future__ import annotations
 
-import re
+import time
+from itertools import islice
 from pathlib import Path
 
 import torch
-from transformers import AutoModelForTokenClassification, AutoTokenizer
 
+from conll_stream import ResumableConllWriter, iter_conll, prefetch
+from inference_pipeline import format_pipeline_stats, run_pipelined
+from model_loader import load_token_classifier
+from prob_store import ProbabilityWriter
+from xlmr_inference import BatchPredictor
 
-def read_conll(path: Path):
-    sents = []
-    toks, labs = [], []
-    with path.open("r", encoding="utf-8", errors="replace") as f:
-        for line in f:
-            line = line.rstrip("\n")
-            if not line.strip():
-                if toks:
-                    sents.append((toks, labs))
-                    toks, labs = [], []
-                continue
-            p = re.split(r"\s+", line.strip())
-            if len(p) >= 2:
-                toks.append(p[0]); labs.append(p[-1])
-    if toks:
-        sents.append((toks, labs))
-    return sents
-
-def write_conll(tokens_list, pred_labels_list, out_path: Path):
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    with out_path.open("w", encoding="utf-8") as f:
-        for toks, labs in zip(tokens_list, pred_labels_list):
-            for t, y in zip(toks, labs):
-                f.write(f"{t}\t{y}\n")
-            f.write("\n")
 
 def main():
     import argparse
@@ -41,76 +21,95 @@ def main():
     ap.add_argument("--out_conll", required=True)
     ap.add_argument("--max_len", type=int, default=256)
     ap.add_argument("--batch", type=int, default=16)
+    ap.add_argument("--max_batch_tokens", type=int, default=0,
+                    help="Optional cap on batch_rows * longest_row subwords (0 = off)")
+    ap.add_argument("--window_stride", type=int, default=64,
+                    help="Subword overlap of sliding windows for sentences over --max_len (0 = truncate)")
+    ap.add_argument("--decode", choices=["viterbi", "argmax"], default="viterbi",
+                    help="BIO-constrained Viterbi (always valid BIO) or plain argmax")
+    ap.add_argument("--num_threads", type=int, default=0)
+    ap.add_argument("--chunk_size", type=int, default=2048,
+                    help="Sentences held in memory at once (length bucketing happens per chunk)")
+    ap.add_argument("--queue_depth", type=int, default=4,
+                    help="Padded batches queued between the tokenizer, forward and writer threads (0 = no pipeline)")
+    ap.add_argument("--checkpoint_every", type=int, default=2048,
+                    help="Sentences per committed output chunk / progress update")
+    ap.add_argument("--resume", action="store_true",
+                    help="Continue from <out_conll>.progress.json if input and settings match")
+    ap.add_argument("--unlabeled", action="store_true",
+                    help="Input may have token-only lines; tag them instead of skipping them")
+    ap.add_argument("--save_probs", default="",
+                    help="Prefix for float16 word probabilities aligned to the output (see prob_store.py)")
     args = ap.parse_args()
+    if args.save_probs and args.resume:
+        ap.error("--save_probs cannot be combined with --resume")
 
     model_dir = Path(args.model_dir)
     in_conll = Path(args.in_conll)
     out_conll = Path(args.out_conll)
 
-    tokenizer = AutoTokenizer.from_pretrained(model_dir)
-    model = AutoModelForTokenClassification.from_pretrained(model_dir)
-    model.eval()
+    params = {
+        "model_dir": str(model_dir),
+        "max_len": args.max_len,
+        "window_stride": args.window_stride,
+        "decode": args.decode,
+        "unlabeled": args.unlabeled,
+    }
+    writer = ResumableConllWriter(
+        out_conll, in_conll, chunk_size=args.checkpoint_every, resume=args.resume, params=params
+    )
+    if writer.complete:
+        writer.close()
+        print(f"✅ Already complete: {out_conll} ({writer.done} sentences)")
+        return
+    if writer.resumed_from:
+        print(f"Resuming after {writer.resumed_from} sentences")
 
     device = "cuda" if torch.cuda.is_available() else "cpu"
-    model.to(device)
-
-    id2label = model.config.id2label
-
-    sents = read_conll(in_conll)
-    tokens_list = [toks for toks, _ in sents]
-
-    pred_labels_list = []
-
-    # simple batching
-    for i in range(0, len(tokens_list), args.batch):
-        batch_tokens = tokens_list[i:i+args.batch]
-
-        enc = tokenizer(
-            batch_tokens,
-            is_split_into_words=True,
-            return_tensors="pt",
-            padding=True,
-            truncation=True,
-            max_length=args.max_len,
-        )
-
-        enc = {k: v.to(device) for k, v in enc.items()}
-
-        with torch.no_grad():
-            logits = model(**enc).logits  # [B, T, C]
-            pred_ids = logits.argmax(-1).cpu().tolist()
-
-        # Convert to token-level BIO (align words)
-        for b_idx, toks in enumerate(batch_tokens):
-            word_ids = enc["input_ids"].new_tensor([0]) 
-            
-            single = tokenizer(
-                toks,
-                is_split_into_words=True,
-                return_tensors="pt",
-                padding=False,
-                truncation=True,
-                max_length=args.max_len,
+    tokenizer, model = load_token_classifier(model_dir, num_threads=args.num_threads or None, device=device)
+
+    predictor = BatchPredictor(
+        model, tokenizer, batch_size=args.batch, max_len=args.max_len,
+        max_batch_tokens=args.max_batch_tokens, device=device,
+        window_stride=args.window_stride, decode=args.decode,
+    )
+
+    # Streams in chunks: reading, inference and writing never hold the whole file.
+    # Output is committed every --checkpoint_every sentences, so a killed run can --resume.
+    # With --queue_depth, tokenization and decoding/writing run on their own threads
+    # while this thread only runs forward passes.
+    start = time.perf_counter()
+    sentences = prefetch(islice(iter_conll(in_conll, unlabeled_label="O" if args.unlabeled else None), writer.resumed_from, None))
+    prob_writer = ProbabilityWriter(args.save_probs, predictor.id2label) if args.save_probs else None
+    pipeline_stats = None
+    with writer:
+        if args.queue_depth > 0:
+            pipeline_stats = run_pipelined(
+                predictor, sentences,
+                sink=lambda sent, labels: writer.write(sent[0], labels),
+                get_tokens=lambda s: s[0], chunk_size=args.chunk_size,
+                queue_depth=args.queue_depth, prob_writer=prob_writer,
             )
-            single_ids = single["input_ids"].to(device)
-            with torch.no_grad():
-                single_logits = model(input_ids=single_ids, attention_mask=single["attention_mask"].to(device)).logits
-            single_pred = single_logits.argmax(-1).squeeze(0).cpu().tolist()
-
-            word_ids = single.word_ids()
-            out_labs = ["O"] * len(toks)
-
-            seen_word = set()
-            for pos, widx in enumerate(word_ids):
-                if widx is None or widx in seen_word:
-                    continue
-                seen_word.add(widx)
-                out_labs[widx] = id2label[single_pred[pos]]
-
-            pred_labels_list.append(out_labs)
+        else:
+            for (toks, _), labels in predictor.predict_stream(
+                sentences, get_tokens=lambda s: s[0], chunk_size=args.chunk_size, prob_writer=prob_writer
+            ):
+                writer.write(toks, labels)
+    if prob_writer is not None:
+        prob_writer.close()
+        print("✅ Wrote probabilities:", prob_writer.probs_path)
+    elapsed = time.perf_counter() - start
+    stats = predictor.last_stats
+    tagged = writer.count - writer.resumed_from
 
-    write_conll(tokens_list, pred_labels_list, out_conll)
     print("✅ Wrote predictions to:", out_conll)
+    print(
+        f"Sentences: {writer.count} ({tagged} this run) | batches: {stats['batches']} | "
+        f"time: {elapsed:.2f}s | {tagged / max(elapsed, 1e-9):.1f} sentences/sec | "
+        f"padding: {stats['padding_ratio']:.1%} of subword slots | extra windows: {stats['extra_windows']}"
+    )
+    if pipeline_stats is not None:
+        print(format_pipeline_stats(pipeline_stats))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,95 @@
+"""
+Word-level label probabilities stored next to a CoNLL prediction file.
+
+Layout for a prefix such as preds/dev:
+    dev.probs.f16     float16 [total_words, num_labels], rows of all sentences back to back
+    dev.offsets.npy   int64 [num_sentences + 1]; sentence i is rows offsets[i]:offsets[i+1]
+    dev.meta.json     labels (column order), dtype, shape
+
+Sentence i is the i-th sentence of the CoNLL file, and row j in its slice is
+its j-th token. Words lost to truncation have an all-zero row.
+
+    store = ProbabilityStore("preds/dev")
+    probs = store[12]          # np.memmap view, no copy, no model run
+    conf = store.all().max(-1) # every word of the corpus
+"""
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+PROBS_SUFFIX = ".probs.f16"
+OFFSETS_SUFFIX = ".offsets.npy"
+META_SUFFIX = ".meta.json"
+
+
+def _paths(prefix: str | Path):
+    prefix = str(prefix)
+    return Path(prefix + PROBS_SUFFIX), Path(prefix + OFFSETS_SUFFIX), Path(prefix + META_SUFFIX)
+
+
+class ProbabilityWriter:
+    """Appends one [num_words, num_labels] block per sentence, in CoNLL order."""
+
+    def __init__(self, prefix: str | Path, id2label: Dict[int, str]):
+        self.probs_path, self.offsets_path, self.meta_path = _paths(prefix)
+        self.probs_path.parent.mkdir(parents=True, exist_ok=True)
+        self.labels = [id2label[i] for i in range(len(id2label))]
+        self._f = self.probs_path.open("wb")
+        self._offsets: List[int] = [0]
+
+    def write(self, probs: np.ndarray) -> None:
+        block = np.ascontiguousarray(probs, dtype=np.float16)
+        if block.ndim != 2 or block.shape[1] != len(self.labels):
+            raise ValueError(f"Expected [words, {len(self.labels)}] probabilities, got {block.shape}")
+        self._f.write(block.tobytes())
+        self._offsets.append(self._offsets[-1] + block.shape[0])
+
+    def close(self) -> None:
+        self._f.close()
+        np.save(self.offsets_path, np.asarray(self._offsets, dtype=np.int64))
+        meta = {
+            "labels": self.labels,
+            "dtype": "float16",
+            "shape": [self._offsets[-1], len(self.labels)],
+            "num_sentences": len(self._offsets) - 1,
+        }
+        self.meta_path.write_text(json.dumps(meta, indent=2), encoding="utf-8")
+
+    def __enter__(self) -> "ProbabilityWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class ProbabilityStore:
+    """Read-only, memory-mapped view of a ProbabilityWriter output."""
+
+    def __init__(self, prefix: str | Path):
+        probs_path, offsets_path, meta_path = _paths(prefix)
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        self.labels: List[str] = meta["labels"]
+        self.offsets = np.load(offsets_path, mmap_mode="r")
+        rows, cols = meta["shape"]
+        if rows:
+            self.probs = np.memmap(probs_path, dtype=np.float16, mode="r", shape=(rows, cols))
+        else:
+            self.probs = np.zeros((0, cols), dtype=np.float16)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> np.ndarray:
+        if i < 0:
+            i += len(self)
+        return self.probs[self.offsets[i]:self.offsets[i + 1]]
+
+    def all(self) -> np.ndarray:
+        return self.probs
+
+    def argmax_labels(self, i: int) -> List[str]:
+        return [self.labels[j] for j in self[i].argmax(-1)]
@@ -0,0 +1,367 @@
+"""
+Shared batched inference for the XLM-R token classifier.
+
+Used by predict_xlmr.py, predict_conll.py, predict.py, predict_checkpoint.py,
+eval_xlmr_conll_spanf1.py and make_model_reports.py:
+
+    predictor = BatchPredictor(model, tokenizer, batch_size=32, max_len=256)
+    labels = predictor.predict_labels(list_of_token_lists, repair=True)
+
+- one tokenizer pass over all sentences (word_ids kept, batches padded from it)
+- batches bucketed by subword length to minimise padding
+- first-subtoken logits gathered with one indexing op per batch
+- BIO-constrained Viterbi decoding over the whole chunk (bio_decoding.py),
+  so labels are always valid BIO; decode="argmax" keeps the plain argmax
+- optional word-level probabilities
+- optional sliding windows (window_stride > 0) so sentences longer than
+  max_len are tagged completely instead of truncated
+- per-chunk steps (prepare_chunk, pad_batch, forward, accumulate,
+  finish_chunk) that inference_pipeline.py runs on separate threads
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+import numpy as np
+import torch
+
+from bio_decoding import BIODecoder
+
+T = TypeVar("T")
+
+
+@dataclass
+class SentencePrediction:
+    labels: List[str]
+    probs: Optional[np.ndarray] = None  # [num_words, num_labels] softmax of the first subtoken
+
+
+# -----------------------------
+# Helpers
+# -----------------------------
+def repair_bio(labels: Sequence[str]) -> List[str]:
+    """
+    Make a label sequence valid BIO: an I- that does not continue an entity of
+    the same type becomes B-, malformed labels become O.
+    """
+    repaired = []
+    prev_tag, prev_type = "O", None
+    for lab in labels:
+        if lab == "O" or "-" not in lab:
+            repaired.append("O")
+            prev_tag, prev_type = "O", None
+            continue
+        tag, typ = lab.split("-", 1)
+        if tag == "B":
+            repaired.append(lab)
+            prev_tag, prev_type = "B", typ
+        elif tag == "I":
+            if prev_tag == "O" or prev_type != typ:
+                repaired.append(f"B-{typ}")
+                prev_tag, prev_type = "B", typ
+            else:
+                repaired.append(lab)
+                prev_tag, prev_type = "I", typ
+        else:
+            repaired.append("O")
+            prev_tag, prev_type = "O", None
+    return repaired
+
+
+def make_buckets(lengths: Sequence[int], batch_size: int, max_batch_tokens: int = 0) -> List[List[int]]:
+    """
+    Group sentence indices sorted by subword length into batches, so each batch
+    pads to a similar length. With max_batch_tokens a batch also closes once
+    batch_rows * longest_row would exceed the budget.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches, current = [], []
+    for i in order:
+        rows = len(current) + 1
+        if current and (rows > batch_size or (max_batch_tokens and rows * lengths[i] > max_batch_tokens)):
+            batches.append(current)
+            current = []
+        current.append(i)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def first_subtoken_positions(word_ids: Sequence[Optional[int]]):
+    """(positions, word indices) of the first subtoken of every word that survived truncation."""
+    positions, words = [], []
+    previous = None
+    for pos, wid in enumerate(word_ids):
+        if wid is None or wid == previous:
+            continue
+        positions.append(pos)
+        words.append(wid)
+        previous = wid
+    return positions, words
+
+
+def window_scores(word_ids: Sequence[Optional[int]], positions: Sequence[int]) -> List[int]:
+    """
+    Distance of each position to the nearest edge of the window content. When
+    windows overlap, a word takes the label from the window where it has the
+    most context on both sides.
+    """
+    content = [pos for pos, wid in enumerate(word_ids) if wid is not None]
+    if not content:
+        return [0] * len(positions)
+    first, last = content[0], content[-1]
+    return [min(pos - first, last - pos) for pos in positions]
+
+
+def normalize_id2label(id2label) -> Dict[int, str]:
+    # Configs saved as JSON can carry string keys.
+    return {int(k): v for k, v in id2label.items()}
+
+
+# -----------------------------
+# Predictor
+# -----------------------------
+@dataclass
+class ChunkState:
+    """Everything one chunk carries between the prepare, forward and finish steps."""
+    sentences: List[List[str]]
+    non_empty: List[int]
+    input_ids: List[List[int]] = field(default_factory=list)
+    attention: List[List[int]] = field(default_factory=list)
+    row_sentence: List[int] = field(default_factory=list)
+    firsts: List[Tuple[List[int], List[int]]] = field(default_factory=list)
+    scores: Optional[List[List[int]]] = None  # window_scores per row, only when windows exist
+    best: Dict[int, List[Tuple[int, int]]] = field(default_factory=dict)
+    word_scores: Dict[int, np.ndarray] = field(default_factory=dict)
+    seen: Dict[int, np.ndarray] = field(default_factory=dict)
+    batches: List[List[int]] = field(default_factory=list)
+    real_slots: int = 0
+    padded_slots: int = 0
+    extra_windows: int = 0
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "batches": len(self.batches),
+            "padding_ratio": 1 - self.real_slots / self.padded_slots if self.padded_slots else 0.0,
+            "real_slots": self.real_slots,
+            "padded_slots": self.padded_slots,
+            "extra_windows": self.extra_windows,
+        }
+
+
+class BatchPredictor:
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        batch_size: int = 32,
+        max_len: int = 256,
+        max_batch_tokens: int = 0,
+        device=None,
+        window_stride: int = 0,
+        decode: str = "viterbi",
+    ):
+        """
+        decode: "viterbi" (BIO-constrained, default) or "argmax".
+
+        window_stride > 0 splits sentences longer than max_len subwords into
+        windows of max_len that overlap by window_stride subwords. The windows
+        are batched with everything else and their word predictions merged.
+        With 0, long sentences are truncated and the lost words get "O".
+        """
+        if window_stride and not 0 < window_stride < max_len // 2:
+            raise ValueError(f"window_stride must be below max_len // 2 ({max_len // 2}), got {window_stride}")
+        if decode not in ("viterbi", "argmax"):
+            raise ValueError(f"decode must be 'viterbi' or 'argmax', got {decode!r}")
+        self.model = model
+        self.tokenizer = tokenizer
+        self.batch_size = batch_size
+        self.max_len = max_len
+        self.max_batch_tokens = max_batch_tokens
+        self.window_stride = window_stride
+        self.device = device if device is not None else next(model.parameters()).device
+        self.id2label = normalize_id2label(model.config.id2label)
+        self.decode = decode
+        self.decoder = BIODecoder(self.id2label) if decode == "viterbi" else None
+        self.last_stats: Dict[str, float] = {}
+
+    # Steps of one chunk: prepare_chunk -> (pad_batch -> forward -> accumulate)
+    # per batch -> finish_chunk. predict() runs them in sequence;
+    # inference_pipeline.run_pipelined overlaps them on separate threads.
+
+    def prepare_chunk(self, sentences: Sequence[Sequence[str]]) -> "ChunkState":
+        """Tokenize once and plan length-bucketed batches."""
+        sentences = [list(s) for s in sentences]
+        state = ChunkState(sentences=sentences, non_empty=[i for i, s in enumerate(sentences) if s])
+        if not state.non_empty:
+            return state
+
+        # With windows, one sentence can produce several rows.
+        window_args = {}
+        if self.window_stride:
+            window_args = {"stride": self.window_stride, "return_overflowing_tokens": True}
+        enc = self.tokenizer(
+            [sentences[i] for i in state.non_empty],
+            is_split_into_words=True,
+            truncation=True,
+            max_length=self.max_len,
+            **window_args,
+        )
+        state.input_ids = enc["input_ids"]
+        state.attention = enc["attention_mask"]
+        num_rows = len(state.input_ids)
+        state.row_sentence = enc["overflow_to_sample_mapping"] if self.window_stride else list(range(num_rows))
+        row_word_ids = [enc.word_ids(r) for r in range(num_rows)]
+        state.firsts = [first_subtoken_positions(word_ids) for word_ids in row_word_ids]
+        state.extra_windows = num_rows - len(state.non_empty)
+
+        # Merge rule: highest window_scores wins, ties go to the earlier window.
+        if state.extra_windows:
+            state.scores = [window_scores(row_word_ids[r], state.firsts[r][0]) for r in range(num_rows)]
+
+        # Word log-probabilities per sentence. Words never seen (truncated) keep
+        # a row that decodes to "O".
+        unseen = np.zeros(len(self.id2label), dtype=np.float32)
+        o_ids = [i for i, label in self.id2label.items() if label == "O"]
+        if o_ids:
+            unseen[:] = -1e4
+            unseen[o_ids[0]] = 0.0
+        state.word_scores = {i: np.tile(unseen, (len(sentences[i]), 1)) for i in state.non_empty}
+        state.seen = {i: np.zeros(len(sentences[i]), dtype=bool) for i in state.non_empty}
+
+        state.batches = make_buckets([len(ids) for ids in state.input_ids], self.batch_size, self.max_batch_tokens)
+        return state
+
+    def pad_batch(self, state: "ChunkState", batch: List[int]):
+        """Padded tensors plus the (row, position) of every first subtoken in the batch."""
+        padded = self.tokenizer.pad(
+            [{"input_ids": state.input_ids[j], "attention_mask": state.attention[j]} for j in batch],
+            return_tensors="pt",
+        )
+        state.padded_slots += padded["input_ids"].numel()
+        state.real_slots += int(padded["attention_mask"].sum())
+        rows = [row for row, j in enumerate(batch) for _ in state.firsts[j][0]]
+        cols = [pos for j in batch for pos in state.firsts[j][0]]
+        return padded, rows, cols
+
+    @torch.no_grad()
+    def forward(self, padded, rows: List[int], cols: List[int]) -> Optional[np.ndarray]:
+        """First-subtoken log-probabilities [words in batch, C]."""
+        if not cols:
+            return None
+        logits = self.model(**{k: v.to(self.device) for k, v in padded.items()}).logits  # [B, T, C]
+        index = torch.tensor([rows, cols], dtype=torch.long, device=logits.device)
+        gathered = logits[index[0], index[1]]  # [words in batch, C]
+        return torch.log_softmax(gathered.float(), dim=-1).cpu().numpy()
+
+    def accumulate(self, state: "ChunkState", batch: List[int], log_probs: Optional[np.ndarray]) -> None:
+        """Scatter a batch's word log-probabilities into its sentences."""
+        if log_probs is None:
+            return
+        offset = 0
+        for j in batch:
+            sent = state.non_empty[state.row_sentence[j]]
+            words = state.firsts[j][1]
+            if state.scores is None:
+                state.word_scores[sent][words] = log_probs[offset:offset + len(words)]
+                state.seen[sent][words] = True
+            else:
+                sent_best = state.best.setdefault(sent, [(-1, 0)] * len(state.sentences[sent]))
+                for k, wid in enumerate(words):
+                    score = (state.scores[j][k], -j)
+                    if score > sent_best[wid]:
+                        sent_best[wid] = score
+                        state.word_scores[sent][wid] = log_probs[offset + k]
+                        state.seen[sent][wid] = True
+            offset += len(words)
+
+    def finish_chunk(
+        self, state: "ChunkState", repair: bool = False, return_probs: bool = False
+    ) -> List[SentencePrediction]:
+        """Decode every sentence of the chunk and build the predictions."""
+        num_labels = len(self.id2label)
+        results = [
+            SentencePrediction(
+                labels=["O"] * len(s),
+                probs=np.zeros((len(s), num_labels), dtype=np.float32) if return_probs else None,
+            )
+            for s in state.sentences
+        ]
+        if self.decoder is not None:
+            label_ids = self.decoder.decode([state.word_scores[i] for i in state.non_empty])
+        else:
+            label_ids = [state.word_scores[i].argmax(-1) for i in state.non_empty]
+
+        for i, ids in zip(state.non_empty, label_ids):
+            result = results[i]
+            result.labels = [self.id2label[int(k)] for k in ids]
+            if repair and self.decoder is None:
+                result.labels = repair_bio(result.labels)
+            if return_probs:
+                seen = state.seen[i]
+                result.probs[seen] = np.exp(state.word_scores[i][seen])
+        return results
+
+    def predict(
+        self,
+        sentences: Sequence[Sequence[str]],
+        repair: bool = False,
+        return_probs: bool = False,
+    ) -> List[SentencePrediction]:
+        """
+        Word-level predictions in input order. Without windows, words lost to
+        truncation get "O" (and an all-zero probability row). repair only
+        matters for decode="argmax"; Viterbi output is already valid BIO.
+        """
+        state = self.prepare_chunk(sentences)
+        for batch in state.batches:
+            padded, rows, cols = self.pad_batch(state, batch)
+            self.accumulate(state, batch, self.forward(padded, rows, cols))
+        results = self.finish_chunk(state, repair=repair, return_probs=return_probs)
+        self.last_stats = state.stats()
+        return results
+
+    def predict_labels(self, sentences: Sequence[Sequence[str]], repair: bool = False) -> List[List[str]]:
+        return [p.labels for p in self.predict(sentences, repair=repair)]
+
+    def predict_stream(
+        self,
+        items: Iterable[T],
+        get_tokens: Callable[[T], Sequence[str]] = lambda item: item,
+        chunk_size: int = 1024,
+        repair: bool = False,
+        prob_writer=None,
+    ) -> Iterator[Tuple[T, List[str]]]:
+        """
+        Yield (item, labels) in input order while holding at most chunk_size
+        items; length bucketing happens inside each chunk. Afterwards
+        last_stats covers the whole stream.
+
+        With a prob_writer (prob_store.ProbabilityWriter), the word-level
+        probabilities of every item are appended to it in the same order.
+        """
+        totals = {"batches": 0, "real_slots": 0, "padded_slots": 0, "extra_windows": 0}
+        chunk: List[T] = []
+
+        def flush():
+            preds = self.predict(
+                [get_tokens(item) for item in chunk], repair=repair, return_probs=prob_writer is not None
+            )
+            for key in totals:
+                totals[key] += self.last_stats[key]
+            if prob_writer is not None:
+                for pred in preds:
+                    prob_writer.write(pred.probs)
+            return zip(chunk, [pred.labels for pred in preds])
+
+        for item in items:
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                yield from flush()
+                chunk = []
+        if chunk:
+            yield from flush()
+
+        padded = totals["padded_slots"]
+        self.last_stats = {**totals, "padding_ratio": 1 - totals["real_slots"] / padded if padded else 0.0}